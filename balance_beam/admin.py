@@ -1,15 +1,147 @@
+from datetime import date, datetime
+
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
-from django.db.models import QuerySet
+from django.db.models import Max, Min, QuerySet
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from rest_framework.request import Request
 
+from .conf import get_setting
 from .models import CustomCustomer, BalanceOperation
 from .common import admin_site
+from .pagination import EstimatedCountPaginator
+
+# Больше периодов за один вызов dates()/datetimes() не проверяется по
+# отдельности: дешевле один DISTINCT.
+MAX_PERIOD_PROBES = 100
+
+
+def _next_period(start: date, kind: str) -> date:
+    if kind == "year":
+        return start.replace(year=start.year + 1)
+    if kind == "month":
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    return date.fromordinal(start.toordinal() + 1)
+
+
+def _truncate(day: date, kind: str) -> date:
+    if kind == "year":
+        return day.replace(month=1, day=1)
+    if kind == "month":
+        return day.replace(day=1)
+    return day
+
+
+class IndexedDatesQuerySet(QuerySet):
+    """QuerySet whose dates() and datetimes() probe an index period by period.
+
+    Django's date_hierarchy lists the years, months or days that have rows
+    with SELECT DISTINCT date_trunc(...), which reads every matching row. Here
+    the bounds come from MIN/MAX and every candidate period is checked with
+    an EXISTS over a range of the indexed field, which reads one index entry
+    per period.
+    """
+
+    def dates(self, field_name, kind, order="ASC"):
+        periods = self._probe_periods(field_name, kind)
+        if periods is None:
+            return super().dates(field_name, kind, order)
+        return periods if order == "ASC" else periods[::-1]
+
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None):
+        periods = self._probe_periods(field_name, kind, tzinfo)
+        if periods is None:
+            return super().datetimes(field_name, kind, order, tzinfo)
+        starts = [self._to_datetime(start, tzinfo) for start in periods]
+        return starts if order == "ASC" else starts[::-1]
+
+    @staticmethod
+    def _to_datetime(day: date, tzinfo=None) -> datetime:
+        moment = datetime(day.year, day.month, day.day)
+        if settings.USE_TZ:
+            return timezone.make_aware(moment, tzinfo or timezone.get_current_timezone())
+        return moment
+
+    def _probe_periods(self, field_name: str, kind: str, tzinfo=None) -> list[date] | None:
+        """
+        Return the first days of the periods of `kind` that have rows, in ascending order.
+        Returns:
+            list[date] | None: The first days, or None if the periods can't
+            be probed and the default DISTINCT query must be used.
+        """
+        if kind not in ("year", "month", "day"):
+            return None
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        first, last = bounds["first"], bounds["last"]
+        if first is None:
+            return []
+        is_datetime = isinstance(first, datetime)
+        if is_datetime:
+            if settings.USE_TZ:
+                tzinfo = tzinfo or timezone.get_current_timezone()
+                first, last = timezone.localtime(first, tzinfo), timezone.localtime(last, tzinfo)
+            first, last = first.date(), last.date()
+        periods = []
+        start = _truncate(first, kind)
+        while start <= last:
+            periods.append((start, _next_period(start, kind)))
+            if len(periods) > MAX_PERIOD_PROBES:
+                return None
+            start = periods[-1][1]
+
+        def bound(day: date) -> date | datetime:
+            return self._to_datetime(day, tzinfo) if is_datetime else day
+
+        return [
+            start
+            for start, end in periods
+            if self.filter(
+                **{f"{field_name}__gte": bound(start), f"{field_name}__lt": bound(end)}
+            ).exists()
+        ]
+
+
+class PerformanceModeAdmin(admin.ModelAdmin):
+    """Changelist settings for tables with millions of rows.
+
+    With ADMIN_PERFORMANCE_MODE enabled the changelist counts rows by the
+    planner's estimate, doesn't count the unfiltered table at all, and
+    builds the date hierarchy from index probes.
+    """
+
+    @property
+    def show_full_result_count(self) -> bool:
+        return not get_setting("ADMIN_PERFORMANCE_MODE")
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        """Return the estimated-count paginator in performance mode."""
+        if not get_setting("ADMIN_PERFORMANCE_MODE"):
+            return super().get_paginator(
+                request, queryset, per_page, orphans, allow_empty_first_page
+            )
+        return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_queryset(self, request: Request) -> QuerySet:
+        """Return the queryset with index-probing date hierarchy in performance mode."""
+        queryset = super().get_queryset(request)
+        if not get_setting("ADMIN_PERFORMANCE_MODE"):
+            return queryset
+        indexed = IndexedDatesQuerySet(
+            model=queryset.model,
+            query=queryset.query.chain(),
+            using=queryset._db,
+            hints=queryset._hints,
+        )
+        indexed._prefetch_related_lookups = queryset._prefetch_related_lookups
+        return indexed
 
 
 @admin.register(CustomCustomer, site=admin_site)
-class CustomCustomerAdmin(DjangoUserAdmin):
+class CustomCustomerAdmin(PerformanceModeAdmin, DjangoUserAdmin):
     """Административный интерфейс модели User.
 
     В модели нет поля `username`. Поэтому здесь переопределяются все
@@ -61,24 +193,31 @@ class CustomCustomerAdmin(DjangoUserAdmin):
         "is_superuser",
         "is_active",
     ]
+    # icontains по этим полям обслуживают триграммные индексы на UPPER(поле),
+    # если при миграции было доступно расширение pg_trgm; без них поиск
+    # просматривает таблицу.
     search_fields = ["first_name", "last_name", "email", "phone"]
     ordering = ["-date_joined", "-id"]
 
 
 @admin.register(BalanceOperation, site=admin_site)
-class BalanceOperationAdmin(admin.ModelAdmin):
+class BalanceOperationAdmin(PerformanceModeAdmin):
     list_display = (
         "user",
-        "related_customer",
+        "counterparty",
         "amount",
         "operation_type",
         "timestamp",
         "success",
     )
     list_filter = ("operation_type", "timestamp", "success")
-    search_fields = ("user__email", "related_customer")
+    search_fields = ("user__email", "counterparty__email")
+    date_hierarchy = "timestamp"
+    # Пользователь выбирается поиском по CustomCustomerAdmin.search_fields,
+    # а не списком всех пользователей.
+    autocomplete_fields = ("user", "counterparty")
 
     def get_queryset(self, request: Request) -> QuerySet:
-        """Override for query optimization. Returns the queryset with 'user' relationship pre-fetched."""
+        """Override for query optimization. Returns the queryset with 'user' and 'counterparty' relationships pre-fetched."""
         queryset = super().get_queryset(request)
-        return queryset.select_related("user")
+        return queryset.select_related("user", "counterparty")
@@ -0,0 +1,296 @@
+"""Контроль допуска на эндпоинтах записи.
+
+При всплеске нагрузки переводы выстраиваются в очередь на блокировках
+строк пользователей и занимают соединения с базой, из-за чего замедляется и
+чтение. AdmissionControlMiddleware ограничивает число одновременных
+запросов записи в процессе и число запросов к одному счёту. Лишние запросы
+сразу получают 429 с Retry-After, а не ждут блокировку до таймаута.
+
+Общий предел подстраивается под время ожидания блокировок (AIMD): пока
+запросы, блокирующие строки, выполняются быстрее ADMISSION_TARGET_LOCK_WAIT_MS,
+предел растёт на единицу за окно запросов; когда медленнее - уменьшается
+в ADMISSION_BACKOFF раз. Представления записи отмечаются декоратором
+`admission_controlled`. Состояние своё у каждого процесса.
+"""
+import json
+import math
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections, router
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from rest_framework import status
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .conf import get_setting
+from .hot_accounts import hot_accounts
+from .metrics import LOCKING_SQL
+from .models import CustomCustomer
+from .recipients import cached_recipient
+
+# Вес нового наблюдения в скользящем среднем времени ожидания блокировок.
+_EWMA_WEIGHT = 0.2
+
+
+def admission_controlled(
+    view: Callable | None = None,
+    *,
+    recipient_fields: tuple[str, ...] = (),
+    legs_field: str | None = None,
+):
+    """Mark a write view for AdmissionControlMiddleware.
+
+    Apply it above @api_view. `recipient_fields` names the request body
+    fields that address a second account whose row the view locks, keys of
+    recipients.RECIPIENT_LOOKUPS; the first one given is resolved to the
+    account id from the recipient cache only, so a recipient the view
+    hasn't looked up yet isn't counted. `legs_field` names a list in the request body whose items
+    carry the `recipient_id` of every account the view locks.
+    """
+
+    def decorator(view: Callable) -> Callable:
+        view.admission_controlled = True
+        view.admission_recipient_fields = recipient_fields
+        view.admission_legs_field = legs_field
+        return view
+
+    return decorator(view) if view is not None else decorator
+
+
+@dataclass(eq=False)
+class Admission:
+    """A request admitted by the controller."""
+
+    account_ids: tuple[int, ...]
+    lock_wait: float = 0.0
+    locking_statements: int = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка выполнения запросов (connection.execute_wrapper): время
+        # запросов с блокировкой строк.
+        if not LOCKING_SQL.search(sql):
+            return execute(sql, params, many, context)
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.lock_wait += time.perf_counter() - began
+            self.locking_statements += 1
+
+
+class AdmissionController:
+    """Process-wide limits on concurrent write requests."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._accounts: Counter[int] = Counter()
+        self._limit: float | None = None
+        self._lock_wait = 0.0
+        self._admitted = 0
+        self._shed = {"global": 0, "account": 0}
+
+    def _current_limit(self) -> float:
+        if self._limit is None:
+            self._limit = float(get_setting("ADMISSION_MAX_IN_FLIGHT"))
+        return self._limit
+
+    def try_acquire(self, account_ids: tuple[int, ...]) -> Admission | None:
+        """
+        Admit a request touching the given accounts.
+        Returns:
+            Admission | None: The admission to release when the request ends,
+            or None if the request must be shed.
+        """
+        account_limit = get_setting("ADMISSION_ACCOUNT_CONCURRENCY")
+        with self._lock:
+            if self._in_flight >= int(self._current_limit()):
+                self._shed["global"] += 1
+                return None
+            if any(self._accounts[pk] >= account_limit for pk in account_ids):
+                self._shed["account"] += 1
+                return None
+            self._in_flight += 1
+            self._accounts.update(account_ids)
+            self._admitted += 1
+        return Admission(account_ids)
+
+    def release(self, admission: Admission) -> None:
+        """Release an admission and adapt the limit to its lock wait."""
+        with self._lock:
+            self._in_flight -= 1
+            self._accounts.subtract(admission.account_ids)
+            for pk in admission.account_ids:
+                if self._accounts[pk] <= 0:
+                    del self._accounts[pk]
+            if admission.locking_statements:
+                self._adapt(admission.lock_wait)
+
+    def _adapt(self, lock_wait: float) -> None:
+        self._lock_wait += _EWMA_WEIGHT * (lock_wait - self._lock_wait)
+        limit = self._current_limit()
+        if self._lock_wait * 1000 > get_setting("ADMISSION_TARGET_LOCK_WAIT_MS"):
+            limit = max(get_setting("ADMISSION_MIN_IN_FLIGHT"), limit * get_setting("ADMISSION_BACKOFF"))
+        else:
+            limit = min(get_setting("ADMISSION_MAX_IN_FLIGHT"), limit + 1 / limit)
+        self._limit = limit
+
+    def retry_after(self) -> int:
+        """Return the Retry-After delay in seconds for a shed request."""
+        return max(get_setting("ADMISSION_RETRY_AFTER"), math.ceil(self._lock_wait))
+
+    def stats(self) -> dict:
+        """Return the controller state, for monitoring."""
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "limit": int(self._current_limit()),
+                "lock_wait_ms": round(self._lock_wait * 1000, 2),
+                "admitted": self._admitted,
+                "shed_global": self._shed["global"],
+                "shed_account": self._shed["account"],
+            }
+
+
+admission_controller = AdmissionController()
+
+
+def _request_account_id(request: HttpRequest) -> int | None:
+    """Return the user id of a request's valid JWT, without querying the database."""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return None
+    try:
+        token = authentication.get_validated_token(raw_token)
+        return int(token[api_settings.USER_ID_CLAIM])
+    except (InvalidToken, TokenError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _request_data(request: HttpRequest) -> Any:
+    if request.content_type == "application/json":
+        return json.loads(request.body)
+    return request.POST
+
+
+def _body_recipient_id(request: HttpRequest, fields: tuple[str, ...]) -> int | None:
+    """Return the id of the recipient addressed by the request body, if it is cached."""
+    try:
+        data = _request_data(request)
+        field = next(field for field in fields if field in data)
+        # До допуска запрос не обращается к базе: email и телефон берутся из
+        # кеша, который заполняет сериализатор представления.
+        return cached_recipient(field, data[field])
+    except (StopIteration, AttributeError, TypeError, ValueError):
+        return None
+
+
+def _body_leg_recipient_ids(request: HttpRequest, legs_field: str) -> list[int]:
+    """Return the recipient ids of the legs in the request body; the view checks them."""
+    try:
+        return [int(leg["recipient_id"]) for leg in _request_data(request)[legs_field]]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return []
+
+
+def too_many_requests(retry_after: int) -> HttpResponse:
+    """Build the 429 response of a shed request, in the DRF error format."""
+    return JsonResponse(
+        {"detail": f"The service is overloaded. Retry in {retry_after} seconds."},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+class AdmissionControlMiddleware:
+    """Shed write requests beyond the per-process and per-account limits.
+
+    Only views marked with `admission_controlled` are limited, and only
+    while ADMISSION_CONTROL is enabled. Requests that would only queue
+    behind the row locks get 429 with Retry-After right away.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self._release(request)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        try:
+            return await self.get_response(request)
+        finally:
+            if getattr(request, "_admission", None) is not None:
+                # Соединение с базой своё у каждого потока: обёртку снимаем в
+                # том же потоке, где выполнялось представление.
+                await sync_to_async(self._release)(request)
+
+    @staticmethod
+    def _controlled(view_func: Callable) -> bool:
+        return getattr(view_func, "admission_controlled", False) and get_setting(
+            "ADMISSION_CONTROL"
+        )
+
+    @staticmethod
+    def _release(request: HttpRequest) -> None:
+        admission = getattr(request, "_admission", None)
+        if admission is None:
+            return
+        connection = connections[router.db_for_write(CustomCustomer)]
+        if admission in connection.execute_wrappers:
+            connection.execute_wrappers.remove(admission)
+        admission_controller.release(admission)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs) -> HttpResponse | None:
+        """Async version of `process_view`; other views don't leave the event loop."""
+        if not self._controlled(view_func):
+            return None
+        return await sync_to_async(self._admit)(request, view_func)
+
+    def process_view(self, request, view_func, view_args, view_kwargs) -> HttpResponse | None:
+        if not self._controlled(view_func):
+            return None
+        return self._admit(request, view_func)
+
+    def _admit(self, request: HttpRequest, view_func: Callable) -> HttpResponse | None:
+        account_ids = {}
+        user_id = _request_account_id(request)
+        if user_id is not None:
+            account_ids[user_id] = None
+        recipient_fields = getattr(view_func, "admission_recipient_fields", ())
+        if recipient_fields and user_id is not None:
+            recipient_id = _body_recipient_id(request, recipient_fields)
+            # Зачисление на горячий счёт не блокирует его строку.
+            if recipient_id is not None and not hot_accounts.slot_count(recipient_id):
+                account_ids[recipient_id] = None
+        legs_field = getattr(view_func, "admission_legs_field", None)
+        if legs_field is not None and user_id is not None:
+            # Пачка блокирует строки всех получателей, горячих тоже.
+            account_ids.update(dict.fromkeys(_body_leg_recipient_ids(request, legs_field)))
+
+        admission = admission_controller.try_acquire(tuple(account_ids))
+        if admission is None:
+            return too_many_requests(admission_controller.retry_after())
+        request._admission = admission
+        connections[router.db_for_write(CustomCustomer)].execute_wrappers.append(admission)
+        return None
@@ -1,11 +1,18 @@
 from rest_framework import routers
 from django.urls import path
+from .conf import get_setting
+from .views import asynchronous
 from .views import (
     increase_balance,
     check_balance,
     check_balance_in_rubles,
     get_operations_history,
+    export_operations,
+    get_statement,
     transfer_balance,
+    transfer_balance_async,
+    get_transfer_request,
+    transfer_balance_batch,
     UserViewSet,
 )
 
@@ -16,7 +23,19 @@ router = routers.DefaultRouter(trailing_slash=False)
 
 router.register("account", UserViewSet, basename="users")
 
-urlpatterns = router.urls + [
+account_urls = router.urls
+
+if get_setting("ASYNC_READ_VIEWS"):
+    check_balance = asynchronous.check_balance
+    check_balance_in_rubles = asynchronous.check_balance_in_rubles
+    get_operations_history = asynchronous.get_operations_history
+    export_operations = asynchronous.export_operations
+    get_statement = asynchronous.get_statement
+    account_urls = [
+        path("account/current", asynchronous.current_user, name="users-current")
+    ] + account_urls
+
+urlpatterns = account_urls + [
     path("increase_balance/", increase_balance, name="increase_balance"),
     path("check_balance/", check_balance, name="check_balance"),
     path(
@@ -27,5 +46,22 @@ urlpatterns = router.urls + [
     path(
         "get_operations_history/", get_operations_history, name="get_operations_history"
     ),
+    path("export_operations/", export_operations, name="export_operations"),
+    path("statement/", get_statement, name="statement"),
     path("transfer_balance/", transfer_balance, name="transfer_balance"),
+    path(
+        "transfer_balance/batch/",
+        transfer_balance_batch,
+        name="transfer_balance_batch",
+    ),
+    path(
+        "transfer_balance/async/",
+        transfer_balance_async,
+        name="transfer_balance_async",
+    ),
+    path(
+        "transfer_requests/<int:pk>/",
+        get_transfer_request,
+        name="transfer_request",
+    ),
 ]
@@ -0,0 +1,156 @@
+"""Аутентификация по JWT без чтения пользователя из базы.
+
+Для эндпоинтов чтения достаточно подписанных claims токена: id
+пользователя, is_active и версии токенов. Строка пользователя загружается
+только если представлению действительно нужны её поля. Отзыв токенов -
+увеличение версии пользователя; текущая версия кешируется.
+
+Эндпоинты записи используют VersionedJWTAuthentication: пользователь
+читается из базы, и версия токена сверяется с версией в его строке, поэтому
+отозванный токен отклоняется и на запись, без задержки кеша.
+"""
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpRequest
+from django.utils.translation import gettext_lazy as _
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+
+from .conf import get_setting
+from .models import CustomCustomer
+
+TOKEN_VERSION_CLAIM = "token_version"
+IS_ACTIVE_CLAIM = "is_active"
+
+
+def _cache():
+    return caches[get_setting("CACHE_ALIAS")]
+
+
+def _token_version_cache_key(user_id: int) -> str:
+    return f"balance_beam:token_version:{user_id}"
+
+
+def get_token_version(user_id: int) -> int | None:
+    """
+    Return the current token version of the user, from the cache if possible.
+    Returns:
+        int | None: The version, or None if the user doesn't exist.
+    """
+    key = _token_version_cache_key(user_id)
+    version = _cache().get(key)
+    if version is None:
+        version = (
+            CustomCustomer.objects.filter(pk=user_id)
+            .values_list("token_version", flat=True)
+            .first()
+        )
+        if version is not None:
+            _cache().set(key, version, get_setting("TOKEN_VERSION_CACHE_TIMEOUT"))
+    return version
+
+
+async def aget_token_version(user_id: int) -> int | None:
+    """Async version of `get_token_version`."""
+    key = _token_version_cache_key(user_id)
+    version = await _cache().aget(key)
+    if version is None:
+        version = await (
+            CustomCustomer.objects.filter(pk=user_id)
+            .values_list("token_version", flat=True)
+            .afirst()
+        )
+        if version is not None:
+            await _cache().aset(key, version, get_setting("TOKEN_VERSION_CACHE_TIMEOUT"))
+    return version
+
+
+def revoke_tokens(user: CustomCustomer) -> None:
+    """
+    Revoke all tokens issued to the user so far by bumping their token version.
+
+    Only the instance is changed: call it in the transaction that then saves
+    the user. The cached version is dropped once that transaction commits.
+    """
+    user.token_version += 1
+    transaction.on_commit(lambda: _cache().delete(_token_version_cache_key(user.pk)))
+
+
+def _check_token_version(token_version: int, current_version: int | None) -> None:
+    if token_version != current_version:
+        raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+
+
+class VersionedJWTAuthentication(JWTAuthentication):
+    """JWT authentication that loads the user and rejects revoked tokens.
+
+    Tokens issued without the version claim are accepted as before.
+    """
+
+    def get_user(self, validated_token: Token) -> CustomCustomer:
+        user = super().get_user(validated_token)
+        if TOKEN_VERSION_CLAIM in validated_token:
+            _check_token_version(validated_token[TOKEN_VERSION_CLAIM], user.token_version)
+        return user
+
+
+class StatelessJWTAuthentication(VersionedJWTAuthentication):
+    """JWT authentication that builds the user from the token claims.
+
+    Tokens issued without the version claim fall back to the regular
+    database lookup.
+    """
+
+    @staticmethod
+    def _claims(validated_token: Token) -> tuple[int, int]:
+        """Return the user id and token version claims of an active user's token."""
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if not validated_token.get(IS_ACTIVE_CLAIM, False):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user_id, validated_token[TOKEN_VERSION_CLAIM]
+
+    def get_user(self, validated_token: Token) -> CustomCustomer:
+        """Return a customer backed by the claims of the validated token."""
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        user_id, token_version = self._claims(validated_token)
+        _check_token_version(token_version, get_token_version(user_id))
+        return CustomCustomer.from_token_claims(user_id, True, token_version)
+
+    async def aget_user(self, validated_token: Token) -> CustomCustomer:
+        """Async version of `get_user`."""
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return await sync_to_async(super().get_user)(validated_token)
+        user_id, token_version = self._claims(validated_token)
+        _check_token_version(token_version, await aget_token_version(user_id))
+        return CustomCustomer.from_token_claims(user_id, True, token_version)
+
+    async def aauthenticate(self, request: HttpRequest) -> tuple[CustomCustomer, Token] | None:
+        """Async version of `authenticate` for plain Django async views."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+
+# Классы аутентификации для эндпоинтов чтения: настройки по умолчанию, где
+# JWTAuthentication заменён на StatelessJWTAuthentication.
+READ_AUTHENTICATION_CLASSES = [
+    StatelessJWTAuthentication
+    if auth_class in (JWTAuthentication, VersionedJWTAuthentication)
+    else auth_class
+    for auth_class in drf_settings.DEFAULT_AUTHENTICATION_CLASSES
+]
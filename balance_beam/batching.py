@@ -0,0 +1,200 @@
+"""Групповая фиксация (group commit) пополнений баланса.
+
+Параллельные запросы на пополнение собираются в пачку на несколько
+миллисекунд или до заданного размера и применяются одной транзакцией:
+пополнения одного счёта складываются в один UPDATE, записи журнала
+вставляются одним bulk_create. Каждый вызывающий получает свою операцию.
+
+Пачка всегда применяется условным UPDATE, как при EXECUTION_STRATEGY
+"conditional", какая бы стратегия ни была настроена: пополнению не нужна
+проверка баланса, а один UPDATE на счёт без предварительной блокировки
+строки - то, ради чего пополнения и собираются в пачку.
+"""
+import math
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from django.db import close_old_connections, transaction
+
+from . import metrics, outbox, rollups
+from .conf import get_setting
+from .models import BalanceOperation, CustomCustomer
+from .services import BalanceService
+
+
+@dataclass
+class _PendingIncrease:
+    user: CustomCustomer
+    amount_in_kopecks: int
+    sender: CustomCustomer | None
+    future: Future = field(default_factory=Future)
+
+
+class IncreaseBalanceBatcher:
+    """Collects concurrent balance increases and applies them in one transaction.
+
+    A single background thread drains the queue: it waits for the first
+    request, then gathers more for `window_ms` milliseconds or until
+    `max_size` requests are collected.
+    """
+
+    HISTOGRAM_BUCKETS = metrics.BATCH_SIZE_BUCKETS
+
+    def __init__(self, window_ms: float, max_size: int) -> None:
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._queue: queue.SimpleQueue[_PendingIncrease] = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._histogram = dict.fromkeys(self.HISTOGRAM_BUCKETS, 0)
+
+    def submit(
+        self,
+        user: CustomCustomer,
+        amount_in_kopecks: int,
+        sender: CustomCustomer | None = None,
+        timeout: float | None = None,
+    ) -> BalanceOperation:
+        """
+        Queue an increase and wait until the batch containing it is committed.
+        Args:
+            user (CustomCustomer): The user whose balance will be increased.
+            amount_in_kopecks (int): The amount to increase the balance, in kopecks.
+            sender (CustomCustomer, optional): The sender of the increase.
+            timeout (float, optional): Seconds to wait for the batch.
+        Returns:
+            BalanceOperation: The operation created for this request.
+        """
+        self._ensure_started()
+        pending = _PendingIncrease(user, amount_in_kopecks, sender)
+        self._queue.put(pending)
+        return pending.future.result(timeout)
+
+    def batch_size_histogram(self) -> dict[str, int]:
+        """Return the number of applied batches per size bucket (upper bound inclusive)."""
+        with self._lock:
+            return {
+                ("+Inf" if bound == math.inf else str(bound)): count
+                for bound, count in self._histogram.items()
+            }
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="increase-balance-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self) -> list[_PendingIncrease]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _record_batch_size(self, size: int) -> None:
+        with self._lock:
+            for bound in self.HISTOGRAM_BUCKETS:
+                if size <= bound:
+                    self._histogram[bound] += 1
+                    break
+        if metrics.enabled():
+            metrics.registry.observe("balance_beam_increase_batch_size", {}, size)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            self._record_batch_size(len(batch))
+            close_old_connections()
+            try:
+                self._apply(batch)
+            except Exception as error:  # pylint: disable=broad-except
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(error)
+
+    @staticmethod
+    @metrics.instrumented(name="increase_batch")
+    def _apply(batch: list[_PendingIncrease]) -> None:
+        """Apply a batch in one transaction and resolve the callers' futures after commit."""
+        totals: dict[int, int] = defaultdict(int)
+        for pending in batch:
+            totals[pending.user.pk] += pending.amount_in_kopecks
+
+        accepted: list[_PendingIncrease] = []
+        operations: list[BalanceOperation] = []
+        with transaction.atomic():
+            updated = {
+                customer_id: BalanceService._apply_balance_delta(customer_id, totals[customer_id])
+                for customer_id in sorted(totals)
+            }
+            for pending in batch:
+                if updated[pending.user.pk] is None:
+                    pending.future.set_exception(
+                        CustomCustomer.DoesNotExist(
+                            f"Customer with id {pending.user.pk} does not exist."
+                        )
+                    )
+                    continue
+                accepted.append(pending)
+                operations.append(
+                    BalanceOperation(
+                        user=pending.user,
+                        amount=pending.amount_in_kopecks,
+                        operation_type="INCREASE",
+                        related_customer=BalanceService._related_customer_label(
+                            pending.sender
+                        ),
+                        counterparty=pending.sender,
+                    )
+                )
+            BalanceOperation.objects.bulk_create(operations)
+            rollups.record_operations(operations)
+            outbox.record_operations(operations)
+            BalanceService._on_accounts_changed(
+                *{operation.user_id for operation in operations}
+            )
+
+        for pending, operation in zip(accepted, operations):
+            pending.future.set_result(operation)
+
+
+_batcher: IncreaseBalanceBatcher | None = None
+_batcher_lock = threading.Lock()
+
+
+def get_increase_batcher() -> IncreaseBalanceBatcher:
+    """Return the process-wide batcher, creating it from the settings on first use."""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = IncreaseBalanceBatcher(
+                window_ms=get_setting("INCREASE_BATCH_WINDOW_MS"),
+                max_size=get_setting("INCREASE_BATCH_MAX_SIZE"),
+            )
+        return _batcher
+
+
+def increase_balance(
+    user: CustomCustomer, amount_in_kopecks: int, sender: CustomCustomer | None = None
+) -> BalanceOperation:
+    """
+    Increase the balance through the group-commit batcher when it is enabled.
+
+    Falls back to BalanceService.increase_balance when batching is disabled or
+    the caller is already inside a transaction, which the batch can't join.
+    """
+    if not get_setting("INCREASE_BATCHING") or transaction.get_connection().in_atomic_block:
+        return BalanceService.increase_balance(user, amount_in_kopecks, sender=sender)
+    return get_increase_batcher().submit(user, amount_in_kopecks, sender=sender)
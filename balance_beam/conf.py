@@ -0,0 +1,160 @@
+"""Настройки приложения balance_beam.
+
+Значения по умолчанию переопределяются словарём BALANCE_BEAM в настройках
+проекта. Настройки читаются при каждом обращении, поэтому работают и с
+override_settings в тестах.
+"""
+from typing import Any
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+DEFAULTS = {
+    # Стратегия выполнения операций с балансом в BalanceService:
+    # "pessimistic" - SELECT ... FOR UPDATE и сохранение строки пользователя;
+    # "conditional" - один UPDATE ... WHERE balance >= x RETURNING balance.
+    "EXECUTION_STRATEGY": "pessimistic",
+    # Групповая фиксация пополнений (balance_beam/batching.py): окно сбора
+    # пачки в миллисекундах и максимальный размер пачки. Пачка применяется
+    # условным UPDATE при любой EXECUTION_STRATEGY.
+    "INCREASE_BATCHING": False,
+    "INCREASE_BATCH_WINDOW_MS": 5,
+    "INCREASE_BATCH_MAX_SIZE": 100,
+    # Секционирование операций (manage.py partition_operations): на сколько
+    # месяцев вперёд создавать секции и сколько прошлых месяцев хранить
+    # подключёнными (None - не отключать).
+    "OPERATIONS_PARTITIONS_AHEAD": 3,
+    "OPERATIONS_PARTITIONS_RETAIN": None,
+    # Сколько секунд кешируется версия токенов пользователя. После отзыва
+    # токенов другие процессы видят новую версию не позже чем через это время,
+    # если кеш не общий.
+    "TOKEN_VERSION_CACHE_TIMEOUT": 60,
+    # Алиас кеша из CACHES для данных приложения.
+    "CACHE_ALIAS": "default",
+    # Кеш снимков счёта (balance_beam/snapshots.py): время жизни снимка и
+    # возраст в секундах, после которого попадание считается устаревшим.
+    "ACCOUNT_SNAPSHOT_CACHE": False,
+    "ACCOUNT_SNAPSHOT_TIMEOUT": 300,
+    "ACCOUNT_SNAPSHOT_STALE_AFTER": 5,
+    # Сколько секунд хранится ответ на запрос с Idempotency-Key.
+    "IDEMPOTENCY_KEY_TTL": 24 * 60 * 60,
+    # Асинхронные версии эндпоинтов чтения (balance_beam/views/asynchronous.py)
+    # вместо синхронных. Имеет смысл при запуске под ASGI.
+    "ASYNC_READ_VIEWS": False,
+    # Алиасы реплик из DATABASES для чтения баланса, истории и профиля
+    # (balance_beam/routers.py). Пустой список - всё читается с основной базы.
+    "READ_REPLICAS": [],
+    # Сколько секунд после записи пользователь читает с основной базы.
+    "READ_YOUR_WRITES_WINDOW": 5,
+    # Максимальное отставание реплики в секундах; при большем чтение идёт
+    # с основной базы. Отставание проверяется не чаще раза в интервал.
+    "REPLICA_MAX_LAG": 2,
+    "REPLICA_LAG_CHECK_INTERVAL": 1,
+    # Горячие счета (balance_beam/hot_accounts.py): как часто в секундах
+    # процесс перечитывает список горячих счетов и сколько слотов баланса
+    # может быть у одного счёта.
+    "HOT_ACCOUNTS_REFRESH_INTERVAL": 10,
+    "HOT_ACCOUNT_MAX_SLOTS": 64,
+    # Сверка балансов (manage.py reconcile_balances): число id пользователей
+    # в одной задаче и отставание в секундах водяной отметки контрольных точек
+    # от текущего времени. Отставание должно быть больше самой долгой
+    # транзакции записи, иначе её операции не попадут в контрольную точку.
+    "RECONCILE_RANGE_SIZE": 10000,
+    "RECONCILE_WATERMARK_LAG": 300,
+    # Режим производительности админки: число строк списка по оценке
+    # планировщика и date_hierarchy по индексу (balance_beam/admin.py).
+    # При оценке меньше порога строки считаются точным COUNT(*).
+    "ADMIN_PERFORMANCE_MODE": False,
+    "ADMIN_EXACT_COUNT_THRESHOLD": 10000,
+    # Выгрузка истории операций (balance_beam/exports.py): сколько строк
+    # читается из серверного курсора за раз и при каком размере в байтах
+    # буфер отдаётся клиенту.
+    "EXPORT_CHUNK_SIZE": 2000,
+    "EXPORT_BUFFER_SIZE": 64 * 1024,
+    # Итоги операций для выписок (balance_beam/rollups.py): копить изменения
+    # итогов всех счетов в OperationRollupDelta, а не обновлять итоги в
+    # транзакции операции (для горячих счетов так всегда); сколько изменений
+    # apply_rollup_deltas переносит за одну транзакцию; сколько id
+    # пользователей rebuild_rollups пересчитывает под одной блокировкой.
+    "ROLLUPS_DEFERRED": False,
+    "ROLLUP_APPLY_BATCH_SIZE": 5000,
+    "ROLLUP_REBUILD_RANGE_SIZE": 1000,
+    # Контроль допуска на эндпоинтах записи (balance_beam/admission.py):
+    # предел одновременных запросов записи в процессе подстраивается между
+    # ADMISSION_MIN_IN_FLIGHT и ADMISSION_MAX_IN_FLIGHT по времени ожидания
+    # блокировок строк (цель - ADMISSION_TARGET_LOCK_WAIT_MS, при превышении
+    # предел умножается на ADMISSION_BACKOFF); к одному счёту допускается не
+    # больше ADMISSION_ACCOUNT_CONCURRENCY запросов. Лишние получают 429 с
+    # Retry-After не меньше ADMISSION_RETRY_AFTER секунд.
+    "ADMISSION_CONTROL": False,
+    "ADMISSION_MAX_IN_FLIGHT": 32,
+    "ADMISSION_MIN_IN_FLIGHT": 4,
+    "ADMISSION_ACCOUNT_CONCURRENCY": 4,
+    "ADMISSION_TARGET_LOCK_WAIT_MS": 50,
+    "ADMISSION_BACKOFF": 0.9,
+    "ADMISSION_RETRY_AFTER": 1,
+    # Метрики для Prometheus (balance_beam/metrics.py, эндпоинт /metrics):
+    # включить измерения; каталог, через который процессы складывают свои
+    # метрики (None - только метрики ответившего процесса), и как часто
+    # процесс туда пишет, в секундах; токен, который должен передать
+    # Prometheus (None - без проверки).
+    "METRICS_ENABLED": False,
+    "METRICS_DIR": None,
+    "METRICS_FLUSH_INTERVAL": 1.0,
+    "METRICS_TOKEN": None,
+    # Загрузка пользователей (balance_beam/imports.py): сколько записей
+    # источника вставляется одной транзакцией.
+    "IMPORT_CHUNK_SIZE": 1000,
+    # Кодирование и разбор JSON в API (balance_beam/fast_json.py): "orjson"
+    # (если не установлен - стандартный модуль) или "json".
+    "JSON_BACKEND": "orjson",
+    # Сколько секунд кешируется id получателя перевода, найденного по id,
+    # email или телефону (balance_beam/recipients.py); 0 - не кешировать.
+    "RECIPIENT_CACHE_TIMEOUT": 300,
+    # Асинхронные переводы (balance_beam/transfer_queue.py, команда
+    # process_transfers): включить эндпоинт transfer_balance/async/; сколько
+    # запросов воркер берёт за раз; пауза опроса пустой очереди и аренда
+    # взятой пачки, в секундах; сколько раз исполняется запрос, прерванный
+    # ошибкой базы (взаимоблокировка и т.п.), и задержка первого повтора в
+    # секундах, дальше она удваивается.
+    "ASYNC_TRANSFERS": False,
+    "TRANSFER_QUEUE_BATCH_SIZE": 100,
+    "TRANSFER_QUEUE_POLL_INTERVAL": 0.5,
+    "TRANSFER_QUEUE_LEASE": 60,
+    "TRANSFER_QUEUE_MAX_ATTEMPTS": 5,
+    "TRANSFER_QUEUE_RETRY_DELAY": 1,
+    # Outbox событий операций (balance_beam/outbox.py, команда
+    # dispatch_outbox): записывать события; получатель (путь к классу из
+    # balance_beam/sinks.py или своему модулю) и аргументы его конструктора;
+    # на сколько частей по счетам делятся события (по диспетчеру на часть);
+    # наибольшая пачка доставки; пауза опроса пустого outbox, задержка
+    # первого повтора после отказа получателя и её предел, в секундах.
+    "OUTBOX_ENABLED": False,
+    "OUTBOX_SINK": "balance_beam.sinks.FileSink",
+    "OUTBOX_SINK_OPTIONS": {"path": "outbox-events.ndjson"},
+    "OUTBOX_PARTITIONS": 1,
+    "OUTBOX_BATCH_SIZE": 1000,
+    "OUTBOX_POLL_INTERVAL": 0.5,
+    "OUTBOX_RETRY_DELAY": 1,
+    "OUTBOX_MAX_RETRY_DELAY": 60,
+}
+
+EXECUTION_STRATEGIES = ("pessimistic", "conditional")
+
+
+def get_setting(name: str) -> Any:
+    """Return the balance_beam setting `name`, falling back to its default."""
+    return getattr(settings, "BALANCE_BEAM", {}).get(name, DEFAULTS[name])
+
+
+def get_execution_strategy() -> str:
+    """Return the configured BalanceService execution strategy.
+    Raises:
+        ImproperlyConfigured: If the strategy is unknown.
+    """
+    strategy = get_setting("EXECUTION_STRATEGY")
+    if strategy not in EXECUTION_STRATEGIES:
+        raise ImproperlyConfigured(
+            f"BALANCE_BEAM['EXECUTION_STRATEGY'] must be one of {EXECUTION_STRATEGIES}, got {strategy!r}"
+        )
+    return strategy
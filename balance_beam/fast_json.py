@@ -0,0 +1,82 @@
+"""Быстрое кодирование и разбор JSON для API.
+
+FastJSONRenderer и FastJSONParser используют orjson, если он установлен и
+выбран в JSON_BACKEND, и стандартный модуль json (как JSONRenderer и
+JSONParser DRF) в остальных случаях. Результат тот же байт в байт: типы,
+которые orjson кодирует иначе (даты, dataclass), передаются кодировщику DRF,
+\\u2028 и \\u2029 экранируются, как в DRF, а всё, что orjson не принимает,
+обрабатывается стандартным путём. Числа с плавающей точкой orjson пишет в
+другом формате (1e16, а не 1e+16), поэтому рендерер подключается только к
+представлениям, которые их не отдают (история операций). Парсер подключён
+ко всем представлениям в настройках DRF.
+"""
+import codecs
+import io
+from typing import Any
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .conf import get_setting
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+JSON_BACKENDS = ("orjson", "json")
+
+
+def use_orjson() -> bool:
+    """Check whether orjson is selected and installed.
+    Raises:
+        ImproperlyConfigured: If the backend is unknown.
+    """
+    backend = get_setting("JSON_BACKEND")
+    if backend not in JSON_BACKENDS:
+        raise ImproperlyConfigured(
+            f"BALANCE_BEAM['JSON_BACKEND'] must be one of {JSON_BACKENDS}, got {backend!r}"
+        )
+    return backend == "orjson" and orjson is not None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer encoding with orjson; the output is byte-identical for data without floats."""
+
+    def render(self, data: Any, accepted_media_type: str | None = None, renderer_context: dict | None = None) -> bytes:
+        if (
+            data is None
+            or not use_orjson()
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except TypeError:
+            # Ключи не строки, слишком большие целые и т.п.
+            return super().render(data, accepted_media_type, renderer_context)
+        return rendered.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser decoding UTF-8 bodies with orjson; anything orjson rejects is parsed as by DRF."""
+
+    def parse(self, stream, media_type: str | None = None, parser_context: dict | None = None) -> Any:
+        encoding = (parser_context or {}).get("encoding", settings.DEFAULT_CHARSET)
+        if not use_orjson() or codecs.lookup(encoding).name != "utf-8":
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # NaN, целые больше 64 бит, одиночные суррогаты: разбирает
+            # стандартный модуль, он же сообщает об ошибке.
+            return super().parse(io.BytesIO(body), media_type, parser_context)
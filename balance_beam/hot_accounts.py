@@ -0,0 +1,148 @@
+"""Горячие счета с балансом, разбитым на слоты.
+
+На счёт мерчанта одновременно приходят тысячи зачислений, и все они ждут
+блокировку одной строки CustomCustomer. У горячего счёта баланс хранится в
+поле `balance` и в `balance_slot_count` строках BalanceSlot: зачисление
+увеличивает случайный слот, не трогая строку пользователя, а списание
+переносит деньги из слотов в основной баланс, обходя слоты по порядку.
+Команда consolidate_balance_slots периодически сводит слоты в основной
+баланс.
+"""
+import random
+import threading
+import time
+
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from .conf import get_setting
+from .models import BalanceSlot, CustomCustomer
+
+
+class HotAccountRegistry:
+    """Process-local map of hot accounts to their slot counts.
+
+    It is reloaded every HOT_ACCOUNTS_REFRESH_INTERVAL seconds with one
+    query, so regular accounts don't pay for the check. A stale entry only
+    sends a credit to the main balance row or to a slot that no longer
+    exists, in which case the credit falls back to the main row too.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._slot_counts: dict[int, int] = {}
+        self._loaded_at = float("-inf")
+
+    def slot_count(self, customer_id: int) -> int:
+        """Return the number of balance slots of the account, 0 for a regular one."""
+        if time.monotonic() - self._loaded_at >= get_setting("HOT_ACCOUNTS_REFRESH_INTERVAL"):
+            self.refresh()
+        return self._slot_counts.get(customer_id, 0)
+
+    def refresh(self) -> None:
+        """Reload the hot accounts from the database."""
+        slot_counts = dict(
+            CustomCustomer.objects.filter(balance_slot_count__gt=0).values_list(
+                "id", "balance_slot_count"
+            )
+        )
+        with self._lock:
+            self._slot_counts = slot_counts
+            self._loaded_at = time.monotonic()
+
+
+hot_accounts = HotAccountRegistry()
+
+
+def credit_slot(customer_id: int, amount_in_kopecks: int) -> str | None:
+    """
+    Add money to a random balance slot of a hot account.
+
+    Only the slot row is locked, so concurrent credits to the account wait
+    for each other only when they pick the same slot.
+    Returns:
+        str | None: The email of the customer, or None if the account has no
+        slots and the credit must go to the main balance.
+    """
+    slot_count = hot_accounts.slot_count(customer_id)
+    if not slot_count:
+        return None
+    connection = connections[router.db_for_write(BalanceSlot)]
+    slots = connection.ops.quote_name(BalanceSlot._meta.db_table)
+    customers = connection.ops.quote_name(CustomCustomer._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {slots} AS slot SET balance = slot.balance + %s "
+            f"FROM {customers} AS customer "
+            "WHERE slot.customer_id = %s AND slot.slot = %s AND customer.id = slot.customer_id "
+            "RETURNING customer.email",
+            [amount_in_kopecks, customer_id, random.randrange(slot_count)],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def sweep_slots(customer_id: int, amount_in_kopecks: int | None = None) -> int:
+    """
+    Move money from the balance slots to the main balance of the account.
+
+    Slots are taken in slot order. Slots locked by a credit in progress are
+    skipped instead of waited for, so a debit never deadlocks with credits.
+    Args:
+        customer_id (int): The primary key of the customer.
+        amount_in_kopecks (int, optional): The amount to move; everything is
+            moved if omitted.
+    Returns:
+        int: The amount moved, in kopecks. It may be less than requested.
+    """
+    with transaction.atomic():
+        moved = 0
+        swept = []
+        for slot in (
+            BalanceSlot.objects.select_for_update(skip_locked=True)
+            .filter(customer_id=customer_id, balance__gt=0)
+            .order_by("slot")
+        ):
+            if amount_in_kopecks is not None and moved >= amount_in_kopecks:
+                break
+            take = slot.balance
+            if amount_in_kopecks is not None:
+                take = min(take, amount_in_kopecks - moved)
+            slot.balance -= take
+            moved += take
+            swept.append(slot)
+        if moved:
+            BalanceSlot.objects.bulk_update(swept, ["balance"])
+            CustomCustomer.objects.filter(pk=customer_id).update(
+                balance=F("balance") + moved
+            )
+    return moved
+
+
+def set_slot_count(customer_id: int, slot_count: int) -> None:
+    """
+    Turn the account into a hot one with `slot_count` slots, or back into a
+    regular one with 0. Money of the removed slots moves to the main balance.
+    Raises:
+        ValueError: If the slot count exceeds HOT_ACCOUNT_MAX_SLOTS.
+        CustomCustomer.DoesNotExist: If the customer doesn't exist.
+    """
+    max_slots = get_setting("HOT_ACCOUNT_MAX_SLOTS")
+    if not 0 <= slot_count <= max_slots:
+        raise ValueError(f"The slot count must be between 0 and {max_slots}.")
+    with transaction.atomic():
+        customer = CustomCustomer.objects.select_for_update().get(pk=customer_id)
+        removed = list(
+            BalanceSlot.objects.select_for_update().filter(
+                customer_id=customer_id, slot__gte=slot_count
+            )
+        )
+        customer.balance += sum(slot.balance for slot in removed)
+        BalanceSlot.objects.filter(pk__in=[slot.pk for slot in removed]).delete()
+        BalanceSlot.objects.bulk_create(
+            [BalanceSlot(customer_id=customer_id, slot=slot) for slot in range(slot_count)],
+            ignore_conflicts=True,
+        )
+        customer.balance_slot_count = slot_count
+        customer.save(update_fields=["balance", "balance_slot_count"])
+    hot_accounts.refresh()
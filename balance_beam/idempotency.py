@@ -0,0 +1,102 @@
+"""Идемпотентность операций записи по заголовку Idempotency-Key.
+
+Первая попытка вставляет запись ключа и выполняет представление в той же
+транзакции. Параллельный дубликат ждёт на уникальном индексе (user, key),
+пока первая попытка не зафиксируется, и затем получает её сохранённый
+ответ. Если первая попытка откатилась, дубликат выполняется сам. Повтор не
+обращается к строке пользователя и не берёт её блокировку.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from typing import Any
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .conf import get_setting
+from .models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = IdempotencyRecord._meta.get_field("key").max_length
+# Заголовки ответа, которые сохраняются вместе с телом и отдаются при повторе.
+STORED_HEADERS = ("Location",)
+
+
+def request_fingerprint(request: Request) -> str:
+    """Hash the method, path and body of the request."""
+    payload = json.dumps(request.data, sort_keys=True, default=str)
+    raw = f"{request.method} {request.path}\n{payload}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _replay(record: IdempotencyRecord, fingerprint: str) -> Response:
+    if record.fingerprint != fingerprint:
+        return Response(
+            {"error": f"{IDEMPOTENCY_HEADER} was already used with a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(
+        record.response_body,
+        status=record.response_status,
+        headers={**(record.response_headers or {}), REPLAYED_HEADER: "true"},
+    )
+
+
+def idempotent(view):
+    """Make a DRF function view idempotent for requests with an Idempotency-Key header.
+
+    Responses with 5xx status aren't stored, so such requests can be retried.
+    """
+
+    @wraps(view)
+    def wrapper(request: Request, *args: Any, **kwargs: Any) -> Response:
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters long."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        fingerprint = request_fingerprint(request)
+
+        while True:
+            with transaction.atomic():
+                record = IdempotencyRecord.objects.filter(user=request.user, key=key).first()
+                if record is not None and record.expires_at > timezone.now():
+                    return _replay(record, fingerprint)
+                try:
+                    with transaction.atomic():
+                        if record is not None:
+                            record.delete()
+                        record = IdempotencyRecord.objects.create(
+                            user=request.user,
+                            key=key,
+                            fingerprint=fingerprint,
+                            expires_at=timezone.now()
+                            + timedelta(seconds=get_setting("IDEMPOTENCY_KEY_TTL")),
+                        )
+                except IntegrityError:
+                    # Параллельный запрос с тем же ключом зафиксировался первым:
+                    # читаем его ответ в новой транзакции.
+                    continue
+
+                response = view(request, *args, **kwargs)
+                if response.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+                    transaction.set_rollback(True)
+                    return response
+                record.response_status = response.status_code
+                record.response_body = response.data
+                record.response_headers = {
+                    name: response[name] for name in STORED_HEADERS if response.has_header(name)
+                }
+                record.save(update_fields=["response_status", "response_body", "response_headers"])
+                return response
+
+    return wrapper
@@ -0,0 +1,207 @@
+"""Массовая загрузка пользователей из CSV и NDJSON.
+
+Источник читается потоком и делится на порции по IMPORT_CHUNK_SIZE записей.
+Каждая запись проверяется валидаторами полей модели (validate_names,
+validate_phone, формат email, длина), пароли порции хешируются в пуле
+процессов, а пользователи вставляются одним bulk_create. Записи с email или
+телефоном, которые уже заняты (в базе или выше в источнике), и записи с
+ошибками не прерывают загрузку, а возвращаются как отказы. Вместе с порцией
+в той же транзакции сохраняется ImportCheckpoint с числом обработанных
+записей, поэтому прерванную загрузку можно продолжить. Используется командой
+`manage.py import_customers`.
+"""
+import csv
+import gzip
+import io
+import json
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+from django.utils.dateparse import parse_date
+
+from .models import CustomCustomer, ImportCheckpoint
+
+FORMATS = ("csv", "ndjson")
+# Поля источника; остальные колонки и ключи не читаются.
+FIELDS = ["email", "password", "first_name", "last_name", "phone", "birth_date"]
+# Сколько раз повторять порцию, если её email или телефон заняли параллельно.
+CONFLICT_RETRIES = 3
+
+
+@dataclass
+class Record:
+    """A source record, cleaned, or with the reason it is rejected."""
+
+    number: int
+    email: str = ""
+    password: str | None = None
+    password_hash: str = ""
+    values: dict = field(default_factory=dict)
+    error: str | None = None
+
+
+@dataclass
+class Rejection:
+    """A source record that wasn't imported."""
+
+    number: int
+    email: str
+    reason: str
+
+
+def detect_format(path: str) -> str:
+    """Guess the source format from the file name, CSV unless it is NDJSON."""
+    name = path[:-3] if path.endswith(".gz") else path
+    return "ndjson" if name.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def open_source(path: str) -> io.TextIOBase:
+    """Open a source file for reading as text, decompressing `.gz` files."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def read_records(source: io.TextIOBase, source_format: str, skip: int = 0) -> Iterator[Record]:
+    """
+    Read and clean the records of a source, one at a time.
+    Args:
+        source: The open source.
+        source_format (str): "csv" (with a header row) or "ndjson".
+        skip (int): The number of records already processed, which are read but not cleaned.
+    Returns:
+        Iterator[Record]: The records after the skipped ones, numbered from 1.
+    """
+    if source_format == "csv":
+        rows = csv.DictReader(source)
+    else:
+        rows = (line for line in source if line.strip())
+    for number, row in enumerate(rows, 1):
+        if number <= skip:
+            continue
+        if source_format == "ndjson":
+            try:
+                row = json.loads(row)
+            except ValueError as error:
+                yield Record(number, error=f"invalid JSON: {error}")
+                continue
+            if not isinstance(row, dict):
+                yield Record(number, error="invalid JSON: not an object")
+                continue
+        yield clean_record(number, row)
+
+
+def clean_record(number: int, row: dict) -> Record:
+    """Validate a source row with the validators of the customer fields."""
+    values = {
+        name: str(row[name]).strip() if row.get(name) is not None else ""
+        for name in FIELDS
+    }
+    email = CustomCustomer.objects.normalize_email(values["email"])
+    record = Record(number, email=email, password=values["password"] or None)
+    if not email:
+        record.error = "email: this field is required"
+        return record
+    errors = []
+    for name, value in (
+        ("email", email),
+        ("first_name", values["first_name"]),
+        ("last_name", values["last_name"]),
+        ("phone", values["phone"]),
+    ):
+        if not value:
+            continue
+        try:
+            CustomCustomer._meta.get_field(name).run_validators(value)
+        except ValidationError as error:
+            errors.append(f"{name}: {' '.join(error.messages)}")
+        else:
+            record.values[name] = value
+    if values["birth_date"]:
+        try:
+            birth_date = parse_date(values["birth_date"])
+        except ValueError:
+            birth_date = None
+        if birth_date is None:
+            errors.append("birth_date: expected YYYY-MM-DD")
+        record.values["birth_date"] = birth_date
+    record.values.pop("email", None)
+    if errors:
+        record.error = "; ".join(errors)
+    return record
+
+
+def hash_passwords(passwords: list[str | None]) -> list[str]:
+    """Hash passwords with the configured hasher; None gives an unusable password."""
+    return [make_password(password) for password in passwords]
+
+
+def _taken(records: list[Record], using: str) -> tuple[set[str], set[str]]:
+    emails = CustomCustomer.objects.using(using).filter(
+        email__in=[record.email for record in records]
+    ).values_list("email", flat=True)
+    phones = CustomCustomer.objects.using(using).filter(
+        phone__in=[record.values["phone"] for record in records if "phone" in record.values]
+    ).values_list("phone", flat=True)
+    return set(emails), set(phones)
+
+
+def save_chunk(
+    job: str, records: list[Record], processed: int, using: str = DEFAULT_DB_ALIAS
+) -> tuple[int, list[Rejection]]:
+    """
+    Insert the valid records of a chunk and move the checkpoint, in one transaction.
+    Args:
+        job (str): The checkpoint name.
+        records (list[Record]): The records of the chunk, valid ones with their password hashes.
+        processed (int): The number of the last record of the chunk.
+    Returns:
+        tuple[int, list[Rejection]]: The number of imported customers and the rejected records.
+    Raises:
+        IntegrityError: If an email or a phone is still taken concurrently after the retries.
+    """
+    conflict = None
+    for _ in range(CONFLICT_RETRIES):
+        try:
+            with transaction.atomic(using=using):
+                imported, rejections = _insert(records, using)
+                ImportCheckpoint.objects.using(using).filter(job=job).update(
+                    records=processed,
+                    imported=F("imported") + imported,
+                    rejected=F("rejected") + len(rejections),
+                )
+            return imported, rejections
+        except IntegrityError as error:
+            # Email или телефон заняли между проверкой и вставкой: при
+            # повторе они найдутся проверкой и попадут в отказы.
+            conflict = error
+    raise conflict
+
+
+def _insert(records: list[Record], using: str) -> tuple[int, list[Rejection]]:
+    valid = [record for record in records if record.error is None]
+    taken_emails, taken_phones = _taken(valid, using)
+    rejections = []
+    customers = []
+    for record in records:
+        reason = record.error
+        phone = record.values.get("phone")
+        if reason is None and record.email in taken_emails:
+            reason = "duplicate email"
+        elif reason is None and phone is not None and phone in taken_phones:
+            reason = "duplicate phone"
+        if reason is not None:
+            rejections.append(Rejection(record.number, record.email, reason))
+            continue
+        taken_emails.add(record.email)
+        if phone is not None:
+            taken_phones.add(phone)
+        customers.append(
+            CustomCustomer(email=record.email, password=record.password_hash, **record.values)
+        )
+    CustomCustomer.objects.using(using).bulk_create(customers)
+    return len(customers), rejections
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ... import rollups
+from ...conf import get_setting
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the pending rollup deltas of hot accounts (and of every account "
+        "with ROLLUPS_DEFERRED) into the daily rollups. Run it regularly, e.g. "
+        "every minute from cron; several instances may run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=get_setting("ROLLUP_APPLY_BATCH_SIZE"),
+            help="Number of deltas applied in one transaction.",
+        )
+
+    def handle(self, *args, batch_size, **options):
+        if connections[DEFAULT_DB_ALIAS].vendor != "postgresql":
+            raise CommandError("Applying rollup deltas requires PostgreSQL.")
+        total = 0
+        while applied := rollups.apply_deltas(batch_size):
+            total += applied
+        self.stdout.write(f"Applied {total} rollup deltas")
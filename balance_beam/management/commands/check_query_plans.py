@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from ... import query_checks, testing
+from ...models import BalanceOperation, CustomCustomer
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the hot paths of the API and BalanceService on generated data, check "
+        "their query budgets and EXPLAIN every query they make. Fails on a "
+        "budget overrun or on a sequential scan or sort of a large table. The "
+        "data is generated in a transaction that is rolled back; still, run it "
+        "against a test or staging database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            action="append",
+            dest="paths",
+            choices=list(testing.HOT_PATHS),
+            help="Only check this hot path; may be repeated.",
+        )
+        parser.add_argument("--customers", type=int, default=20000)
+        parser.add_argument("--operations", type=int, default=200000)
+        parser.add_argument(
+            "--large-rows",
+            type=int,
+            default=10000,
+            help="The estimated number of rows from which a table counts as large.",
+        )
+
+    def handle(self, *args, paths, customers, operations, large_rows, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.vendor != "postgresql":
+            raise CommandError("Checking query plans requires PostgreSQL.")
+        isolated = dict(getattr(settings, "BALANCE_BEAM", {}), **testing.HOT_PATH_SETTINGS)
+        failures = []
+        with override_settings(BALANCE_BEAM=isolated), transaction.atomic():
+            fixture = self._seed(customers, operations)
+            for name in paths or testing.HOT_PATHS:
+                failures += self._check(name, fixture, large_rows, connection)
+            transaction.set_rollback(True)
+        if failures:
+            raise CommandError(f"{len(failures)} problems: " + "; ".join(failures))
+        self.stdout.write("All hot paths are within their budgets and plans")
+
+    def _seed(self, customers: int, operations: int) -> testing.HotPathFixture:
+        prefix = f"plan-check-{time.time_ns()}"
+        created = CustomCustomer.objects.bulk_create(
+            (
+                CustomCustomer(email=f"{prefix}-{index}@example.com", balance=10**9)
+                for index in range(max(customers, 4))
+            ),
+            batch_size=5000,
+        )
+        sender, recipients = created[0], [customer.pk for customer in created[1:4]]
+        # Половина операций у отправителя - пользователь с длинной историей.
+        query_checks.seed_operations([sender.pk], recipients[0], operations // 2)
+        query_checks.seed_operations([customer.pk for customer in created], sender.pk, operations // 2)
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            for model in (CustomCustomer, BalanceOperation):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+        self.stdout.write(f"Generated {len(created)} customers and {operations} operations")
+        return testing.make_fixture(sender, recipients)
+
+    def _check(self, name, fixture, large_rows, connection) -> list[str]:
+        # Первый вызов заполняет кэши процесса; проверяется второй.
+        testing.HOT_PATHS[name](fixture)
+        with CaptureQueriesContext(connection) as captured:
+            testing.HOT_PATHS[name](fixture)
+        queries = query_checks.counted_queries(captured)
+        budget = query_checks.QUERY_BUDGETS[name]
+        failures = []
+        if len(queries) > budget:
+            failures.append(f"{name}: {len(queries)} queries, budget {budget}")
+        self.stdout.write(f"{name}: {len(queries)}/{budget} queries")
+        for sql in queries:
+            for problem in query_checks.plan_problems(sql, large_rows):
+                failures.append(f"{name}: {problem}")
+                self.stdout.write(f"  {problem}\n    {sql}")
+        return failures
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import hot_accounts
+from ...models import CustomCustomer
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the money of hot accounts' balance slots to their main balance. "
+        "Run it regularly, e.g. every minute from cron, so that debits rarely "
+        "have to sweep the slots. With --slots, change the number of slots of "
+        "one account; 0 turns it back into a regular account."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--account", type=int, help="Only consolidate the account with this id."
+        )
+        parser.add_argument(
+            "--slots",
+            type=int,
+            help="Set the number of balance slots of --account before consolidating.",
+        )
+
+    def handle(self, *args, account, slots, **options):
+        if slots is not None:
+            if account is None:
+                raise CommandError("--slots requires --account.")
+            try:
+                hot_accounts.set_slot_count(account, slots)
+            except (ValueError, CustomCustomer.DoesNotExist) as error:
+                raise CommandError(str(error)) from error
+            self.stdout.write(f"Account {account} now has {slots} balance slots")
+
+        accounts = CustomCustomer.objects.filter(balance_slot_count__gt=0)
+        if account is not None:
+            accounts = accounts.filter(pk=account)
+        for customer_id in accounts.values_list("id", flat=True).order_by("id"):
+            moved = hot_accounts.sweep_slots(customer_id)
+            self.stdout.write(
+                f"Account {customer_id}: moved {moved / 100} rubles to the main balance"
+            )
@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ... import outbox
+from ...conf import get_setting
+from ...sinks import load_sink
+
+_stopping = False
+
+
+def _request_stop(signum, frame) -> None:
+    global _stopping
+    _stopping = True
+
+
+def _init_worker() -> None:
+    # При запуске процессов через spawn Django нужно настроить заново.
+    django.setup()
+    # Диспетчер дописывает текущую пачку и только потом завершается.
+    signal.signal(signal.SIGINT, _request_stop)
+    signal.signal(signal.SIGTERM, _request_stop)
+
+
+def _dispatch(partition: int, batch_size: int, poll_interval: float, drain: bool) -> tuple[int, dict | None, float]:
+    began = time.monotonic()
+    sink = load_sink()
+    try:
+        # Соединение не закрывается между пачками: на нём держится
+        # advisory lock части.
+        with outbox.partition_lock(partition) as acquired:
+            if not acquired:
+                return partition, None, 0.0
+            dispatcher = outbox.Dispatcher(
+                sink, partition, batch_size=batch_size, poll_interval=poll_interval
+            )
+            stats = dispatcher.run(should_stop=lambda: _stopping, drain=drain)
+    finally:
+        sink.close()
+    return partition, dict(stats), time.monotonic() - began
+
+
+def _forward_stop(signum, frame) -> None:
+    for process in multiprocessing.active_children():
+        os.kill(process.pid, signal.SIGTERM)
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver the outbox events of balance operations to the sink set in "
+        "OUTBOX_SINK, in large batches and in order per account. One process "
+        "runs per partition (OUTBOX_PARTITIONS); a partition that another "
+        "dispatcher holds is skipped. SIGINT or SIGTERM stops the dispatchers "
+        "after their current batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--partition",
+            type=int,
+            action="append",
+            dest="partitions",
+            help="Dispatch only this partition; can be repeated. By default all partitions.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=get_setting("OUTBOX_BATCH_SIZE"),
+            help="The largest number of events delivered in one batch.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=get_setting("OUTBOX_POLL_INTERVAL"),
+            help="Seconds a dispatcher waits when its partition has no events.",
+        )
+        parser.add_argument(
+            "--drain",
+            action="store_true",
+            help="Exit once the partitions have no events.",
+        )
+
+    def handle(self, *args, partitions, batch_size, poll_interval, drain, **options):
+        count = get_setting("OUTBOX_PARTITIONS")
+        partitions = sorted(set(partitions or range(count)))
+        if any(not 0 <= partition < count for partition in partitions):
+            raise CommandError(f"Partitions are numbered from 0 to {count - 1}.")
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive.")
+        if poll_interval < 0:
+            raise CommandError("--poll-interval can't be negative.")
+        try:
+            load_sink().close()
+        except (ImportError, TypeError) as error:
+            raise CommandError(f"Can't create the outbox sink: {error}")
+
+        global _stopping
+        _stopping = False
+        began = time.monotonic()
+        if len(partitions) == 1:
+            handlers = {
+                signum: signal.signal(signum, _request_stop)
+                for signum in (signal.SIGINT, signal.SIGTERM)
+            }
+            try:
+                results = [_dispatch(partitions[0], batch_size, poll_interval, drain)]
+            finally:
+                for signum, handler in handlers.items():
+                    signal.signal(signum, handler)
+        else:
+            # Процессы не должны наследовать открытые соединения родителя.
+            connections.close_all()
+            handlers = {
+                signum: signal.signal(signum, _forward_stop)
+                for signum in (signal.SIGINT, signal.SIGTERM)
+            }
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=len(partitions), initializer=_init_worker
+                ) as pool:
+                    futures = [
+                        pool.submit(_dispatch, partition, batch_size, poll_interval, drain)
+                        for partition in partitions
+                    ]
+                    results = [future.result() for future in futures]
+            finally:
+                for signum, handler in handlers.items():
+                    signal.signal(signum, handler)
+
+        elapsed = time.monotonic() - began
+        total = 0
+        for partition, stats, seconds in results:
+            if stats is None:
+                self.stdout.write(f"Partition {partition} is dispatched by another process, skipped")
+                continue
+            delivered = stats.get("delivered", 0)
+            total += delivered
+            self.stdout.write(
+                f"Partition {partition}: {delivered} events in {stats.get('batches', 0)} batches, "
+                f"{stats.get('failures', 0)} failed deliveries, {seconds:.1f}s "
+                f"({delivered / seconds if seconds else 0:.0f}/s)"
+            )
+        self.stdout.write(
+            f"Delivered {total} outbox events in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else 0:.0f}/s)"
+        )
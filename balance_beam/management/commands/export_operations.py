@@ -0,0 +1,68 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import exports
+from ...models import CustomCustomer
+from ...serializers import ExportQuerySerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the full operations history of a customer, oldest first, as CSV "
+        "or NDJSON. The rows are streamed, so memory use doesn't depend on the "
+        "size of the history. Filters match the history API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "account", help="The id or the email of the customer."
+        )
+        parser.add_argument(
+            "--format", dest="export_format", choices=list(exports.FORMATS), default="csv"
+        )
+        parser.add_argument("--gzip", action="store_true", help="Compress the output.")
+        parser.add_argument(
+            "--output", "-o", default="-", help="The output file; '-' for stdout."
+        )
+        parser.add_argument("--operation-type", dest="operation_type")
+        parser.add_argument(
+            "--success", choices=["true", "false"], help="Only successful or only failed operations."
+        )
+        parser.add_argument("--amount-min", dest="amount_min", help="In kopecks, inclusive.")
+        parser.add_argument("--amount-max", dest="amount_max", help="In kopecks, inclusive.")
+        parser.add_argument("--date-from", dest="date_from", help="ISO 8601, inclusive.")
+        parser.add_argument("--date-to", dest="date_to", help="ISO 8601, exclusive.")
+        parser.add_argument("--counterparty", help="Only operations with this customer id.")
+
+    def handle(self, *args, account, output, **options):
+        lookup = {"pk": account} if account.isdigit() else {"email": account}
+        try:
+            customer_id = CustomCustomer.objects.values_list("pk", flat=True).get(**lookup)
+        except CustomCustomer.DoesNotExist as error:
+            raise CommandError(f"Customer {account} doesn't exist.") from error
+
+        query = ExportQuerySerializer(
+            data={
+                name: options[name]
+                for name in ExportQuerySerializer().fields
+                if options.get(name) is not None
+            }
+        )
+        if not query.is_valid():
+            raise CommandError(query.errors)
+        params = dict(query.validated_data)
+        export_format = params.pop("export_format")
+        compress = params.pop("gzip")
+
+        out = sys.stdout.buffer if output == "-" else open(output, "wb")
+        try:
+            for chunk in exports.stream_operations(
+                customer_id, export_format, compress, **params
+            ):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        if output != "-":
+            self.stdout.write(f"Exported the operations of customer {customer_id} to {output}")
@@ -0,0 +1,146 @@
+import csv
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ... import imports
+from ...conf import get_setting
+from ...models import ImportCheckpoint
+
+
+def _init_worker() -> None:
+    # При запуске процессов через spawn Django нужно настроить заново.
+    django.setup()
+
+
+def _chunks(records: Iterable[imports.Record], size: int) -> Iterator[list[imports.Record]]:
+    records = iter(records)
+    while chunk := list(islice(records, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Import customers from a CSV (with a header row) or NDJSON file with the "
+        "columns email, password, first_name, last_name, phone and birth_date. "
+        "Passwords are hashed in parallel processes and customers are inserted in "
+        "chunks. Invalid records and taken emails or phones are reported, not "
+        "imported. An interrupted import continues from its checkpoint when run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="The file to import; `.gz` files are decompressed.")
+        parser.add_argument(
+            "--format",
+            dest="source_format",
+            choices=imports.FORMATS,
+            help="The source format; by default guessed from the file name.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of password hashing processes.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=get_setting("IMPORT_CHUNK_SIZE"),
+            help="Number of records inserted in one transaction.",
+        )
+        parser.add_argument(
+            "--job",
+            help="The checkpoint name; by default the absolute path of the source.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and import the source from the start.",
+        )
+        parser.add_argument(
+            "--report", help="Write the rejected records to this CSV file."
+        )
+
+    def handle(self, *args, source, source_format, workers, chunk_size, job, restart, report, **options):
+        if not os.path.isfile(source):
+            raise CommandError(f"Source {source} doesn't exist.")
+        if chunk_size < 1 or workers < 1:
+            raise CommandError("--chunk-size and --workers must be positive.")
+        source_format = source_format or imports.detect_format(source)
+        job = job or os.path.abspath(source)
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(job=job)
+        if restart:
+            checkpoint.records = checkpoint.imported = checkpoint.rejected = 0
+            checkpoint.save()
+        if checkpoint.records:
+            self.stdout.write(f"Resuming {job} after record {checkpoint.records}")
+        self.job = job
+        self.verbosity = options["verbosity"]
+        self.workers = workers
+        self.imported = 0
+        self.rejected = 0
+        # Процессы не должны наследовать открытые соединения родителя.
+        connections.close_all()
+
+        # Отказы дописываются к отчёту прерванного запуска.
+        append = bool(checkpoint.records) and report is not None and os.path.exists(report)
+        report_file = open(report, "a" if append else "w", newline="", encoding="utf-8") if report else None
+        self.report_file = report_file
+        try:
+            self.writer = csv.writer(report_file) if report_file else None
+            if self.writer and not append:
+                self.writer.writerow(["record", "email", "reason"])
+            with imports.open_source(source) as file, ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker
+            ) as pool:
+                records = imports.read_records(file, source_format, skip=checkpoint.records)
+                # Пока вставляется одна порция, пароли следующей уже хешируются.
+                pending = None
+                for chunk in _chunks(records, chunk_size):
+                    hashing = self._hash(pool, chunk)
+                    if pending is not None:
+                        self._save(*pending)
+                    pending = chunk, hashing
+                if pending is not None:
+                    self._save(*pending)
+        finally:
+            if report_file:
+                report_file.close()
+
+        checkpoint.refresh_from_db()
+        self.stdout.write(
+            f"Imported {self.imported} customers, rejected {self.rejected} records; "
+            f"{checkpoint.records} records of {job} processed in total"
+        )
+
+    def _hash(self, pool: ProcessPoolExecutor, chunk: list[imports.Record]) -> list[Future]:
+        passwords = [record.password for record in chunk if record.error is None]
+        size = max(1, -(-len(passwords) // self.workers))
+        return [
+            pool.submit(imports.hash_passwords, passwords[start : start + size])
+            for start in range(0, len(passwords), size)
+        ]
+
+    def _save(self, chunk: list[imports.Record], hashing: list[Future]) -> None:
+        hashes = iter(password_hash for future in hashing for password_hash in future.result())
+        for record in chunk:
+            if record.error is None:
+                record.password_hash = next(hashes)
+            record.password = None
+        imported, rejections = imports.save_chunk(self.job, chunk, chunk[-1].number)
+        self.imported += imported
+        self.rejected += len(rejections)
+        for rejection in rejections:
+            if self.writer:
+                self.writer.writerow([rejection.number, rejection.email, rejection.reason])
+            if self.verbosity >= 2:
+                self.stderr.write(f"Record {rejection.number}: {rejection.reason}")
+        if self.report_file:
+            self.report_file.flush()
+        if self.verbosity >= 2:
+            self.stdout.write(f"Processed {chunk[-1].number} records")
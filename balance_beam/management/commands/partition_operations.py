@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from ... import partitioning
+from ...conf import get_setting
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-create future monthly partitions of the operations table and "
+        "detach partitions older than the retention period. Run it regularly, "
+        "e.g. daily from cron: inserts into a month without a partition fail."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=get_setting("OPERATIONS_PARTITIONS_AHEAD"),
+            help="Number of future months to keep partitions for.",
+        )
+        parser.add_argument(
+            "--retain",
+            type=int,
+            default=get_setting("OPERATIONS_PARTITIONS_RETAIN"),
+            help="Number of past months to keep attached; older partitions are "
+            "detached, not dropped. Nothing is detached if omitted.",
+        )
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only print what would be done."
+        )
+
+    def handle(self, *args, ahead, retain, database, dry_run, **options):
+        connection = connections[database]
+        if connection.vendor != "postgresql" or not partitioning.is_partitioned(connection):
+            raise CommandError("The operations table is not partitioned.")
+
+        current = partitioning.month_start(timezone.now().date())
+        existing = partitioning.monthly_partitions(connection)
+        first = min(existing, default=current)
+        for offset in range(ahead + 1):
+            month = partitioning.add_months(current, offset)
+            # Месяцы до первой помесячной секции хранятся в legacy-секции.
+            if month in existing or month < first:
+                continue
+            if not dry_run:
+                partitioning.create_month_partition(connection, month)
+            action = "Would create" if dry_run else "Created"
+            self.stdout.write(f"{action} {partitioning.partition_name(month)}")
+
+        if retain is None:
+            return
+        oldest_kept = partitioning.add_months(current, -retain)
+        for month, name in sorted(existing.items()):
+            if month >= oldest_kept:
+                break
+            if not dry_run:
+                partitioning.detach_partition(connection, name)
+            self.stdout.write(f"{'Would detach' if dry_run else 'Detached'} {name}")
@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ... import transfer_queue
+from ...conf import get_setting
+
+_stopping = False
+
+
+def _request_stop(signum, frame) -> None:
+    global _stopping
+    _stopping = True
+
+
+def _init_worker() -> None:
+    # При запуске процессов через spawn Django нужно настроить заново.
+    django.setup()
+    # Воркер дописывает текущую пачку и только потом завершается.
+    signal.signal(signal.SIGINT, _request_stop)
+    signal.signal(signal.SIGTERM, _request_stop)
+
+
+def _work(batch_size: int, poll_interval: float, drain: bool) -> tuple[int, dict, float]:
+    began = time.monotonic()
+    outcomes = transfer_queue.run_worker(
+        batch_size, poll_interval, drain, should_stop=lambda: _stopping
+    )
+    return os.getpid(), dict(outcomes), time.monotonic() - began
+
+
+def _forward_stop(signum, frame) -> None:
+    for process in multiprocessing.active_children():
+        os.kill(process.pid, signal.SIGTERM)
+
+
+class Command(BaseCommand):
+    help = (
+        "Execute the transfers queued by the transfer_balance/async/ endpoint. "
+        "Each worker process claims batches of due requests with "
+        "SELECT ... FOR UPDATE SKIP LOCKED and executes them through "
+        "BalanceService, one transaction per sender. SIGINT or SIGTERM stops "
+        "the workers after their current batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes; 1 runs the worker in this process.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=get_setting("TRANSFER_QUEUE_BATCH_SIZE"),
+            help="Number of requests a worker claims at once.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=get_setting("TRANSFER_QUEUE_POLL_INTERVAL"),
+            help="Seconds a worker waits when no request is due.",
+        )
+        parser.add_argument(
+            "--drain",
+            action="store_true",
+            help="Exit once no request is pending or being processed.",
+        )
+
+    def handle(self, *args, workers, batch_size, poll_interval, drain, **options):
+        if workers < 1 or batch_size < 1:
+            raise CommandError("--workers and --batch-size must be positive.")
+        if poll_interval < 0:
+            raise CommandError("--poll-interval can't be negative.")
+
+        global _stopping
+        _stopping = False
+        began = time.monotonic()
+        if workers == 1:
+            handlers = {
+                signum: signal.signal(signum, _request_stop)
+                for signum in (signal.SIGINT, signal.SIGTERM)
+            }
+            try:
+                results = [_work(batch_size, poll_interval, drain)]
+            finally:
+                for signum, handler in handlers.items():
+                    signal.signal(signum, handler)
+        else:
+            # Процессы не должны наследовать открытые соединения родителя.
+            connections.close_all()
+            handlers = {
+                signum: signal.signal(signum, _forward_stop)
+                for signum in (signal.SIGINT, signal.SIGTERM)
+            }
+            try:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                    futures = [
+                        pool.submit(_work, batch_size, poll_interval, drain)
+                        for _ in range(workers)
+                    ]
+                    results = [future.result() for future in futures]
+            finally:
+                for signum, handler in handlers.items():
+                    signal.signal(signum, handler)
+
+        elapsed = time.monotonic() - began
+        total = 0
+        for pid, outcomes, seconds in results:
+            processed = sum(outcomes.values())
+            total += processed
+            self.stdout.write(
+                f"Worker {pid}: {processed} requests in {seconds:.1f}s "
+                f"({processed / seconds if seconds else 0:.0f}/s); "
+                + ", ".join(f"{outcomes.get(outcome, 0)} {outcome}" for outcome in transfer_queue.OUTCOMES)
+            )
+        self.stdout.write(
+            f"Processed {total} transfer requests in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else 0:.0f}/s)"
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ... import reconciliation, rollups
+from ...conf import get_setting
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily operation rollups from the operations table, e.g. "
+        "once after enabling them or after fixing operations by hand. Writes "
+        "to the rollups wait while a range of customers is being rebuilt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--account", type=int, help="Only rebuild the rollups of the account with this id."
+        )
+        parser.add_argument(
+            "--range-size",
+            type=int,
+            default=get_setting("ROLLUP_REBUILD_RANGE_SIZE"),
+            help="Number of customer ids rebuilt in one transaction.",
+        )
+
+    def handle(self, *args, account, range_size, **options):
+        if connections[DEFAULT_DB_ALIAS].vendor != "postgresql":
+            raise CommandError("Rebuilding rollups requires PostgreSQL.")
+        if account is not None:
+            ranges = [(account, account)]
+        else:
+            ranges = reconciliation.id_ranges(range_size)
+        rows = 0
+        for first_id, last_id in ranges:
+            rows += rollups.rebuild_range(first_id, last_id)
+            self.stdout.write(f"Customers {first_id}-{last_id}: done")
+        self.stdout.write(f"Rebuilt {rows} rollup rows")
@@ -0,0 +1,111 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from ... import reconciliation
+from ...conf import get_setting
+
+
+def _init_worker() -> None:
+    # При запуске процессов через spawn Django нужно настроить заново.
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that every customer's balance equals the sum of their successful "
+        "operations. The customer id space is split into ranges reconciled in "
+        "parallel; by default only operations after the saved checkpoints are "
+        "read. Exits with an error if mismatches are found."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes.",
+        )
+        parser.add_argument(
+            "--range-size",
+            type=int,
+            default=get_setting("RECONCILE_RANGE_SIZE"),
+            help="Number of customer ids reconciled by one task.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Ignore the checkpoints and read the whole history.",
+        )
+        parser.add_argument(
+            "--no-checkpoint",
+            action="store_true",
+            help="Don't save new checkpoints.",
+        )
+        parser.add_argument(
+            "--report", help="Write the mismatches to this CSV file."
+        )
+
+    def handle(self, *args, workers, range_size, full, no_checkpoint, report, **options):
+        if connections[DEFAULT_DB_ALIAS].vendor != "postgresql":
+            raise CommandError("Reconciliation requires PostgreSQL.")
+        watermark = timezone.now() - timedelta(
+            seconds=get_setting("RECONCILE_WATERMARK_LAG")
+        )
+        ranges = reconciliation.id_ranges(range_size)
+        # Процессы не должны наследовать открытые соединения родителя.
+        connections.close_all()
+
+        checked = 0
+        mismatches = 0
+        report_file = open(report, "w", newline="", encoding="utf-8") if report else None
+        try:
+            writer = csv.writer(report_file) if report_file else None
+            if writer:
+                writer.writerow(["customer_id", "email", "balance", "expected", "difference"])
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                futures = [
+                    pool.submit(
+                        reconciliation.reconcile_range,
+                        first_id,
+                        last_id,
+                        watermark,
+                        incremental=not full,
+                        save_checkpoint=not no_checkpoint,
+                    )
+                    for first_id, last_id in ranges
+                ]
+                for future in as_completed(futures):
+                    result = future.result()
+                    checked += result.checked
+                    mismatches += len(result.mismatches)
+                    for mismatch in result.mismatches:
+                        self.stderr.write(
+                            f"Customer {mismatch.customer_id}: balance {mismatch.balance}, "
+                            f"operations {mismatch.expected}"
+                        )
+                        if writer:
+                            writer.writerow(
+                                [
+                                    mismatch.customer_id,
+                                    mismatch.email,
+                                    mismatch.balance,
+                                    mismatch.expected,
+                                    mismatch.difference,
+                                ]
+                            )
+        finally:
+            if report_file:
+                report_file.close()
+
+        self.stdout.write(
+            f"Checked {checked} accounts in {len(ranges)} ranges, {mismatches} mismatches"
+        )
+        if mismatches:
+            raise CommandError(f"{mismatches} balances don't match their operations.")
@@ -0,0 +1,512 @@
+"""Метрики сервиса в текстовом формате Prometheus.
+
+MetricsMiddleware измеряет каждый запрос к API: время ответа по
+представлениям, число запросов к базе и время в базе. Декоратор
+`instrumented` делает то же для методов BalanceService и дополнительно
+измеряет ожидание блокировок строк (SELECT ... FOR UPDATE и UPDATE), длительность
+транзакций и считает отказы по причинам. Учитывается только внешний вызов:
+вложенные вызовы сервиса входят в его метрики. К ним добавляются счётчики
+процесса: размеры пачек зачислений, кэш снимков счетов и контроль допуска,
+у воркеров process_transfers - исходы и задержка асинхронных переводов, а у
+диспетчеров dispatch_outbox - доставка, отказы получателя и отставание.
+
+Измерения накапливаются в памяти процесса. При METRICS_DIR каждый процесс
+раз в METRICS_FLUSH_INTERVAL секунд записывает их в свой файл в этом
+каталоге, а эндпоинт `/metrics` складывает файлы всех процессов, так что
+Prometheus видит сумму по всем воркерам. Каталог нужно очищать при запуске
+сервиса. Без METRICS_DIR видны только метрики процесса, ответившего на
+запрос.
+"""
+import atexit
+import json
+import math
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Callable
+from contextlib import ExitStack
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, connections, router
+from django.http import HttpRequest, HttpResponse
+
+from .conf import get_setting
+
+# Запросы, которые ждут блокировку строки: SELECT ... FOR UPDATE и UPDATE.
+# Общий для метрик и контроля допуска (admission.py).
+LOCKING_SQL = re.compile(r"^\s*UPDATE\b|\bFOR UPDATE\b", re.IGNORECASE)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, math.inf)
+QUEUE_DELAY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, math.inf)
+
+# Имя: (тип, описание, границы корзин гистограммы).
+METRICS = {
+    "balance_beam_http_request_duration_seconds": (
+        "histogram", "Time to handle an API request.", LATENCY_BUCKETS
+    ),
+    "balance_beam_http_db_queries_total": (
+        "counter", "Database queries made while handling API requests.", None
+    ),
+    "balance_beam_http_db_duration_seconds_total": (
+        "counter", "Time spent in database queries while handling API requests.", None
+    ),
+    "balance_beam_service_duration_seconds": (
+        "histogram", "Time of BalanceService calls.", LATENCY_BUCKETS
+    ),
+    "balance_beam_service_db_queries_total": (
+        "counter", "Database queries made by BalanceService calls.", None
+    ),
+    "balance_beam_service_db_duration_seconds_total": (
+        "counter", "Time spent in database queries by BalanceService calls.", None
+    ),
+    "balance_beam_row_lock_wait_seconds": (
+        "histogram", "Time of the row-locking statements of a BalanceService call.",
+        LATENCY_BUCKETS,
+    ),
+    "balance_beam_transaction_duration_seconds": (
+        "histogram", "Duration of the transactions of BalanceService calls.", LATENCY_BUCKETS
+    ),
+    "balance_beam_service_failures_total": (
+        "counter", "Failed BalanceService calls by reason.", None
+    ),
+    "balance_beam_increase_batch_size": (
+        "histogram", "Number of balance increases applied in one batch.", BATCH_SIZE_BUCKETS
+    ),
+    "balance_beam_snapshot_cache_events_total": (
+        "counter", "Account snapshot cache events.", None
+    ),
+    "balance_beam_admission_admitted_total": (
+        "counter", "Write requests admitted by the admission control.", None
+    ),
+    "balance_beam_admission_shed_total": (
+        "counter", "Write requests rejected with 429 by the admission control, by limit.", None
+    ),
+    "balance_beam_admission_in_flight": (
+        "gauge", "Write requests being handled.", None
+    ),
+    "balance_beam_admission_limit": (
+        "gauge", "Current limit of concurrent write requests.", None
+    ),
+    "balance_beam_transfer_queue_processed_total": (
+        "counter", "Queued transfers processed by the workers, by outcome.", None
+    ),
+    "balance_beam_transfer_queue_delay_seconds": (
+        "histogram", "Time from enqueueing a transfer to its completion.", QUEUE_DELAY_BUCKETS
+    ),
+    "balance_beam_transfer_queue_claimed": (
+        "histogram", "Number of queued transfers claimed by a worker at once.", BATCH_SIZE_BUCKETS
+    ),
+    "balance_beam_outbox_delivered_total": (
+        "counter", "Outbox events delivered to the sink.", None
+    ),
+    "balance_beam_outbox_delivery_failures_total": (
+        "counter", "Outbox batches the sink didn't accept, by reason.", None
+    ),
+    "balance_beam_outbox_batch_size": (
+        "histogram", "Number of outbox events delivered in one batch.", BATCH_SIZE_BUCKETS
+    ),
+    "balance_beam_outbox_lag_seconds": (
+        "histogram", "Time from writing an outbox event to its delivery.", QUEUE_DELAY_BUCKETS
+    ),
+    "balance_beam_outbox_oldest_event_age_seconds": (
+        "gauge", "Age of the oldest undelivered outbox event of a partition.", None
+    ),
+    "balance_beam_outbox_batch_limit": (
+        "gauge", "Current batch size limit of the outbox dispatcher of a partition.", None
+    ),
+}
+
+# SQLSTATE ошибок базы, которые различаются в причинах отказов.
+DATABASE_FAILURES = {
+    "40P01": "deadlock",
+    "40001": "serialization_failure",
+    "55P03": "lock_timeout",
+    "57014": "statement_timeout",
+}
+
+
+def enabled() -> bool:
+    """Check whether the metrics are turned on in the settings."""
+    return get_setting("METRICS_ENABLED")
+
+
+def _key(name: str, labels: dict[str, str]) -> tuple[str, tuple]:
+    return name, tuple(sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """Counters and histograms of this process, shared with the other processes through METRICS_DIR."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._counters: dict[tuple, float] = defaultdict(float)
+        # Для каждой корзины число наблюдений (не накопленное), затем сумма
+        # и общее число.
+        self._histograms: dict[tuple, list[float]] = {}
+        self._flusher: threading.Thread | None = None
+
+    def _check_process(self) -> None:
+        # После fork (gunicorn --preload) дочерний процесс начинает с нуля,
+        # иначе измерения родителя попали бы в сумму несколько раз.
+        if self._pid != os.getpid():
+            self._reset()
+        if self._flusher is None and get_setting("METRICS_DIR"):
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+            self._flusher.start()
+
+    def inc(self, name: str, labels: dict[str, str], value: float = 1) -> None:
+        """Add `value` to a counter."""
+        key = _key(name, labels)
+        with self._lock:
+            self._check_process()
+            self._counters[key] += value
+
+    def observe(self, name: str, labels: dict[str, str], value: float) -> None:
+        """Record a value in a histogram."""
+        buckets = METRICS[name][2]
+        key = _key(name, labels)
+        with self._lock:
+            self._check_process()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(buckets) + 2)
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self) -> dict:
+        """Return the measurements of this process, including the component counters."""
+        with self._lock:
+            self._check_process()
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [
+                [name, list(labels), list(values)] for (name, labels), values in self._histograms.items()
+            ]
+        gauges = []
+        for name, labels, value in _component_samples():
+            target = gauges if METRICS[name][0] == "gauge" else counters
+            target.append([name, sorted(labels.items()), value])
+        return {"pid": self._pid, "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def _path(self, directory: str) -> str:
+        return os.path.join(directory, f"{self._pid}.json")
+
+    def flush(self) -> None:
+        """Write the snapshot of this process to METRICS_DIR."""
+        directory = get_setting("METRICS_DIR")
+        if not directory:
+            return
+        path = self._path(directory)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, path)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(get_setting("METRICS_FLUSH_INTERVAL"))
+            if self._pid != os.getpid():
+                return
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def collect(self) -> list[dict]:
+        """Return the snapshots of all processes: this one and those in METRICS_DIR."""
+        snapshots = [self.snapshot()]
+        directory = get_setting("METRICS_DIR")
+        if not directory:
+            return snapshots
+        own = os.path.basename(self._path(directory))
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json") or filename == own:
+                continue
+            try:
+                with open(os.path.join(directory, filename), encoding="utf-8") as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            # Счётчики завершившихся процессов остаются в сумме, а их
+            # текущие значения (gauge) - нет.
+            if not _process_alive(snapshot["pid"]):
+                snapshot["gauges"] = []
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self) -> str:
+        """Render the sum over all processes in the Prometheus text exposition format."""
+        values: dict[tuple, float] = defaultdict(float)
+        histograms: dict[tuple, list[float]] = {}
+        for snapshot in self.collect():
+            for name, labels, value in snapshot["counters"] + snapshot["gauges"]:
+                values[_key(name, dict(labels))] += value
+            for name, labels, counts in snapshot["histograms"]:
+                key = _key(name, dict(labels))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], counts)]
+                else:
+                    histograms[key] = list(counts)
+
+        lines = []
+        for name, (kind, description, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (sample_name, labels), value in sorted(values.items()):
+                if sample_name == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            for (sample_name, labels), counts in sorted(histograms.items()):
+                if sample_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {_number(cumulative)}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(counts[-2])}")
+                lines.append(f"{name}_count{_labels(labels)} {_number(counts[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _component_samples() -> list[tuple[str, dict, float]]:
+    """Read the counters kept by the snapshot cache, the admission control and the outbox dispatchers."""
+    from .admission import admission_controller
+    from .outbox import dispatcher_state
+    from .snapshots import account_snapshots
+
+    samples = [
+        ("balance_beam_snapshot_cache_events_total", {"event": event}, count)
+        for event, count in account_snapshots.stats().items()
+    ]
+    admission = admission_controller.stats()
+    samples += [
+        ("balance_beam_admission_admitted_total", {}, admission["admitted"]),
+        ("balance_beam_admission_shed_total", {"limit": "process"}, admission["shed_global"]),
+        ("balance_beam_admission_shed_total", {"limit": "account"}, admission["shed_account"]),
+        ("balance_beam_admission_in_flight", {}, admission["in_flight"]),
+        ("balance_beam_admission_limit", {}, admission["limit"]),
+    ]
+    for partition, (age, batch_limit) in sorted(dispatcher_state.items()):
+        labels = {"partition": str(partition)}
+        samples += [
+            ("balance_beam_outbox_oldest_event_age_seconds", labels, age),
+            ("balance_beam_outbox_batch_limit", labels, batch_limit),
+        ]
+    return samples
+
+
+registry = MetricsRegistry()
+atexit.register(lambda: enabled() and registry.flush())
+
+
+class DatabaseTimer:
+    """Count the queries and their time on one connection (connection.execute_wrapper).
+
+    Statements matching LOCKING_SQL are also timed separately, as row-lock waits.
+    With `track_transactions` the duration of the transactions is recorded,
+    from their first statement to the commit or rollback.
+    """
+
+    def __init__(self, connection=None, method: str | None = None) -> None:
+        self.queries = 0
+        self.duration = 0.0
+        self.lock_wait = 0.0
+        self.locking_statements = 0
+        self.connection = connection
+        self.method = method
+        self.transaction_started: float | None = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if (
+            self.method is not None
+            and self.transaction_started is None
+            and self.connection.in_atomic_block
+        ):
+            self.transaction_started = time.perf_counter()
+            self.connection.on_commit(self._committed)
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - began
+            self.queries += 1
+            self.duration += elapsed
+            if LOCKING_SQL.search(sql):
+                self.lock_wait += elapsed
+                self.locking_statements += 1
+
+    def _committed(self) -> None:
+        self._record_transaction("commit")
+
+    def _record_transaction(self, outcome: str) -> None:
+        registry.observe(
+            "balance_beam_transaction_duration_seconds",
+            {"method": self.method, "outcome": outcome},
+            time.perf_counter() - self.transaction_started,
+        )
+        self.transaction_started = None
+
+    def finish(self) -> None:
+        """Record a transaction that ended without a commit."""
+        if self.transaction_started is not None and not self.connection.in_atomic_block:
+            self._record_transaction("rollback")
+
+
+def failure_reason(error: BaseException) -> str:
+    """Name the reason of a failed BalanceService call for the failure counter."""
+    if isinstance(error, ObjectDoesNotExist):
+        return "not_found"
+    if isinstance(error, DatabaseError):
+        cause = error.__cause__
+        code = getattr(cause, "pgcode", None) or getattr(cause, "sqlstate", None)
+        return DATABASE_FAILURES.get(code, "database_error")
+    if type(error).__name__ == "BatchTransferError":
+        return "batch_rolled_back"
+    if isinstance(error, ValueError):
+        message = str(error)
+        if message.startswith("Insufficient balance"):
+            return "insufficient_funds"
+        if "to yourself" in message:
+            return "self_transfer"
+        return "invalid"
+    return type(error).__name__
+
+
+_calls = threading.local()
+
+
+def instrumented(method: Callable | None = None, *, name: str | None = None):
+    """Record the metrics of a BalanceService method; apply it below @classmethod."""
+
+    def decorator(method: Callable) -> Callable:
+        label = name or method.__name__
+
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if getattr(_calls, "active", False) or not enabled():
+                return method(*args, **kwargs)
+            connection = connections[router.db_for_write(_customer_model())]
+            timer = DatabaseTimer(connection, label)
+            _calls.active = True
+            began = time.perf_counter()
+            try:
+                with connection.execute_wrapper(timer):
+                    return method(*args, **kwargs)
+            except Exception as error:
+                registry.inc(
+                    "balance_beam_service_failures_total",
+                    {"method": label, "reason": failure_reason(error)},
+                )
+                raise
+            finally:
+                _calls.active = False
+                timer.finish()
+                labels = {"method": label}
+                registry.observe(
+                    "balance_beam_service_duration_seconds", labels, time.perf_counter() - began
+                )
+                registry.inc("balance_beam_service_db_queries_total", labels, timer.queries)
+                registry.inc("balance_beam_service_db_duration_seconds_total", labels, timer.duration)
+                if timer.locking_statements:
+                    registry.observe("balance_beam_row_lock_wait_seconds", labels, timer.lock_wait)
+
+        return wrapper
+
+    return decorator(method) if method is not None else decorator
+
+
+def _customer_model():
+    from .models import CustomCustomer
+
+    return CustomCustomer
+
+
+class MetricsMiddleware:
+    """Measure the API requests: latency per view, database queries and time.
+
+    Async views query the database from other threads, so only their
+    latency is recorded.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        timer = DatabaseTimer()
+        began = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - began, timer)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if not enabled():
+            return await self.get_response(request)
+        began = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - began, None)
+        return response
+
+    @staticmethod
+    def _record(
+        request: HttpRequest, response: HttpResponse, elapsed: float, timer: DatabaseTimer | None
+    ) -> None:
+        match = getattr(request, "resolver_match", None)
+        # Неизвестные адреса в одну метку, чтобы число рядов не росло.
+        view = match.view_name if match is not None else "unmatched"
+        registry.observe(
+            "balance_beam_http_request_duration_seconds",
+            {"view": view, "method": request.method, "status": str(response.status_code)},
+            elapsed,
+        )
+        if timer is not None:
+            registry.inc("balance_beam_http_db_queries_total", {"view": view}, timer.queries)
+            registry.inc("balance_beam_http_db_duration_seconds_total", {"view": view}, timer.duration)
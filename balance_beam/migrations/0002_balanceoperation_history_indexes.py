@@ -0,0 +1,25 @@
+# Generated by Django 5.0.2 on 2026-10-17 10:12
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу операций,
+    # но не может выполняться внутри транзакции.
+    atomic = False
+
+    dependencies = [
+        ('balance_beam', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='balanceoperation',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='balanceop_user_ts_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='balanceoperation',
+            index=models.Index(condition=models.Q(('success', False)), fields=['user', '-timestamp', '-id'], name='balanceop_user_failed_idx'),
+        ),
+    ]
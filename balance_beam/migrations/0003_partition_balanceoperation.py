@@ -0,0 +1,113 @@
+"""Переводит таблицу операций на помесячное секционирование по timestamp.
+
+Существующая таблица не копируется: она становится секцией "legacy" со
+всеми строками до первой помесячной секции. Долгие шаги (уникальный индекс
+(id, timestamp) и проверка CHECK-ограничения диапазона) выполняются без
+блокировки записи, под эксклюзивной блокировкой выполняется только
+переименование и подключение секции.
+"""
+from django.db import migrations, transaction
+from django.utils import timezone
+
+from balance_beam import partitioning
+
+TABLE = partitioning.TABLE
+LEGACY = partitioning.LEGACY_PARTITION
+MONTHS_AHEAD = 3
+
+
+def partition_operations_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql" or partitioning.is_partitioned(connection):
+        return
+    qn = connection.ops.quote_name
+    # Граница с запасом в месяц, чтобы строки, вставленные во время
+    # миграции, гарантированно попали в legacy-секцию.
+    boundary = partitioning.add_months(partitioning.month_start(timezone.now().date()), 2)
+    boundary_literal = f"{boundary} 00:00:00+00"
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {qn(LEGACY + '_pkey')} "
+            f'ON {qn(TABLE)} (id, "timestamp")'
+        )
+        cursor.execute(
+            f"ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(LEGACY + '_range')} "
+            f'CHECK ("timestamp" < %s) NOT VALID',
+            [boundary_literal],
+        )
+        cursor.execute(
+            f"ALTER TABLE {qn(TABLE)} VALIDATE CONSTRAINT {qn(LEGACY + '_range')}"
+        )
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {qn(TABLE)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            "SELECT i.relname, pg_get_indexdef(x.indexrelid) FROM pg_index x "
+            "JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = %s::regclass AND NOT x.indisprimary AND i.relname <> %s",
+            [TABLE, LEGACY + "_pkey"],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {qn(TABLE)}")
+        (next_id,) = cursor.fetchone()
+
+        cursor.execute(f"ALTER TABLE {qn(TABLE)} RENAME TO {qn(LEGACY)}")
+        for name, _ in indexes:
+            cursor.execute(f"ALTER INDEX {qn(name)} RENAME TO {qn(name + '_legacy')}")
+        cursor.execute(f"ALTER TABLE {qn(LEGACY)} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+            [LEGACY],
+        )
+        (legacy_pkey,) = cursor.fetchone()
+        cursor.execute(f"ALTER TABLE {qn(LEGACY)} DROP CONSTRAINT {qn(legacy_pkey)}")
+        cursor.execute(
+            f"ALTER TABLE {qn(LEGACY)} ADD CONSTRAINT {qn(LEGACY + '_pkey')} "
+            f"PRIMARY KEY USING INDEX {qn(LEGACY + '_pkey')}"
+        )
+
+        cursor.execute(
+            f"CREATE TABLE {qn(TABLE)} (LIKE {qn(LEGACY)} INCLUDING DEFAULTS, "
+            f'PRIMARY KEY (id, "timestamp")) PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f"CREATE SEQUENCE {qn(TABLE + '_id_seq')} OWNED BY {qn(TABLE)}.id")
+        cursor.execute("SELECT setval(%s, %s, false)", [TABLE + "_id_seq", next_id])
+        cursor.execute(
+            f"ALTER TABLE {qn(TABLE)} ALTER COLUMN id "
+            f"SET DEFAULT nextval('{TABLE}_id_seq'::regclass)"
+        )
+        # Индексы родительской таблицы совпадают с индексами legacy-секции,
+        # поэтому при подключении они переиспользуются, а не строятся заново.
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(name)} {definition}")
+
+        cursor.execute(
+            f"ALTER TABLE {qn(TABLE)} ATTACH PARTITION {qn(LEGACY)} "
+            "FOR VALUES FROM (MINVALUE) TO (%s)",
+            [boundary_literal],
+        )
+        for offset in range(MONTHS_AHEAD):
+            partitioning.create_month_partition(
+                connection, partitioning.add_months(boundary, offset)
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('balance_beam', '0002_balanceoperation_history_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_operations_table, elidable=False),
+    ]
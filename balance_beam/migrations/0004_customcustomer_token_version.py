@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balance_beam', '0003_partition_balanceoperation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customcustomer',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
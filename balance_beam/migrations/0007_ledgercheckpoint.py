@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balance_beam', '0006_balanceslot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerCheckpoint',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger_checkpoint', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('operations_total', models.BigIntegerField()),
+                ('through', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка сверки',
+                'verbose_name_plural': 'Контрольные точки сверки',
+            },
+        ),
+    ]
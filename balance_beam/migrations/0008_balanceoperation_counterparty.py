@@ -0,0 +1,73 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from balance_beam import partitioning
+
+INDEXES = [
+    models.Index(
+        condition=models.Q(("counterparty__isnull", False)),
+        fields=["counterparty", "-timestamp"],
+        name="balanceop_counterparty_ts_idx",
+    ),
+    models.Index(
+        condition=models.Q(("transfer_group__isnull", False)),
+        fields=["transfer_group"],
+        name="balanceop_transfer_group_idx",
+    ),
+]
+DEFINITIONS = {
+    "balanceop_counterparty_ts_idx": '("counterparty_id", "timestamp" DESC) WHERE "counterparty_id" IS NOT NULL',
+    "balanceop_transfer_group_idx": '("transfer_group") WHERE "transfer_group" IS NOT NULL',
+}
+
+
+def create_indexes(apps, schema_editor):
+    # Индексы строятся без блокировки записи, на секционированной таблице -
+    # по секциям (см. partitioning.create_index_concurrently).
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        model = apps.get_model("balance_beam", "BalanceOperation")
+        for index in INDEXES:
+            schema_editor.add_index(model, index)
+        return
+    for name, definition in DEFINITIONS.items():
+        partitioning.create_index_concurrently(connection, name, definition)
+
+
+def drop_indexes(apps, schema_editor):
+    model = apps.get_model("balance_beam", "BalanceOperation")
+    for index in INDEXES:
+        schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('balance_beam', '0007_ledgercheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balanceoperation',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='counterparty_operations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='balanceoperation',
+            name='transfer_group',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='balanceoperation', index=index)
+                for index in INDEXES
+            ],
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes, elidable=False),
+            ],
+        ),
+    ]
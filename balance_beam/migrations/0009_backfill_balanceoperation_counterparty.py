@@ -0,0 +1,80 @@
+"""Заполняет counterparty и transfer_group у операций, созданных до их появления.
+
+Второй участник разбирается из строки related_customer вида
+"email, id: N". Операции списания и зачисления одного перевода создавались
+подряд, поэтому пара ищется по соседним id с переставленными участниками и
+противоположными суммами. Строки обновляются пачками по диапазону id, каждая
+пачка в своей транзакции: таблица не блокируется, а прерванную миграцию
+можно запустить снова - обновляются только незаполненные строки.
+"""
+from django.db import migrations, transaction
+
+from balance_beam import partitioning
+
+TABLE = partitioning.TABLE
+CUSTOMERS = "balance_beam_customcustomer"
+BATCH_SIZE = 10000
+
+BACKFILL_COUNTERPARTY = rf"""
+    UPDATE {TABLE} AS operation SET counterparty_id = customer.id
+    FROM {CUSTOMERS} AS customer
+    WHERE operation.id BETWEEN %s AND %s
+      AND operation.counterparty_id IS NULL
+      AND operation.related_customer IS NOT NULL
+      AND customer.id = substring(operation.related_customer FROM ', id: (\d+)$')::bigint
+"""
+
+BACKFILL_TRANSFER_GROUP = f"""
+    WITH pairs AS (
+        SELECT debit.id AS debit_id, credit.id AS credit_id, gen_random_uuid() AS transfer_group
+        FROM {TABLE} AS debit
+        JOIN {TABLE} AS credit
+          ON credit.id = debit.id + 1
+         AND credit.operation_type = 'INCREASE'
+         AND credit.user_id = debit.counterparty_id
+         AND credit.counterparty_id = debit.user_id
+         AND credit.amount = -debit.amount
+         AND credit.transfer_group IS NULL
+         -- Границы по timestamp отсекают лишние секции при поиске пары.
+         AND credit."timestamp" BETWEEN debit."timestamp" AND debit."timestamp" + interval '1 hour'
+        WHERE debit.id BETWEEN %s AND %s
+          AND debit.operation_type = 'TRANSFER'
+          AND debit.success AND debit.text_error IS NULL
+          AND debit.transfer_group IS NULL
+    ), legs AS (
+        SELECT debit_id AS id, transfer_group FROM pairs
+        UNION ALL
+        SELECT credit_id, transfer_group FROM pairs
+    )
+    UPDATE {TABLE} AS operation SET transfer_group = legs.transfer_group
+    FROM legs WHERE operation.id = legs.id
+"""
+
+
+def backfill(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(id), MAX(id) FROM {TABLE}")
+        first, last = cursor.fetchone()
+    if first is None:
+        return
+    # Пары ищутся после заполнения counterparty во всей таблице: зачисление
+    # может оказаться в следующей пачке.
+    for statement in (BACKFILL_COUNTERPARTY, BACKFILL_TRANSFER_GROUP):
+        for start in range(first, last + 1, BATCH_SIZE):
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(statement, [start, start + BATCH_SIZE - 1])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('balance_beam', '0008_balanceoperation_counterparty'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:26
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import DatabaseError, migrations, models
+from django.db.models.functions import Upper
+
+from balance_beam import partitioning
+
+TIMESTAMP_INDEX = models.Index(fields=['timestamp'], name='balanceop_timestamp_idx')
+
+
+def create_timestamp_index(apps, schema_editor):
+    # Секционированная таблица операций индексируется по секциям
+    # (см. partitioning.create_index_concurrently).
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        model = apps.get_model("balance_beam", "BalanceOperation")
+        schema_editor.add_index(model, TIMESTAMP_INDEX)
+        return
+    partitioning.create_index_concurrently(connection, TIMESTAMP_INDEX.name, '("timestamp")')
+
+
+def drop_timestamp_index(apps, schema_editor):
+    model = apps.get_model("balance_beam", "BalanceOperation")
+    schema_editor.remove_index(model, TIMESTAMP_INDEX)
+
+
+TRIGRAM_INDEXES = [
+    GinIndex(OpClass(Upper(field), name='gin_trgm_ops'), name=f'customer_{field}_trgm_idx')
+    for field in ('email', 'first_name', 'last_name', 'phone')
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # pg_trgm входит в contrib и есть не на каждом сервере. Без него индексы
+    # не создаются, и поиск в админке остаётся обычным ILIKE по таблице.
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DatabaseError:
+            # Нет прав на создание расширения.
+            return
+    model = apps.get_model("balance_beam", "CustomCustomer")
+    for index in TRIGRAM_INDEXES:
+        schema_editor.add_index(model, index, concurrently=True)
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for index in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(index.name)}"
+        )
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи, CREATE INDEX CONCURRENTLY не
+    # может выполняться внутри транзакции.
+    atomic = False
+
+    dependencies = [
+        ('balance_beam', '0009_backfill_balanceoperation_counterparty'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='balanceoperation', index=TIMESTAMP_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_timestamp_index, drop_timestamp_index, elidable=False),
+            ],
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='customcustomer', index=index)
+                for index in TRIGRAM_INDEXES
+            ],
+            database_operations=[
+                migrations.RunPython(create_trigram_indexes, drop_trigram_indexes, elidable=False),
+            ],
+        ),
+        AddIndexConcurrently(
+            model_name='customcustomer',
+            index=models.Index(fields=['-date_joined', '-id'], name='customer_joined_id_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balance_beam', '0010_admin_performance_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('operation_type', models.CharField(max_length=8)),
+                ('success', models.BooleanField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('amount_in', models.BigIntegerField(default=0)),
+                ('amount_out', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Итоги операций за день',
+                'verbose_name_plural': 'Итоги операций за день',
+            },
+        ),
+        migrations.CreateModel(
+            name='OperationRollupDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('operation_type', models.CharField(max_length=8)),
+                ('success', models.BooleanField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('amount_in', models.BigIntegerField(default=0)),
+                ('amount_out', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Изменение итогов операций',
+                'verbose_name_plural': 'Изменения итогов операций',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='operationrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'operation_type', 'success'), name='operationrollup_key_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='operationrollupdelta',
+            index=models.Index(fields=['user', 'day'], name='rollupdelta_user_day_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balance_beam', '0014_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='response_headers',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+"""Номера событий outbox по счёту.
+
+Недоставленные события нумеруются по счёту в порядке id, а OutboxSequence
+получает последний номер каждого счёта.
+"""
+from django.db import migrations, models
+
+EVENTS = "balance_beam_outboxevent"
+SEQUENCES = "balance_beam_outboxsequence"
+
+NUMBER_EVENTS = f"""
+    UPDATE {EVENTS} AS event SET sequence = numbered.sequence
+    FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY account_id ORDER BY id) AS sequence
+        FROM {EVENTS}
+    ) AS numbered
+    WHERE event.id = numbered.id
+"""
+
+FILL_SEQUENCES = f"""
+    INSERT INTO {SEQUENCES} (account_id, last_sequence)
+    SELECT account_id, MAX(sequence) FROM {EVENTS} GROUP BY account_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('balance_beam', '0015_idempotencyrecord_response_headers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxSequence',
+            fields=[
+                ('account_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('last_sequence', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Номер события outbox',
+                'verbose_name_plural': 'Номера событий outbox',
+            },
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='sequence',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunSQL(NUMBER_EVENTS, migrations.RunSQL.noop),
+        migrations.RunSQL(FILL_SEQUENCES, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='sequence',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='outboxevent',
+            constraint=models.UniqueConstraint(fields=('account_id', 'sequence'), name='outboxevent_account_sequence_unique'),
+        ),
+    ]
@@ -1,2 +1,9 @@
 from .customer import CustomCustomer, validate_names, validate_phone
 from .balancify import BalanceOperation
+from .idempotency import IdempotencyRecord
+from .slots import BalanceSlot
+from .reconciliation import LedgerCheckpoint
+from .rollups import OperationRollup, OperationRollupDelta
+from .imports import ImportCheckpoint
+from .transfers import TransferRequest
+from .outbox import OutboxEvent, OutboxSequence
@@ -7,6 +7,18 @@ class BalanceOperation(models.Model):
         CustomCustomer, on_delete=models.PROTECT, related_name="balance_operations"
     )
     related_customer = models.CharField(max_length=255, null=True, blank=True)
+    # Второй участник операции. Строка related_customer остаётся подписью
+    # на момент операции, поиск и выборки идут по этому полю.
+    counterparty = models.ForeignKey(
+        CustomCustomer,
+        on_delete=models.PROTECT,
+        related_name="counterparty_operations",
+        null=True,
+        blank=True,
+        db_index=False,
+    )
+    # Общий идентификатор операций списания и зачисления одного перевода.
+    transfer_group = models.UUIDField(null=True, blank=True)
     amount = models.IntegerField()
     OPERATION_TYPES = (
         ("INCREASE", "Increase"),
@@ -17,6 +29,34 @@ class BalanceOperation(models.Model):
     success = models.BooleanField(default=True)
     text_error = models.CharField(max_length=255, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # История операций пользователя: ORDER BY timestamp DESC, id DESC
+            # и keyset-пагинация по (timestamp, id).
+            models.Index(
+                fields=["user", "-timestamp", "-id"],
+                name="balanceop_user_ts_id_idx",
+            ),
+            # Неуспешные операции редки, частичный индекс остаётся маленьким.
+            models.Index(
+                fields=["user", "-timestamp", "-id"],
+                condition=models.Q(success=False),
+                name="balanceop_user_failed_idx",
+            ),
+            models.Index(
+                fields=["counterparty", "-timestamp"],
+                condition=models.Q(counterparty__isnull=False),
+                name="balanceop_counterparty_ts_idx",
+            ),
+            models.Index(
+                fields=["transfer_group"],
+                condition=models.Q(transfer_group__isnull=False),
+                name="balanceop_transfer_group_idx",
+            ),
+            # Фильтр по дате и date_hierarchy в админке, MIN/MAX(timestamp).
+            models.Index(fields=["timestamp"], name="balanceop_timestamp_idx"),
+        ]
+
     def __str__(self) -> str:
         """Return a string representation of the operation."""
         return f"Operation {self.operation_type} for {self.user} in {self.timestamp} datetime"
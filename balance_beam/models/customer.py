@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser, UserManager as DjangoUserManager
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.functions import Upper
 from django.utils.translation import gettext_lazy as _
 
 
@@ -89,6 +91,10 @@ class CustomCustomer(AbstractUser):
         null=True,
     )
     birth_date = models.DateField(null=True, blank=True)
+    # Версия JWT-токенов пользователя: увеличение отзывает все выданные токены.
+    token_version = models.PositiveIntegerField(default=0)
+    # Число слотов баланса горячего счёта (см. BalanceSlot); 0 - обычный счёт.
+    balance_slot_count = models.PositiveSmallIntegerField(default=0)
 
     objects = CustomerManager()
 
@@ -98,6 +104,72 @@ class CustomCustomer(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # Поиск в админке: icontains превращается в UPPER(поле) LIKE
+            # '%...%', такие условия обслуживает триграммный индекс на UPPER.
+            # Миграция 0010 создаёт эти индексы, только если на сервере есть
+            # расширение pg_trgm.
+            *[
+                GinIndex(
+                    OpClass(Upper(field), name="gin_trgm_ops"),
+                    name=f"customer_{field}_trgm_idx",
+                )
+                for field in ("email", "first_name", "last_name", "phone")
+            ],
+            # Сортировка списка пользователей в админке.
+            models.Index(fields=["-date_joined", "-id"], name="customer_joined_id_idx"),
+        ]
 
     def __str__(self):
         return self.email
+
+    @classmethod
+    def from_token_claims(
+        cls, user_id: int, is_active: bool, token_version: int
+    ) -> "CustomCustomer":
+        """
+        Build a customer from JWT claims without querying the database.
+
+        The other fields are deferred and loaded together by one query on the
+        first access to any of them.
+        """
+        claims = {"id": user_id, "is_active": is_active, "token_version": token_version}
+        field_names = [
+            field.attname for field in cls._meta.concrete_fields if field.attname in claims
+        ]
+        user = cls.from_db(
+            router.db_for_read(cls), field_names, [claims[name] for name in field_names]
+        )
+        user._load_deferred_together = True
+        return user
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if self.is_active or self.pk is None or (
+            update_fields is not None and "is_active" not in update_fields
+        ):
+            super().save(*args, **kwargs)
+            return
+        # Отключение пользователя отзывает его токены: в уже выданных токенах
+        # claim is_active остаётся true, а эндпоинты чтения строку
+        # пользователя не читают.
+        from ..authentication import revoke_tokens
+
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            deactivated = (
+                type(self)._base_manager.using(using).filter(pk=self.pk, is_active=True).exists()
+            )
+            if deactivated:
+                revoke_tokens(self)
+                if update_fields is not None:
+                    kwargs["update_fields"] = {*update_fields, "token_version"}
+            super().save(*args, **kwargs)
+
+    def refresh_from_db(self, using=None, fields=None):
+        # Пользователь из claims токена при первом обращении к отложенному полю
+        # загружается целиком, а не отдельным запросом на каждое поле.
+        if fields is not None and getattr(self, "_load_deferred_together", False):
+            self._load_deferred_together = False
+            fields = list(self.get_deferred_fields() | set(fields))
+        super().refresh_from_db(using=using, fields=fields)
@@ -0,0 +1,33 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from ..models import CustomCustomer
+
+
+class IdempotencyRecord(models.Model):
+    """Ответ на запрос с заголовком Idempotency-Key.
+
+    Повтор запроса с тем же ключом получает сохранённый ответ, не выполняя
+    операцию снова. Записи удаляются после `expires_at`.
+    """
+
+    user = models.ForeignKey(
+        CustomCustomer, on_delete=models.CASCADE, related_name="idempotency_records"
+    )
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # Заголовки из idempotency.STORED_HEADERS, например Location.
+    response_headers = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="idempotency_user_key_unique"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"Idempotency key {self.key} of {self.user_id}"
@@ -0,0 +1,23 @@
+from django.db import models
+
+
+class ImportCheckpoint(models.Model):
+    """Сколько записей источника обработала загрузка пользователей.
+
+    Команда import_customers сохраняет контрольную точку в той же транзакции,
+    что и порцию новых пользователей, поэтому повторный запуск продолжает
+    с первой необработанной записи, не пропуская и не дублируя строки.
+    """
+
+    job = models.CharField(max_length=255, unique=True)
+    records = models.PositiveBigIntegerField(default=0)
+    imported = models.PositiveBigIntegerField(default=0)
+    rejected = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Контрольная точка загрузки"
+        verbose_name_plural = "Контрольные точки загрузки"
+
+    def __str__(self) -> str:
+        return f"Import {self.job} through record {self.records}"
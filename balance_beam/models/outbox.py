@@ -0,0 +1,51 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class OutboxEvent(models.Model):
+    """Событие для внешних систем, ещё не доставленное диспетчером.
+
+    Строка пишется в той же транзакции, что и операция, и удаляется после
+    доставки командой dispatch_outbox. `sequence` - номер события среди
+    событий счёта, без пропусков и в порядке фиксации транзакций: номера
+    выдаёт OutboxSequence.
+    """
+
+    account_id = models.BigIntegerField()
+    sequence = models.BigIntegerField()
+    event_type = models.CharField(max_length=64)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Событие outbox"
+        verbose_name_plural = "События outbox"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account_id", "sequence"], name="outboxevent_account_sequence_unique"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.event_type} {self.account_id}#{self.sequence}"
+
+
+class OutboxSequence(models.Model):
+    """Последний номер события счёта в outbox.
+
+    Строка счёта увеличивается в транзакции, записывающей его события, и
+    остаётся заблокированной до её фиксации. Поэтому транзакции с событиями
+    одного счёта, в том числе зачисления на горячий счёт через слоты,
+    получают номера по очереди и в порядке фиксации, независимо от того,
+    блокировали ли они строку пользователя.
+    """
+
+    account_id = models.BigIntegerField(primary_key=True)
+    last_sequence = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Номер события outbox"
+        verbose_name_plural = "Номера событий outbox"
+
+    def __str__(self) -> str:
+        return f"Outbox sequence of {self.account_id}: {self.last_sequence}"
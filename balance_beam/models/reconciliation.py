@@ -0,0 +1,26 @@
+from django.db import models
+from ..models import CustomCustomer
+
+
+class LedgerCheckpoint(models.Model):
+    """Сумма операций пользователя на момент `through`.
+
+    Команда reconcile_balances сохраняет сумму успешных операций, чтобы при
+    следующем запуске читать только операции после `through`.
+    """
+
+    customer = models.OneToOneField(
+        CustomCustomer,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="ledger_checkpoint",
+    )
+    operations_total = models.BigIntegerField()
+    through = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Контрольная точка сверки"
+        verbose_name_plural = "Контрольные точки сверки"
+
+    def __str__(self) -> str:
+        return f"Ledger checkpoint of {self.customer_id} through {self.through}"
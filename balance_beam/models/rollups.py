@@ -0,0 +1,65 @@
+from django.db import models
+from ..models import CustomCustomer
+
+
+class RollupCounters(models.Model):
+    """Итоги операций пользователя за день (UTC) по типу и успешности.
+
+    Успешная операция - изменившая баланс: `success` и без `text_error`.
+    Суммы хранятся в копейках: зачисления в `amount_in`, списания по модулю
+    в `amount_out`.
+    """
+
+    # Индекс по пользователю - первое поле уникального ключа и индекса дочерних моделей.
+    user = models.ForeignKey(
+        CustomCustomer, on_delete=models.CASCADE, related_name="+", db_index=False
+    )
+    day = models.DateField()
+    operation_type = models.CharField(max_length=8)
+    success = models.BooleanField()
+    count = models.BigIntegerField(default=0)
+    amount_in = models.BigIntegerField(default=0)
+    amount_out = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class OperationRollup(RollupCounters):
+    """Итоги операций для выписок (balance_beam/rollups.py).
+
+    Обновляются в транзакции операции; итоги горячих счетов сначала
+    копятся в OperationRollupDelta.
+    """
+
+    class Meta:
+        verbose_name = "Итоги операций за день"
+        verbose_name_plural = "Итоги операций за день"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "day", "operation_type", "success"],
+                name="operationrollup_key_unique",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"Rollup of {self.user_id} for {self.day}"
+
+
+class OperationRollupDelta(RollupCounters):
+    """Ещё не применённое к OperationRollup изменение итогов.
+
+    Строки только вставляются, поэтому одновременные операции одного
+    пользователя не ждут друг друга. Команда apply_rollup_deltas переносит
+    их в OperationRollup.
+    """
+
+    class Meta:
+        verbose_name = "Изменение итогов операций"
+        verbose_name_plural = "Изменения итогов операций"
+        indexes = [
+            models.Index(fields=["user", "day"], name="rollupdelta_user_day_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"Rollup delta of {self.user_id} for {self.day}"
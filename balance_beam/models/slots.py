@@ -0,0 +1,30 @@
+from django.db import models
+from ..models import CustomCustomer
+
+
+class BalanceSlot(models.Model):
+    """Часть баланса горячего счёта.
+
+    Баланс счёта с `balance_slot_count > 0` складывается из поля
+    `CustomCustomer.balance` и балансов его слотов. Зачисления попадают в
+    случайный слот и не блокируют строку пользователя, списания переносят
+    деньги из слотов в основной баланс (balance_beam/hot_accounts.py).
+    """
+
+    customer = models.ForeignKey(
+        CustomCustomer, on_delete=models.CASCADE, related_name="balance_slots"
+    )
+    slot = models.PositiveSmallIntegerField()
+    balance = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Слот баланса"
+        verbose_name_plural = "Слоты баланса"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["customer", "slot"], name="balanceslot_customer_slot_unique"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"Slot {self.slot} of {self.customer_id}"
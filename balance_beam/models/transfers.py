@@ -0,0 +1,62 @@
+from django.db import models
+from django.utils import timezone
+
+from ..models import CustomCustomer
+
+
+class TransferRequest(models.Model):
+    """Перевод, принятый асинхронным эндпоинтом и ожидающий исполнения.
+
+    Команда process_transfers забирает запросы пачками (SELECT ... FOR UPDATE
+    SKIP LOCKED) и исполняет их через BalanceService. Взятый запрос остаётся
+    PROCESSING до available_at: если воркер не завершил его к этому времени,
+    запрос снова может взять другой воркер. claim_token отличает текущую
+    попытку от устаревших.
+    """
+
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+    STATUSES = (
+        (PENDING, "Pending"),
+        (PROCESSING, "Processing"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    )
+    ACTIVE_STATUSES = (PENDING, PROCESSING)
+
+    sender = models.ForeignKey(
+        CustomCustomer, on_delete=models.PROTECT, related_name="transfer_requests"
+    )
+    recipient = models.ForeignKey(
+        CustomCustomer, on_delete=models.PROTECT, related_name="+", db_index=False
+    )
+    amount = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Когда запрос можно взять: время следующей попытки для PENDING и
+    # окончание аренды для PROCESSING.
+    available_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.UUIDField(null=True, blank=True)
+    error = models.CharField(max_length=255, null=True, blank=True)
+    # Баланс отправителя после перевода, в копейках.
+    balance_after = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Запрос перевода"
+        verbose_name_plural = "Запросы переводов"
+        indexes = [
+            # Очередь: только незавершённые запросы, поэтому индекс не растёт
+            # вместе с историей.
+            models.Index(
+                fields=["available_at", "id"],
+                condition=models.Q(status__in=("PENDING", "PROCESSING")),
+                name="transfer_request_queue_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"Transfer request {self.pk}: {self.amount} to {self.recipient_id} ({self.status})"
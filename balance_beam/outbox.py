@@ -0,0 +1,309 @@
+"""Transactional outbox событий операций для внешних систем.
+
+Уведомлениям, антифроду и бухгалтерии нужны все операции, но обращаться к
+ним внутри транзакций BalanceService значит дольше держать блокировки.
+Поэтому BalanceService в той же транзакции, что и операции, записывает
+строки OutboxEvent (при OUTBOX_ENABLED), а команда dispatch_outbox забирает
+их большими пачками в порядке id, передаёт получателю (balance_beam/sinks.py)
+и удаляет доставленные.
+
+Порядок событий счёта задаёт сам outbox, а не блокировка строки
+пользователя, которую зачисления на горячий счёт через слоты не берут.
+Номер события выдаёт строка счёта в OutboxSequence: она остаётся
+заблокированной до фиксации транзакции, поэтому транзакции с событиями
+одного счёта нумеруют их по очереди, без пропусков, и получают id событий в
+том же порядке. Номера берутся последними блокировками транзакции, одним
+запросом в порядке счетов, так что взаимных блокировок они не добавляют, а
+одновременные зачисления на горячий счёт ждут друг друга только на время
+записи события и фиксации.
+
+События делятся по счетам на OUTBOX_PARTITIONS частей, каждую часть
+доставляет один диспетчер: его держит advisory lock PostgreSQL, второй
+диспетчер той же части не запускается. Поэтому события каждого счёта
+приходят строго по порядку номеров.
+
+Пока получатель не принял пачку, её события не удаляются и следующие за
+ними не отправляются. После ошибки диспетчер ждёт (Retry-After получателя
+или удваивающуюся задержку до OUTBOX_MAX_RETRY_DELAY) и уменьшает пачку
+вдвое, после успешных доставок пачка снова растёт до OUTBOX_BATCH_SIZE.
+"""
+import time
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from . import metrics
+from .conf import get_setting
+from .models import BalanceOperation, OutboxEvent, OutboxSequence
+from .sinks import EventSink, SinkError
+
+EVENT_OPERATION = "balance.operation"
+# Первый ключ advisory lock диспетчеров, второй - номер части.
+LOCK_CLASS = 0x0B0C
+
+# Часть -> (возраст самого старого недоставленного события в секундах,
+# текущий предел пачки) у диспетчеров этого процесса, для метрик.
+dispatcher_state: dict[int, tuple[float, int]] = {}
+
+# Операции, события которых откладываются до выхода из batched().
+_batch: ContextVar[list[BalanceOperation] | None] = ContextVar(
+    "balance_beam_outbox_batch", default=None
+)
+
+
+def operation_payload(operation: BalanceOperation) -> dict:
+    """Return the event data of a saved operation."""
+    return {
+        "id": operation.pk,
+        "user": operation.user_id,
+        "amount": operation.amount,
+        "operation_type": operation.operation_type,
+        # DjangoJSONEncoder оставил бы только миллисекунды.
+        "timestamp": operation.timestamp.isoformat(),
+        "success": operation.success,
+        "text_error": operation.text_error,
+        "related_customer": operation.related_customer,
+        "counterparty": operation.counterparty_id,
+        "transfer_group": operation.transfer_group,
+    }
+
+
+def record_operations(operations: Iterable[BalanceOperation]) -> None:
+    """
+    Add outbox events for saved operations while OUTBOX_ENABLED is on. Must
+    be called in the transaction that created them, after its other writes,
+    so that the events commit or roll back with them. Inside batched() the
+    events are written when the block exits.
+    """
+    if not get_setting("OUTBOX_ENABLED"):
+        return
+    batch = _batch.get()
+    if batch is not None:
+        batch.extend(operations)
+        return
+    _write_events(list(operations))
+
+
+@contextmanager
+def batched() -> Iterator[None]:
+    """
+    Write the events recorded inside the block together when it exits.
+
+    For a transaction recording operations of several accounts in separate
+    calls: the sequence numbers of all the accounts are then taken in one
+    statement and in account order, like in a single call. Nothing is
+    written if the block raises, as its transaction rolls back; a nested
+    block that raises drops only its own operations, like a savepoint.
+    """
+    batch = _batch.get()
+    if batch is not None:
+        start = len(batch)
+        try:
+            yield
+        except BaseException:
+            del batch[start:]
+            raise
+        return
+    batch = []
+    token = _batch.set(batch)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+    _write_events(batch)
+
+
+def allocate_sequences(counts: dict[int, int]) -> dict[int, int]:
+    """
+    Reserve sequence numbers for new events of accounts.
+
+    The OutboxSequence rows stay locked until the transaction ends; they are
+    locked in account order, so concurrent callers can't deadlock.
+    Args:
+        counts (dict[int, int]): The number of new events per account.
+    Returns:
+        dict[int, int]: The last reserved number per account.
+    """
+    connection = connections[router.db_for_write(OutboxSequence)]
+    table = connection.ops.quote_name(OutboxSequence._meta.db_table)
+    placeholders = ", ".join(["(%s, %s)"] * len(counts))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (account_id, last_sequence) VALUES {placeholders} "
+            f"ON CONFLICT (account_id) DO UPDATE "
+            f"SET last_sequence = {table}.last_sequence + EXCLUDED.last_sequence "
+            "RETURNING account_id, last_sequence",
+            [value for account_id in sorted(counts) for value in (account_id, counts[account_id])],
+        )
+        return dict(cursor.fetchall())
+
+
+def _write_events(operations: list[BalanceOperation]) -> None:
+    if not operations:
+        return
+    counts = Counter(operation.user_id for operation in operations)
+    last = allocate_sequences(counts)
+    # Номера счёта идут подряд и заканчиваются выданным последним.
+    next_sequence = {
+        account_id: last[account_id] - count + 1 for account_id, count in counts.items()
+    }
+    events = []
+    for operation in operations:
+        sequence = next_sequence[operation.user_id]
+        next_sequence[operation.user_id] += 1
+        events.append(
+            OutboxEvent(
+                account_id=operation.user_id,
+                sequence=sequence,
+                event_type=EVENT_OPERATION,
+                payload=operation_payload(operation),
+            )
+        )
+    OutboxEvent.objects.bulk_create(events)
+
+
+def event_message(event: OutboxEvent) -> dict:
+    """Return the message a sink receives for an event."""
+    return {
+        "id": event.pk,
+        "type": event.event_type,
+        "account": event.account_id,
+        "sequence": event.sequence,
+        "created_at": event.created_at,
+        "data": event.payload,
+    }
+
+
+@contextmanager
+def partition_lock(partition: int, using: str = DEFAULT_DB_ALIAS) -> Iterator[bool]:
+    """
+    Hold the session advisory lock of a partition (PostgreSQL; elsewhere always acquired).
+    Yields:
+        bool: Whether the lock was acquired; False if another dispatcher holds it.
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        yield True
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [LOCK_CLASS, partition])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired and connection.is_usable():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [LOCK_CLASS, partition])
+
+
+class Dispatcher:
+    """Deliver the outbox events of one partition to a sink, oldest first."""
+
+    def __init__(
+        self,
+        sink: EventSink,
+        partition: int = 0,
+        partitions: int | None = None,
+        batch_size: int | None = None,
+        poll_interval: float | None = None,
+    ) -> None:
+        self.sink = sink
+        self.partition = partition
+        self.partitions = partitions or get_setting("OUTBOX_PARTITIONS")
+        self.max_batch_size = batch_size or get_setting("OUTBOX_BATCH_SIZE")
+        self.batch_size = self.max_batch_size
+        self.poll_interval = (
+            get_setting("OUTBOX_POLL_INTERVAL") if poll_interval is None else poll_interval
+        )
+
+    def pending(self, limit: int) -> list[OutboxEvent]:
+        """Return the oldest undelivered events of the partition."""
+        events = OutboxEvent.objects.order_by("id")
+        if self.partitions > 1:
+            events = events.alias(partition=Mod("account_id", self.partitions)).filter(
+                partition=self.partition
+            )
+        return list(events[:limit])
+
+    def dispatch(self) -> int:
+        """
+        Deliver one batch and delete its events.
+        Returns:
+            int: The number of delivered events; 0 when the partition is drained.
+        Raises:
+            SinkError: If the sink didn't accept the batch; its events are kept.
+        """
+        events = self.pending(self.batch_size)
+        now = timezone.now()
+        age = (now - events[0].created_at).total_seconds() if events else 0.0
+        dispatcher_state[self.partition] = (age, self.batch_size)
+        if not events:
+            return 0
+        self.sink.send([event_message(event) for event in events])
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+        if metrics.enabled():
+            delivered = timezone.now()
+            metrics.registry.inc("balance_beam_outbox_delivered_total", {}, len(events))
+            metrics.registry.observe("balance_beam_outbox_batch_size", {}, len(events))
+            for event in events:
+                metrics.registry.observe(
+                    "balance_beam_outbox_lag_seconds",
+                    {},
+                    (delivered - event.created_at).total_seconds(),
+                )
+        return len(events)
+
+    def run(self, should_stop: Callable[[], bool] = lambda: False, drain: bool = False) -> Counter:
+        """
+        Deliver batches until stopped, backing off while the sink fails.
+        Args:
+            should_stop (Callable[[], bool]): Checked between batches and while waiting.
+            drain (bool): Return once the partition has no events.
+        Returns:
+            Counter: Delivered events, batches and failed deliveries.
+        """
+        stats = Counter()
+        failures = 0
+        while not should_stop():
+            try:
+                delivered = self.dispatch()
+            except SinkError as error:
+                failures += 1
+                stats["failures"] += 1
+                if metrics.enabled():
+                    metrics.registry.inc(
+                        "balance_beam_outbox_delivery_failures_total", {"reason": error.reason}
+                    )
+                self.batch_size = max(1, self.batch_size // 2)
+                delay = error.retry_after
+                if delay is None:
+                    delay = min(
+                        get_setting("OUTBOX_RETRY_DELAY") * 2 ** (failures - 1),
+                        get_setting("OUTBOX_MAX_RETRY_DELAY"),
+                    )
+                _sleep(delay, should_stop)
+                continue
+            failures = 0
+            if delivered:
+                stats["delivered"] += delivered
+                stats["batches"] += 1
+                self.batch_size = min(
+                    self.max_batch_size, self.batch_size + max(1, self.max_batch_size // 8)
+                )
+                continue
+            if drain:
+                break
+            _sleep(self.poll_interval, should_stop)
+        return stats
+
+
+def _sleep(seconds: float, should_stop: Callable[[], bool]) -> None:
+    # Ожидание повтора может быть долгим: проверяем остановку по ходу.
+    deadline = time.monotonic() + seconds
+    while not should_stop() and (left := deadline - time.monotonic()) > 0:
+        time.sleep(min(left, 0.1))
@@ -0,0 +1,135 @@
+"""Помесячное секционирование таблицы операций (PostgreSQL).
+
+Таблица BalanceOperation секционируется по диапазону `timestamp`: одна
+секция на календарный месяц (UTC). Таблица, существовавшая до
+секционирования, подключается как секция "legacy" со всеми строками до
+первой помесячной секции. Функции модуля используются миграцией 0003 и
+командой `manage.py partition_operations`.
+"""
+import re
+from datetime import date
+
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+TABLE = "balance_beam_balanceoperation"
+LEGACY_PARTITION = f"{TABLE}_legacy"
+_MONTH_PARTITION_RE = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+
+def month_start(value: date) -> date:
+    """Return the first day of the month of `value`."""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    """Shift the first day of a month by `count` months."""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """Return the name of the partition holding the month of `month`."""
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+def is_partitioned(connection: BaseDatabaseWrapper) -> bool:
+    """Check whether the operations table is already partitioned."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def attached_partitions(connection: BaseDatabaseWrapper) -> list[str]:
+    """Return the names of all partitions attached to the operations table."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass",
+            [TABLE],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def monthly_partitions(connection: BaseDatabaseWrapper) -> dict[date, str]:
+    """Return the attached monthly partitions by the first day of their month."""
+    partitions = {}
+    for name in attached_partitions(connection):
+        match = _MONTH_PARTITION_RE.match(name)
+        if match:
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def create_index_concurrently(
+    connection: BaseDatabaseWrapper, name: str, definition: str
+) -> None:
+    """
+    Create an index on the operations table without blocking writes.
+
+    CREATE INDEX CONCURRENTLY isn't supported on a partitioned table, so the
+    index is created on the parent only, built concurrently on every
+    partition and attached, which makes the parent index valid. Partitions
+    created later get the index automatically. Safe to rerun after a failure.
+    Can't run inside a transaction block.
+    Args:
+        connection: The database connection.
+        name (str): The name of the index on the parent table.
+        definition (str): The index definition after the table name, e.g.
+            '("user_id", "timestamp" DESC) WHERE "success" = false'.
+    """
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if not is_partitioned(connection):
+            cursor.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {qn(name)} ON {qn(TABLE)} {definition}"
+            )
+            return
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {qn(name)} ON ONLY {qn(TABLE)} {definition}")
+        for partition in attached_partitions(connection):
+            index = f"{name}_{partition.removeprefix(TABLE + '_')}"
+            # После сбоя CONCURRENTLY оставляет невалидный индекс, его
+            # нужно построить заново.
+            cursor.execute(
+                "SELECT indisvalid, EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = indexrelid) "
+                "FROM pg_index WHERE indexrelid = to_regclass(%s)",
+                [index],
+            )
+            state = cursor.fetchone()
+            if state is not None and not state[0]:
+                cursor.execute(f"DROP INDEX CONCURRENTLY {qn(index)}")
+                state = None
+            if state is None:
+                cursor.execute(
+                    f"CREATE INDEX CONCURRENTLY {qn(index)} ON {qn(partition)} {definition}"
+                )
+            if state is None or not state[1]:
+                cursor.execute(f"ALTER INDEX {qn(name)} ATTACH PARTITION {qn(index)}")
+
+
+def create_month_partition(connection: BaseDatabaseWrapper, month: date) -> str:
+    """Create the partition for `month` if it doesn't exist and return its name."""
+    name = partition_name(month)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(name)} "
+            f"PARTITION OF {connection.ops.quote_name(TABLE)} "
+            "FOR VALUES FROM (%s) TO (%s)",
+            [f"{month} 00:00:00+00", f"{add_months(month, 1)} 00:00:00+00"],
+        )
+    return name
+
+
+def detach_partition(connection: BaseDatabaseWrapper, name: str) -> None:
+    """
+    Detach a partition without blocking queries on the parent table.
+
+    The detached table is kept, so it can be archived or dropped separately.
+    DETACH ... CONCURRENTLY can't run inside a transaction block.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {connection.ops.quote_name(TABLE)} "
+            f"DETACH PARTITION {connection.ops.quote_name(name)} CONCURRENTLY"
+        )
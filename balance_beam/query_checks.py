@@ -0,0 +1,135 @@
+"""Бюджеты запросов к базе и проверка планов запросов горячих путей.
+
+QUERY_BUDGETS задаёт наибольшее число запросов для каждого эндпоинта и
+метода BalanceService на горячем пути. В тестах путь выполняется внутри
+`query_budget(name)`, который падает с QueryBudgetExceeded и списком
+запросов, если бюджет превышен. Команды управления транзакцией (BEGIN,
+COMMIT, SAVEPOINT) не считаются: внутри транзакции теста они другие, чем
+в работе сервиса.
+
+Команда `manage.py check_query_plans` выполняет все пути из HOT_PATHS
+(balance_beam/testing.py) на сгенерированных данных в транзакции, которая
+затем откатывается, проверяет бюджеты и выполняет EXPLAIN для каждого
+запроса. Последовательное чтение или сортировка больших таблиц (от
+`large_rows` строк по оценке планировщика) считаются ошибкой.
+"""
+import json
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+from .models import BalanceOperation
+
+# Наибольшее число запросов к базе на один вызов пути. Бюджеты записи
+# включают события outbox (OUTBOX_ENABLED): номера событий и их INSERT на
+# каждую транзакцию с операциями.
+QUERY_BUDGETS = {
+    "api:increase_balance": 7,
+    "api:transfer_balance": 11,
+    "api:transfer_balance_batch": 7,
+    "api:transfer_balance_async": 2,
+    "api:check_balance": 1,
+    "api:check_balance_in_rubles": 1,
+    "api:get_operations_history": 1,
+    "api:get_operations_history_filtered": 1,
+    "api:get_statement": 2,
+    "service:increase_balance": 6,
+    "service:transfer_balance": 10,
+    "service:transfer_many": 6,
+    "service:check_user_balance_in_kopecks": 1,
+    "service:get_operations_page": 1,
+}
+_TRANSACTION_CONTROL = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE SAVEPOINT")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a hot path makes more queries than its budget allows."""
+
+
+def counted_queries(captured: CaptureQueriesContext) -> list[str]:
+    """Return the SQL of the captured queries, without the transaction control statements."""
+    return [
+        query["sql"]
+        for query in captured.captured_queries
+        if not query["sql"].startswith(_TRANSACTION_CONTROL)
+    ]
+
+
+@contextmanager
+def query_budget(name: str, using: str = DEFAULT_DB_ALIAS) -> Iterator[CaptureQueriesContext]:
+    """
+    Fail when the code inside makes more queries than QUERY_BUDGETS[name].
+    Args:
+        name (str): The hot path, a key of QUERY_BUDGETS.
+        using (str): The database alias to watch.
+    Raises:
+        QueryBudgetExceeded: If the budget is exceeded.
+    """
+    budget = QUERY_BUDGETS[name]
+    with CaptureQueriesContext(connections[using]) as captured:
+        yield captured
+    queries = counted_queries(captured)
+    if len(queries) > budget:
+        listing = "\n".join(f"{number}. {sql}" for number, sql in enumerate(queries, 1))
+        raise QueryBudgetExceeded(
+            f"{name} made {len(queries)} queries, the budget is {budget}:\n{listing}"
+        )
+
+
+def seed_operations(
+    user_ids: list[int], counterparty_id: int, rows: int, using: str = DEFAULT_DB_ALIAS
+) -> None:
+    """Insert `rows` operations spread over the users and the last hours with one query (PostgreSQL)."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {BalanceOperation._meta.db_table} "
+            "(user_id, counterparty_id, amount, operation_type, timestamp, success) "
+            "SELECT (%s::bigint[])[1 + n %% %s], %s, 100 + n %% 1000, "
+            "CASE WHEN n %% 3 = 0 THEN 'TRANSFER' ELSE 'INCREASE' END, "
+            "now() - n * interval '10 milliseconds', n %% 50 <> 0 "
+            "FROM generate_series(1, %s) AS n",
+            [user_ids, len(user_ids), counterparty_id, rows],
+        )
+
+
+def plan_problems(sql: str, large_rows: int, using: str = DEFAULT_DB_ALIAS) -> list[str]:
+    """
+    EXPLAIN a query and describe its sequential scans and sorts of large tables (PostgreSQL).
+    Args:
+        sql (str): The query, with the parameters inlined.
+        large_rows (int): The estimated number of rows from which a table is large.
+    Returns:
+        list[str]: The problems found; empty if the plan is fine.
+    """
+    connection = connections[using]
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        problems = []
+        for node in _plan_nodes(plan[0]["Plan"]):
+            if node["Node Type"] == "Seq Scan":
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE relname = %s", [node["Relation Name"]]
+                )
+                row = cursor.fetchone()
+                if row is not None and row[0] >= large_rows:
+                    problems.append(
+                        f"sequential scan of {node['Relation Name']} (~{int(row[0])} rows)"
+                    )
+            elif node["Node Type"] in ("Sort", "Incremental Sort"):
+                sorted_rows = node["Plans"][0]["Plan Rows"] if node.get("Plans") else node["Plan Rows"]
+                if sorted_rows >= large_rows:
+                    problems.append(f"sort of ~{sorted_rows} rows by {', '.join(node['Sort Key'])}")
+    return problems
+
+
+def _plan_nodes(node: dict) -> Iterator[dict]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
@@ -0,0 +1,104 @@
+"""Поиск получателя перевода по id, email или телефону.
+
+Получатель ищется одним запросом по уникальному индексу поля (первичный
+ключ, email или телефон), из базы читается только id. Найденные id
+кешируются на RECIPIENT_CACHE_TIMEOUT секунд, так что проверка получателя
+при повторных переводах не обращается к базе. Отсутствие получателя не
+кешируется: новый пользователь находится сразу. Контроль допуска читает
+только кеш (`cached_recipient`), чтобы не обращаться к базе до допуска
+запроса. Смена телефона через
+UserSerializerForUpdate сбрасывает записи старого и нового номера после
+фиксации транзакции.
+"""
+import hashlib
+from typing import Any
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .conf import get_setting
+from .models import CustomCustomer
+
+# Поле запроса перевода -> поле модели с уникальным индексом.
+RECIPIENT_LOOKUPS = {
+    "recipient_id": "pk",
+    "recipient_email": "email",
+    "recipient_phone": "phone",
+}
+
+
+def _cache():
+    return caches[get_setting("CACHE_ALIAS")]
+
+
+def _cache_key(lookup: str, value: Any) -> str:
+    # Email может быть длиннее допустимого ключа memcached.
+    digest = hashlib.blake2b(str(value).encode(), digest_size=16).hexdigest()
+    return f"balance_beam:recipient:{lookup}:{digest}"
+
+
+def normalize_recipient(field: str, value: Any) -> Any:
+    """Bring a recipient value to the form it is stored in."""
+    if field == "recipient_email":
+        return CustomCustomer.objects.normalize_email(value.strip())
+    if field == "recipient_phone":
+        return value.strip()
+    return int(value)
+
+
+def resolve_recipient(field: str, value: Any) -> int | None:
+    """
+    Return the id of the customer a transfer is addressed to.
+    Args:
+        field (str): The request field, a key of RECIPIENT_LOOKUPS.
+        value: The id, the email or the phone of the recipient.
+    Returns:
+        int | None: The customer id, or None if there is no such customer.
+    """
+    lookup = RECIPIENT_LOOKUPS[field]
+    value = normalize_recipient(field, value)
+    timeout = get_setting("RECIPIENT_CACHE_TIMEOUT")
+    key = _cache_key(lookup, value)
+    if timeout:
+        customer_id = _cache().get(key)
+        if customer_id is not None:
+            return customer_id
+    customer_id = (
+        CustomCustomer.objects.filter(**{lookup: value}).values_list("pk", flat=True).first()
+    )
+    if customer_id is not None and timeout:
+        _cache().set(key, customer_id, timeout)
+    return customer_id
+
+
+def cached_recipient(field: str, value: Any) -> int | None:
+    """
+    Return the id of the customer a transfer is addressed to, without querying the database.
+
+    An id is returned as given; an email or a phone only if `resolve_recipient`
+    has cached it.
+    Args:
+        field (str): The request field, a key of RECIPIENT_LOOKUPS.
+        value: The id, the email or the phone of the recipient.
+    Returns:
+        int | None: The customer id, or None if it isn't known yet.
+    """
+    lookup = RECIPIENT_LOOKUPS[field]
+    value = normalize_recipient(field, value)
+    if lookup == "pk":
+        return value
+    if not get_setting("RECIPIENT_CACHE_TIMEOUT"):
+        return None
+    return _cache().get(_cache_key(lookup, value))
+
+
+def forget_recipient(field: str, *values: Any) -> None:
+    """Drop the cached ids of the given values of a recipient field, after the transaction commits."""
+    lookup = RECIPIENT_LOOKUPS[field]
+    keys = [
+        _cache_key(lookup, normalize_recipient(field, value))
+        for value in values
+        if value not in (None, "")
+    ]
+    if keys:
+        transaction.on_commit(lambda: _cache().delete_many(keys))
@@ -0,0 +1,209 @@
+"""Сверка балансов с журналом операций (PostgreSQL).
+
+Баланс пользователя (вместе со слотами горячего счёта) должен быть равен
+сумме его успешных операций. Пространство id пользователей делится на
+диапазоны, каждый диапазон сверяется одним SQL-запросом: суммы считает база,
+а строки по пользователям читаются серверным курсором порциями, так что
+память процесса не зависит от числа операций. Суммы операций до водяной
+отметки сохраняются в LedgerCheckpoint, и следующий запуск читает только
+более новые операции. Используется командой `manage.py reconcile_balances`.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import BalanceOperation, BalanceSlot, CustomCustomer, LedgerCheckpoint
+
+FETCH_SIZE = 2000
+
+
+@dataclass
+class Mismatch:
+    """An account whose balance differs from the sum of its operations."""
+
+    customer_id: int
+    email: str
+    balance: int
+    expected: int
+
+    @property
+    def difference(self) -> int:
+        return self.balance - self.expected
+
+
+@dataclass
+class RangeResult:
+    """Outcome of reconciling one range of customer ids."""
+
+    first_id: int
+    last_id: int
+    checked: int = 0
+    mismatches: list[Mismatch] = field(default_factory=list)
+
+
+def id_ranges(range_size: int, using: str = DEFAULT_DB_ALIAS) -> list[tuple[int, int]]:
+    """Split the customer id space into inclusive ranges of `range_size` ids."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT MIN(id), MAX(id) FROM {CustomCustomer._meta.db_table}"
+        )
+        first, last = cursor.fetchone()
+    if first is None:
+        return []
+    return [
+        (start, min(start + range_size - 1, last))
+        for start in range(first, last + 1, range_size)
+    ]
+
+
+def _range_since(
+    first_id: int, last_id: int, incremental: bool, using: str
+) -> datetime | None:
+    """
+    Return the oldest checkpoint of the range, or None if the whole history
+    must be read: a full run, or a customer of the range has no checkpoint.
+    """
+    if not incremental:
+        return None
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT bool_and(checkpoint.through IS NOT NULL), MIN(checkpoint.through) "
+            f"FROM {CustomCustomer._meta.db_table} AS customer "
+            f"LEFT JOIN {LedgerCheckpoint._meta.db_table} AS checkpoint "
+            "ON checkpoint.customer_id = customer.id "
+            "WHERE customer.id BETWEEN %s AND %s",
+            [first_id, last_id],
+        )
+        covered, since = cursor.fetchone()
+    return since if covered else None
+
+
+def _range_sql(incremental: bool, since: datetime | None) -> str:
+    """Build the query returning the balance and ledger sums of every customer of a range."""
+    checkpoints = LedgerCheckpoint._meta.db_table
+    if incremental:
+        checkpoint_total = "COALESCE(checkpoint.operations_total, 0)"
+        checkpoint_through = "checkpoint.through"
+        # Контрольная точка без новых операций до водяной отметки остаётся
+        # прежней, перезаписывать её незачем.
+        checkpoint_changed = (
+            "checkpoint.through IS NULL OR ledger.amount_through_watermark IS NOT NULL"
+        )
+        customer_checkpoint = (
+            f"LEFT JOIN {checkpoints} AS checkpoint ON checkpoint.customer_id = customer.id"
+        )
+        operation_checkpoint = (
+            f"LEFT JOIN {checkpoints} AS checkpoint ON checkpoint.customer_id = operation.user_id"
+        )
+        # Операции до контрольной точки пользователя уже учтены в ней.
+        after_checkpoint = (
+            "AND (checkpoint.through IS NULL OR operation.timestamp > checkpoint.through)"
+        )
+    else:
+        checkpoint_total, checkpoint_through = "0", "NULL::timestamptz"
+        checkpoint_changed = "TRUE"
+        customer_checkpoint = operation_checkpoint = after_checkpoint = ""
+    # Общая нижняя граница диапазона отсекает старые секции таблицы операций.
+    since_filter = "AND operation.timestamp > %(since)s" if since is not None else ""
+    return f"""
+        SELECT customer.id, customer.email,
+               customer.balance + COALESCE(slots.balance, 0),
+               {checkpoint_total} + COALESCE(ledger.amount, 0),
+               {checkpoint_total} + COALESCE(ledger.amount_through_watermark, 0),
+               GREATEST({checkpoint_through}, %(watermark)s),
+               {checkpoint_changed}
+        FROM {CustomCustomer._meta.db_table} AS customer
+        {customer_checkpoint}
+        LEFT JOIN (
+            SELECT customer_id, SUM(balance) AS balance
+            FROM {BalanceSlot._meta.db_table}
+            WHERE customer_id BETWEEN %(first_id)s AND %(last_id)s
+            GROUP BY customer_id
+        ) AS slots ON slots.customer_id = customer.id
+        LEFT JOIN (
+            SELECT operation.user_id,
+                   SUM(operation.amount) AS amount,
+                   SUM(operation.amount) FILTER (WHERE operation.timestamp <= %(watermark)s)
+                       AS amount_through_watermark
+            FROM {BalanceOperation._meta.db_table} AS operation
+            {operation_checkpoint}
+            WHERE operation.user_id BETWEEN %(first_id)s AND %(last_id)s
+              AND operation.success AND operation.text_error IS NULL
+              {after_checkpoint}
+              {since_filter}
+            GROUP BY operation.user_id
+        ) AS ledger ON ledger.user_id = customer.id
+        WHERE customer.id BETWEEN %(first_id)s AND %(last_id)s
+        ORDER BY customer.id
+    """
+
+
+def reconcile_range(
+    first_id: int,
+    last_id: int,
+    watermark: datetime,
+    incremental: bool = True,
+    save_checkpoint: bool = True,
+    using: str = DEFAULT_DB_ALIAS,
+) -> RangeResult:
+    """
+    Compare the balances of the customers in [first_id, last_id] with their operations.
+
+    Args:
+        first_id (int): The first customer id of the range.
+        last_id (int): The last customer id of the range, inclusive.
+        watermark (datetime): Operations up to this moment are summed into
+            the new checkpoints. It must lag behind the current time, so that
+            no transaction still in progress can insert an older operation.
+        incremental (bool): Start from the saved checkpoints instead of the
+            whole history.
+        save_checkpoint (bool): Save the sums up to `watermark` as the new
+            checkpoints.
+        using (str): The database alias.
+    Returns:
+        RangeResult: The number of checked accounts and the mismatches.
+    """
+    result = RangeResult(first_id, last_id)
+    since = _range_since(first_id, last_id, incremental, using)
+    params = {
+        "first_id": first_id,
+        "last_id": last_id,
+        "watermark": watermark,
+        "since": since,
+    }
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        checkpoints: list[LedgerCheckpoint] = []
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(_range_sql(incremental, since), params)
+            while rows := cursor.fetchmany(FETCH_SIZE):
+                for customer_id, email, balance, expected, total, through, changed in rows:
+                    result.checked += 1
+                    if balance != expected:
+                        result.mismatches.append(
+                            Mismatch(customer_id, email, balance, expected)
+                        )
+                    if save_checkpoint and changed:
+                        checkpoints.append(
+                            LedgerCheckpoint(
+                                customer_id=customer_id,
+                                operations_total=total,
+                                through=through,
+                            )
+                        )
+                if len(checkpoints) >= FETCH_SIZE:
+                    _save_checkpoints(checkpoints, using)
+                    checkpoints = []
+        _save_checkpoints(checkpoints, using)
+    return result
+
+
+def _save_checkpoints(checkpoints: list[LedgerCheckpoint], using: str) -> None:
+    if checkpoints:
+        LedgerCheckpoint.objects.using(using).bulk_create(
+            checkpoints,
+            update_conflicts=True,
+            unique_fields=["customer"],
+            update_fields=["operations_total", "through"],
+        )
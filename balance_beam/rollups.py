@@ -0,0 +1,246 @@
+"""Дневные итоги операций для выписок.
+
+Итоги хранятся в OperationRollup по ключу (пользователь, день UTC, тип,
+успешность) и обновляются в той же транзакции, что и операции, поэтому
+выписка за любой период читает не больше нескольких строк на день, а не все
+операции периода. Итоги горячих счетов (и всех счетов при
+ROLLUPS_DEFERRED) записываются строками OperationRollupDelta без обновления
+общей строки и переносятся в OperationRollup командой apply_rollup_deltas;
+выписка учитывает и ещё не перенесённые изменения. Команда rebuild_rollups
+пересчитывает итоги по таблице операций.
+"""
+from collections import defaultdict
+from collections.abc import Iterable
+from datetime import date, datetime, timezone
+
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import DateField, Q, QuerySet, Sum
+from django.db.models.functions import Trunc
+
+from .conf import get_setting
+from .hot_accounts import hot_accounts
+from .models import BalanceOperation, OperationRollup, OperationRollupDelta
+from .routers import aread_from_replica, read_from_replica
+
+KEY_COLUMNS = ["user_id", "day", "operation_type", "success"]
+COUNTER_COLUMNS = ["count", "amount_in", "amount_out"]
+STATEMENT_COUNTERS = ["money_in", "money_out", "operations", "failed"]
+
+
+def _upsert_sql(table: str, rows: str) -> str:
+    """Build an INSERT adding the counters of `rows` to the existing rollup rows."""
+    columns = ", ".join(KEY_COLUMNS + COUNTER_COLUMNS)
+    updates = ", ".join(
+        f"{name} = {table}.{name} + EXCLUDED.{name}" for name in COUNTER_COLUMNS
+    )
+    return (
+        f"INSERT INTO {table} ({columns}) {rows} "
+        f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}"
+    )
+
+
+def operation_day(timestamp: datetime) -> date:
+    """Return the UTC day of an operation, the day its rollup is kept under."""
+    return timestamp.astimezone(timezone.utc).date()
+
+
+def record_operations(operations: Iterable[BalanceOperation]) -> None:
+    """
+    Add saved operations to the rollups. Must be called in the transaction
+    that created them, so that the rollups commit or roll back with them.
+    """
+    deltas: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+    for operation in operations:
+        counters = deltas[
+            (
+                operation.user_id,
+                operation_day(operation.timestamp),
+                operation.operation_type,
+                operation.success and operation.text_error is None,
+            )
+        ]
+        counters[0] += 1
+        if operation.amount > 0:
+            counters[1] += operation.amount
+        else:
+            counters[2] -= operation.amount
+    if not deltas:
+        return
+
+    deferred = get_setting("ROLLUPS_DEFERRED")
+    inline = []
+    later = []
+    # Строки итогов обновляются в порядке ключа, чтобы одновременные
+    # транзакции не ждали друг друга по кругу.
+    for key in sorted(deltas):
+        if deferred or hot_accounts.slot_count(key[0]):
+            later.append(key)
+        else:
+            inline.append(key)
+    if later:
+        OperationRollupDelta.objects.bulk_create(
+            [
+                OperationRollupDelta(
+                    **dict(zip(KEY_COLUMNS + COUNTER_COLUMNS, (*key, *deltas[key])))
+                )
+                for key in later
+            ]
+        )
+    if inline:
+        connection = connections[router.db_for_write(OperationRollup)]
+        table = connection.ops.quote_name(OperationRollup._meta.db_table)
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(inline))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                _upsert_sql(table, f"VALUES {placeholders}"),
+                [value for key in inline for value in (*key, *deltas[key])],
+            )
+
+
+def apply_deltas(batch_size: int, using: str = DEFAULT_DB_ALIAS) -> int:
+    """
+    Move a batch of OperationRollupDelta rows into OperationRollup (PostgreSQL).
+
+    Deltas locked by a concurrent applier are skipped, so appliers can run
+    in parallel.
+    Returns:
+        int: The number of applied deltas; 0 when none are left.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    rollups = qn(OperationRollup._meta.db_table)
+    deltas = qn(OperationRollupDelta._meta.db_table)
+    keys = ", ".join(KEY_COLUMNS)
+    counters = ", ".join(COUNTER_COLUMNS)
+    sums = ", ".join(f"SUM({name})" for name in COUNTER_COLUMNS)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH batch AS (
+                DELETE FROM {deltas} WHERE id IN (
+                    SELECT id FROM {deltas} ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {keys}, {counters}
+            ), applied AS (
+                {_upsert_sql(rollups, f"SELECT {keys}, {sums} FROM batch GROUP BY {keys} ORDER BY {keys}")}
+            )
+            SELECT COUNT(*) FROM batch
+            """,
+            [batch_size],
+        )
+        return cursor.fetchone()[0]
+
+
+def rebuild_range(first_id: int, last_id: int, using: str = DEFAULT_DB_ALIAS) -> int:
+    """
+    Recompute the rollups of the customers in [first_id, last_id] from their
+    operations (PostgreSQL).
+
+    The rollup tables are locked against writes for the duration of the
+    range, so that no operation committed meanwhile is lost or counted
+    twice: a concurrent operation waits for the lock before it can commit.
+    Returns:
+        int: The number of rollup rows written.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    rollups = qn(OperationRollup._meta.db_table)
+    deltas = qn(OperationRollupDelta._meta.db_table)
+    operations = qn(BalanceOperation._meta.db_table)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {rollups}, {deltas} IN EXCLUSIVE MODE")
+        for table in (rollups, deltas):
+            cursor.execute(
+                f"DELETE FROM {table} WHERE user_id BETWEEN %s AND %s", [first_id, last_id]
+            )
+        cursor.execute(
+            f"""
+            INSERT INTO {rollups} ({", ".join(KEY_COLUMNS + COUNTER_COLUMNS)})
+            SELECT user_id, (timestamp AT TIME ZONE 'UTC')::date, operation_type,
+                   success AND text_error IS NULL,
+                   COUNT(*), SUM(GREATEST(amount, 0)), SUM(GREATEST(-amount, 0))
+            FROM {operations}
+            WHERE user_id BETWEEN %s AND %s
+            GROUP BY 1, 2, 3, 4
+            """,
+            [first_id, last_id],
+        )
+        return cursor.rowcount
+
+
+def _period_totals(model: type, user_id: int, period: str, date_from: date, date_to: date) -> QuerySet:
+    """Build the per-period totals of one rollup table."""
+    return (
+        model.objects.filter(user_id=user_id, day__gte=date_from, day__lt=date_to)
+        .annotate(start=Trunc("day", period, output_field=DateField()))
+        .values("start")
+        .annotate(
+            money_in=Sum("amount_in", filter=Q(success=True), default=0),
+            money_out=Sum("amount_out", filter=Q(success=True), default=0),
+            operations=Sum("count", filter=Q(success=True), default=0),
+            failed=Sum("count", filter=Q(success=False), default=0),
+        )
+        .order_by("start")
+    )
+
+
+def _merge_periods(*row_sets: list[dict]) -> list[dict]:
+    """Add up the totals of the same periods from the rollups and the pending deltas."""
+    periods: dict[date, dict] = {}
+    for rows in row_sets:
+        for row in rows:
+            totals = periods.setdefault(row["start"], dict.fromkeys(STATEMENT_COUNTERS, 0))
+            for name in STATEMENT_COUNTERS:
+                totals[name] += int(row[name])
+    return [{"start": start, **periods[start]} for start in sorted(periods)]
+
+
+def statement_response(params: dict, periods: list[dict]) -> dict:
+    """Build the statement API body from validated StatementQuerySerializer data."""
+    return {
+        "period": params["period"],
+        "date_from": params["date_from"].isoformat(),
+        "date_to": params["date_to"].isoformat(),
+        "periods": [
+            {**totals, "start": totals["start"].isoformat()} for totals in periods
+        ],
+        "total": {
+            name: sum(totals[name] for totals in periods) for name in STATEMENT_COUNTERS
+        },
+    }
+
+
+def statement(user_id: int, period: str, date_from: date, date_to: date) -> list[dict]:
+    """
+    Return the user's totals per day or month, oldest first.
+
+    The cost depends on the number of days in the range, not on the number
+    of operations.
+    Args:
+        user_id (int): The owner of the operations.
+        period (str): "day" or "month".
+        date_from (date): The first day, inclusive.
+        date_to (date): The last day, exclusive.
+    Returns:
+        list[dict]: Periods with operations: `start` and the amounts in
+        kopecks `money_in` and `money_out`, the number of successful
+        `operations` and of `failed` ones.
+    """
+    with read_from_replica(user_id):
+        return _merge_periods(
+            *(
+                list(_period_totals(model, user_id, period, date_from, date_to))
+                for model in (OperationRollup, OperationRollupDelta)
+            )
+        )
+
+
+async def astatement(user_id: int, period: str, date_from: date, date_to: date) -> list[dict]:
+    """Async version of `statement`."""
+    async with aread_from_replica(user_id):
+        return _merge_periods(
+            *[
+                [row async for row in _period_totals(model, user_id, period, date_from, date_to)]
+                for model in (OperationRollup, OperationRollupDelta)
+            ]
+        )
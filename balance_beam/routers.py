@@ -0,0 +1,143 @@
+"""Чтение с реплик с гарантией read-your-writes.
+
+Роутер отправляет запросы чтения на реплику только внутри контекста
+`read_from_replica`, в который входят методы BalanceService, работающие
+только на чтение. Всё остальное, в том числе чтения внутри транзакций
+записи, идёт на основную базу. После записи пользователь на время
+READ_YOUR_WRITES_WINDOW читает с основной базы, а реплика с отставанием
+больше REPLICA_MAX_LAG не используется.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+from .conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+_read_alias: ContextVar[str | None] = ContextVar("balance_beam_read_alias", default=None)
+
+REPLICA_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaLagMonitor:
+    """Caches the replication lag of each replica for REPLICA_LAG_CHECK_INTERVAL seconds."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._checked: dict[str, tuple[float, float]] = {}
+
+    def lag(self, alias: str) -> float:
+        """Return the replica lag in seconds; infinity if the replica is unreachable."""
+        now = time.monotonic()
+        with self._lock:
+            checked_at, lag = self._checked.get(alias, (float("-inf"), 0.0))
+        if now - checked_at < get_setting("REPLICA_LAG_CHECK_INTERVAL"):
+            return lag
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+        except DatabaseError:
+            logger.warning("Replica %s is unreachable, reading from the primary", alias)
+            lag = float("inf")
+        with self._lock:
+            self._checked[alias] = (now, lag)
+        return lag
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+def _pin_cache_key(user_id: int) -> str:
+    return f"balance_beam:read_primary:{user_id}"
+
+
+def pin_to_primary(*user_ids: int) -> None:
+    """Make the users read from the primary for READ_YOUR_WRITES_WINDOW seconds."""
+    if not get_setting("READ_REPLICAS") or not user_ids:
+        return
+    caches[get_setting("CACHE_ALIAS")].set_many(
+        {_pin_cache_key(user_id): True for user_id in user_ids},
+        get_setting("READ_YOUR_WRITES_WINDOW"),
+    )
+
+
+def pin_to_primary_on_commit(*user_ids: int) -> None:
+    """Pin the users to the primary once the current transaction commits."""
+    if get_setting("READ_REPLICAS") and user_ids:
+        transaction.on_commit(lambda: pin_to_primary(*user_ids))
+
+
+def choose_read_alias(user_id: int | None) -> str | None:
+    """
+    Pick a replica for the user's reads.
+    Returns:
+        str | None: A replica alias, or None to read from the primary.
+    """
+    replicas = get_setting("READ_REPLICAS")
+    if not replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return None
+    if user_id is not None and caches[get_setting("CACHE_ALIAS")].get(_pin_cache_key(user_id)):
+        return None
+    max_lag = get_setting("REPLICA_MAX_LAG")
+    healthy = [alias for alias in replicas if lag_monitor.lag(alias) <= max_lag]
+    return random.choice(healthy) if healthy else None
+
+
+@contextmanager
+def read_from_replica(user_id: int | None = None):
+    """Route the reads inside the block to a replica, unless the user must read from the primary."""
+    if _read_alias.get() is not None:
+        yield _read_alias.get()
+        return
+    token = _read_alias.set(choose_read_alias(user_id))
+    try:
+        yield _read_alias.get()
+    finally:
+        _read_alias.reset(token)
+
+
+@asynccontextmanager
+async def aread_from_replica(user_id: int | None = None):
+    """Async version of `read_from_replica`."""
+    if _read_alias.get() is not None:
+        yield _read_alias.get()
+        return
+    token = _read_alias.set(await sync_to_async(choose_read_alias)(user_id))
+    try:
+        yield _read_alias.get()
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """Database router that sends reads to the replica chosen by `read_from_replica`."""
+
+    def db_for_read(self, model, **hints) -> str | None:
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints) -> str | None:
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool | None:
+        databases = {DEFAULT_DB_ALIAS, *get_setting("READ_REPLICAS")}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> bool | None:
+        if db in get_setting("READ_REPLICAS"):
+            return False
+        return None
@@ -1,3 +1,17 @@
-from .history import HistoryOperationSerializer
+from .history import (
+    HistoryOperationSerializer,
+    history_rows,
+    HistoryFilterSerializer,
+    HistoryQuerySerializer,
+    ExportQuerySerializer,
+)
 from .account import UserSerializer, UserSerializerForUpdate
-from .operations import BalanceIncreaseOperationSerializer, BalanceTransferOperationSerializer
+from .operations import (
+    BalanceIncreaseOperationSerializer,
+    BalanceTransferOperationSerializer,
+    BalanceBatchTransferSerializer,
+)
+from .rows import RowSerializer
+from .statement import StatementQuerySerializer
+from .token import CustomerTokenObtainPairSerializer
+from .transfers import TransferRequestSerializer
@@ -1,7 +1,10 @@
 from django.contrib.auth import password_validation
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils.translation import gettext_lazy as _
+from ..authentication import revoke_tokens
 from ..models import validate_names, validate_phone, CustomCustomer
+from ..recipients import forget_recipient
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError as RestValidationError
 
@@ -94,6 +97,7 @@ class UserSerializerForUpdate(serializers.ModelSerializer):
             "balance": {"read_only": True},
         }
 
+    @transaction.atomic
     def update(
         self, instance: CustomCustomer, validated_data: dict[str, str | int]
     ) -> CustomCustomer:
@@ -128,6 +132,9 @@ class UserSerializerForUpdate(serializers.ModelSerializer):
                 )
 
             instance.set_password(validated_data.pop("password"))
+            # Новая версия сохраняется вместе с паролем ниже, в этой же
+            # транзакции.
+            revoke_tokens(instance)
 
         if "first_name" in validated_data:
             try:
@@ -143,9 +150,13 @@ class UserSerializerForUpdate(serializers.ModelSerializer):
                 raise serializers.ValidationError({"last_name": error.messages})
             instance.last_name = validated_data.pop("last_name")
 
+        old_phone = instance.phone
         if "phone" in validated_data:
             validate_number_phone(validated_data.get("phone"))
 
         instance = super().update(instance, validated_data)
+        if instance.phone != old_phone:
+            # Переводы по телефону не должны находить прежнего владельца номера.
+            forget_recipient("recipient_phone", old_phone, instance.phone)
 
         return instance
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from ..models import BalanceOperation
+from ..pagination import decode_cursor
+from .rows import RowSerializer
 
 
 class HistoryOperationSerializer(serializers.ModelSerializer):
@@ -7,3 +9,52 @@ class HistoryOperationSerializer(serializers.ModelSerializer):
     class Meta:
         model = BalanceOperation
         fields = ["user", "amount", "operation_type", "timestamp", "success", "text_error"]
+
+
+# Быстрый путь истории операций: строки values_list() вместо экземпляров модели.
+history_rows = RowSerializer(HistoryOperationSerializer)
+
+
+class HistoryFilterSerializer(serializers.Serializer):
+    """Filters of the operations history, shared by the history API and exports."""
+
+    operation_type = serializers.ChoiceField(
+        choices=BalanceOperation.OPERATION_TYPES, required=False
+    )
+    success = serializers.BooleanField(required=False)
+    amount_min = serializers.IntegerField(required=False)
+    amount_max = serializers.IntegerField(required=False)
+    date_from = serializers.DateTimeField(required=False)
+    date_to = serializers.DateTimeField(required=False)
+    counterparty = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs: dict) -> dict:
+        """Check that the amount and date ranges are not reversed."""
+        for low, high in (("amount_min", "amount_max"), ("date_from", "date_to")):
+            if low in attrs and high in attrs and attrs[low] > attrs[high]:
+                raise serializers.ValidationError({high: f"Must not be less than {low}."})
+        return attrs
+
+
+class HistoryQuerySerializer(HistoryFilterSerializer):
+    """Query parameters of the paginated operations history."""
+
+    MAX_LIMIT = 100
+
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=MAX_LIMIT, default=5)
+
+    @staticmethod
+    def validate_cursor(value: str) -> tuple:
+        """Decode the cursor into a (timestamp, id) position."""
+        try:
+            return decode_cursor(value)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+
+
+class ExportQuerySerializer(HistoryFilterSerializer):
+    """Query parameters of the operations history export."""
+
+    export_format = serializers.ChoiceField(choices=["csv", "ndjson"], default="csv")
+    gzip = serializers.BooleanField(default=False)
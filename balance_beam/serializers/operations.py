@@ -1,6 +1,6 @@
 from rest_framework import serializers
-from ..models import BalanceOperation, CustomCustomer
-from django.shortcuts import get_object_or_404
+from ..models import BalanceOperation
+from ..recipients import RECIPIENT_LOOKUPS, resolve_recipient
 
 
 class BalanceIncreaseOperationSerializer(serializers.ModelSerializer):
@@ -25,20 +25,56 @@ class BalanceIncreaseOperationSerializer(serializers.ModelSerializer):
         return value
 
 
-def validate_recipient_id(value: int) -> int:
-    """Validate that the user_id exists in the database."""
-    CustomCustomer.objects.get(id=value)
-    get_object_or_404(CustomCustomer, id=value)
-    return value
+class BalanceTransferOperationSerializer(serializers.ModelSerializer):
+    """Transfer from the authenticated user.
 
+    The recipient is given by exactly one of `recipient_id`,
+    `recipient_email` or `recipient_phone`; the validated data always has
+    the resolved `recipient_id`.
+    """
 
-class BalanceTransferOperationSerializer(serializers.ModelSerializer):
     operation_type = serializers.CharField(default="DECREASE")
-    recipient_id = serializers.IntegerField(write_only=True)
+    recipient_id = serializers.IntegerField(write_only=True, required=False)
+    recipient_email = serializers.EmailField(write_only=True, required=False)
+    recipient_phone = serializers.CharField(write_only=True, required=False, max_length=15)
 
     class Meta:
         model = BalanceOperation
-        fields = ["amount", "operation_type", "timestamp", "success", "text_error", "recipient_id"]
+        fields = [
+            "amount",
+            "operation_type",
+            "timestamp",
+            "success",
+            "text_error",
+            "recipient_id",
+            "recipient_email",
+            "recipient_phone",
+        ]
+
+    def validate(self, attrs: dict) -> dict:
+        """
+        Resolve the recipient to its id, with at most one indexed query.
+        Raises:
+            ValidationError: If not exactly one recipient field is given, or
+                there is no such customer.
+        """
+        given = [field for field in RECIPIENT_LOOKUPS if field in attrs]
+        if len(given) != 1:
+            raise serializers.ValidationError(
+                f"Specify exactly one of {', '.join(RECIPIENT_LOOKUPS)}."
+            )
+        field = given[0]
+        value = attrs.pop(field)
+        recipient_id = resolve_recipient(field, value)
+        if recipient_id is None:
+            label = field.removeprefix("recipient_")
+            raise serializers.ValidationError(
+                {field: f"Customer with {label} {value} does not exist."}
+            )
+        # Чтобы сбросить запись кеша, если получатель пропал до перевода.
+        self.recipient_lookup = (field, value)
+        attrs["recipient_id"] = recipient_id
+        return attrs
 
     @staticmethod
     def validate_amount(value: int) -> int:
@@ -53,3 +89,21 @@ class BalanceTransferOperationSerializer(serializers.ModelSerializer):
         if value <= 0:
             raise serializers.ValidationError("Amount must be a positive number.")
         return value
+
+
+class BalanceTransferLegSerializer(serializers.Serializer):
+    recipient_id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
+
+
+class BalanceBatchTransferSerializer(serializers.Serializer):
+    """Batch of transfers from the authenticated user.
+
+    Recipients are not looked up here: unknown recipients are reported per leg
+    by `BalanceService.transfer_many` instead of costing a query each.
+    """
+
+    MAX_LEGS = 1000
+
+    transfers = BalanceTransferLegSerializer(many=True, allow_empty=False, max_length=MAX_LEGS)
+    atomic = serializers.BooleanField(default=True)
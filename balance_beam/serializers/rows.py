@@ -0,0 +1,97 @@
+from collections.abc import Callable, Iterable
+from datetime import datetime
+from typing import Any
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import cached_property
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+# Поля, у которых to_representation возвращает значение из базы без
+# изменений; у остальных (например, DateTimeField) вызывается метод поля.
+PASSTHROUGH_FIELDS = (
+    serializers.IntegerField,
+    serializers.CharField,
+    serializers.BooleanField,
+    serializers.ChoiceField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+class RowSerializer:
+    """Serialize `values_list()` rows exactly like a ModelSerializer serializes instances.
+
+    The field mapping is compiled once from the serializer: the output
+    names, the model columns to select and the conversions that are not a
+    no-op. Only flat fields of model columns are supported.
+    """
+
+    def __init__(self, serializer_class: type[serializers.ModelSerializer]) -> None:
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def _mapping(self) -> tuple[list[str], list[str], list[tuple[str, serializers.Field]]]:
+        model = self.serializer_class.Meta.model
+        names, columns, converted = [], [], []
+        for field in self.serializer_class().fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.BaseSerializer) or "." in field.source or field.source == "*":
+                raise ImproperlyConfigured(
+                    f"{self.serializer_class.__name__}.{field.field_name} is not a model column."
+                )
+            names.append(field.field_name)
+            columns.append(model._meta.get_field(field.source).attname)
+            if type(field) not in PASSTHROUGH_FIELDS:
+                converted.append((field.field_name, field))
+        return names, columns, converted
+
+    @property
+    def columns(self) -> list[str]:
+        """The model columns to select, in the order of the output fields."""
+        return self._mapping[1]
+
+    def to_representation(self, rows: Iterable[tuple]) -> list[dict]:
+        """
+        Turn rows of `columns` into the serializer's representation.
+        Args:
+            rows (Iterable[tuple]): Rows starting with the `columns`; extra trailing values are ignored.
+        Returns:
+            list[dict]: One dict per row, with the keys in the serializer's field order.
+        """
+        names, _, fields = self._mapping
+        converters = [(name, _converter(field)) for name, field in fields]
+        data = []
+        for row in rows:
+            item = dict(zip(names, row))
+            for name, convert in converters:
+                value = item[name]
+                if value is not None:
+                    item[name] = convert(value)
+            data.append(item)
+        return data
+
+
+def _converter(field: serializers.Field) -> Callable[[Any], Any]:
+    """Return the conversion of a field's values, with the per-request settings resolved once."""
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if type(field) is not serializers.DateTimeField or not (
+        isinstance(output_format, str) and output_format.lower() == ISO_8601
+    ):
+        return field.to_representation
+    # DateTimeField определяет часовой пояс для каждого значения; для
+    # страницы он один и тот же.
+    zone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    if zone is None:
+        return field.to_representation
+
+    def convert(value: Any) -> Any:
+        if not isinstance(value, datetime) or value.tzinfo is None:
+            return field.to_representation(value)
+        try:
+            text = value.astimezone(zone).isoformat()
+        except OverflowError:
+            return field.to_representation(value)
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+
+    return convert
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework import serializers
+
+from ..partitioning import add_months, month_start
+
+
+class StatementQuerySerializer(serializers.Serializer):
+    """Query parameters of the statement.
+
+    Without dates the statement covers the last 12 months by month, or the
+    current month by day.
+    """
+
+    MAX_MONTHS = 120
+    MAX_DAYS = 366
+
+    period = serializers.ChoiceField(choices=["month", "day"], default="month")
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, attrs: dict) -> dict:
+        """Fill in the default range and check its length."""
+        period = attrs["period"]
+        today = timezone.now().date()
+        date_to = attrs.setdefault("date_to", add_months(month_start(today), 1))
+        default_months = 12 if period == "month" else 1
+        date_from = attrs.setdefault(
+            "date_from",
+            add_months(month_start(date_to - timedelta(days=1)), 1 - default_months),
+        )
+        if date_from >= date_to:
+            raise serializers.ValidationError({"date_to": "Must be greater than date_from."})
+        if period == "month":
+            months = (date_to.year - date_from.year) * 12 + date_to.month - date_from.month
+            if months > self.MAX_MONTHS:
+                raise serializers.ValidationError(
+                    {"date_from": f"The range must not exceed {self.MAX_MONTHS} months."}
+                )
+        elif (date_to - date_from).days > self.MAX_DAYS:
+            raise serializers.ValidationError(
+                {"date_from": f"The range must not exceed {self.MAX_DAYS} days."}
+            )
+        return attrs
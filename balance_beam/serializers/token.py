@@ -0,0 +1,17 @@
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.tokens import Token
+
+from ..authentication import IS_ACTIVE_CLAIM, TOKEN_VERSION_CLAIM
+from ..models import CustomCustomer
+
+
+class CustomerTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issues tokens with the claims needed by StatelessJWTAuthentication."""
+
+    @classmethod
+    def get_token(cls, user: CustomCustomer) -> Token:
+        """Add the user's activity flag and token version to the token claims."""
+        token = super().get_token(user)
+        token[IS_ACTIVE_CLAIM] = user.is_active
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
@@ -0,0 +1,23 @@
+from rest_framework import serializers
+from ..models import TransferRequest
+
+
+class TransferRequestSerializer(serializers.ModelSerializer):
+    """Status of a queued transfer, as polled by its sender."""
+
+    recipient_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = TransferRequest
+        fields = [
+            "id",
+            "recipient_id",
+            "amount",
+            "status",
+            "attempts",
+            "error",
+            "balance_after",
+            "created_at",
+            "completed_at",
+        ]
+        read_only_fields = fields
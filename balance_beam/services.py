@@ -1,16 +1,130 @@
-from django.db import transaction
+import uuid
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from datetime import datetime
+from operator import attrgetter
+from typing import Any
+
+from asgiref.sync import sync_to_async
+from django.db import connections, router, transaction
+from django.db.models import F, Q, QuerySet, Sum
+from django.db.models.functions import Coalesce
+from . import metrics, outbox, rollups
+from .conf import get_execution_strategy
+from .hot_accounts import credit_slot, hot_accounts, sweep_slots
 from .models import CustomCustomer, BalanceOperation
+from .pagination import Position
+from .routers import aread_from_replica, pin_to_primary_on_commit, read_from_replica
+from .snapshots import SNAPSHOT_PAGE_SIZE, account_snapshots
+
+
+@dataclass
+class TransferLegResult:
+    """Outcome of a single leg of a batch transfer."""
+
+    sender_id: int
+    recipient_id: int
+    amount_in_kopecks: int
+    success: bool = True
+    error: str | None = None
+    sender_balance: int | None = None
+
+
+class BatchTransferError(ValueError):
+    """Raised when an all-or-nothing batch transfer is rolled back.
+
+    The per-leg outcomes are available in `results`.
+    """
+
+    def __init__(self, message: str, results: list[TransferLegResult]) -> None:
+        super().__init__(message)
+        self.results = results
 
 
 class BalanceService:
     @staticmethod
+    def _related_customer_label(customer: CustomCustomer | None) -> str | None:
+        """Build the `related_customer` value stored on a BalanceOperation."""
+        if customer is None:
+            return None
+        return f"{customer.email}, id: {customer.id}"
+
+    @staticmethod
+    def _on_accounts_changed(*user_ids: int) -> None:
+        """Drop the cached snapshots and pin the reads to the primary after the commit."""
+        account_snapshots.invalidate_on_commit(*user_ids)
+        pin_to_primary_on_commit(*user_ids)
+
+    @staticmethod
+    def _apply_balance_delta(customer_id: int, delta: int) -> tuple[int | None, str] | None:
+        """
+        Change a customer's balance with a single conditional UPDATE, without a prior lock.
+
+        A credit to a hot account goes to one of its balance slots.
+        Args:
+            customer_id (int): The primary key of the customer.
+            delta (int): The amount in kopecks to add, negative for debits.
+        Returns:
+            tuple[int | None, str] | None: The new main balance, None after a
+            credit to a slot, and the customer's email; or None if no row was
+            updated: the customer doesn't exist or the balance is insufficient.
+        """
+        if delta > 0:
+            email = credit_slot(customer_id, delta)
+            if email is not None:
+                return None, email
+        connection = connections[router.db_for_write(CustomCustomer)]
+        table = connection.ops.quote_name(CustomCustomer._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET balance = balance + %s "
+                "WHERE id = %s AND balance >= %s RETURNING balance, email",
+                [delta, customer_id, max(-delta, 0)],
+            )
+            return cursor.fetchone()
+
+    @classmethod
+    def _apply_balance_delta_or_raise(
+        cls, customer_id: int, delta: int
+    ) -> tuple[int | None, str]:
+        """
+        Apply `_apply_balance_delta` and turn an unaffected row into an error.
+
+        A debit that the main balance of a hot account can't cover is retried
+        after moving money from the balance slots.
+        Raises:
+            CustomCustomer.DoesNotExist: If the customer doesn't exist.
+            ValueError: If the balance is insufficient for the debit.
+        """
+        updated = cls._apply_balance_delta(customer_id, delta)
+        if updated is not None:
+            return updated
+        customer = (
+            CustomCustomer.objects.filter(pk=customer_id)
+            .values("balance", "balance_slot_count")
+            .first()
+        )
+        if customer is None:
+            raise CustomCustomer.DoesNotExist(f"Customer with id {customer_id} does not exist.")
+        balance = customer["balance"]
+        if customer["balance_slot_count"]:
+            balance += sweep_slots(customer_id, -delta - balance)
+            updated = cls._apply_balance_delta(customer_id, delta)
+            if updated is not None:
+                return updated
+        raise ValueError(f"Insufficient balance. User balance: {balance / 100} rubles")
+
+    @classmethod
     def _perform_balance_operation(
+        cls,
         user: CustomCustomer,
         amount_in_kopecks: int,
         operation_type: str,
         related_customer: CustomCustomer | None = None,
         text_error: str | None = None,
         success: bool = True,
+        transfer_group: uuid.UUID | None = None,
+        locked: bool = False,
     ) -> BalanceOperation:
         """
         Perform a balance operation for a user and create a corresponding BalanceOperation record.
@@ -21,29 +135,62 @@ class BalanceService:
         related_customer (CustomCustomer, optional): The related customer for the operation.
         text_error (str, optional): The error message, if any.
         success (bool): Indicates if the operation was successful.
+        transfer_group (UUID, optional): The id shared by the legs of a transfer.
+        locked (bool): The caller already holds the row lock of `user` in this
+            transaction and `user.balance` is current, so the row isn't read again.
         Returns:
         BalanceOperation: The created BalanceOperation record.
         """
         with transaction.atomic():
-            user = CustomCustomer.objects.select_for_update().get(pk=user.pk)
-            if not text_error:
-                user.balance += amount_in_kopecks
-                user.save()
+            if get_execution_strategy() == "conditional":
+                if not text_error:
+                    balance, _ = cls._apply_balance_delta_or_raise(
+                        user.pk, amount_in_kopecks
+                    )
+                    if balance is not None:
+                        user.balance = balance
+            elif (
+                not text_error
+                and amount_in_kopecks > 0
+                and credit_slot(user.pk, amount_in_kopecks) is not None
+            ):
+                # Зачисление на горячий счёт ушло в слот без блокировки строки
+                # пользователя.
+                pass
+            else:
+                if not locked:
+                    user = CustomCustomer.objects.select_for_update().get(pk=user.pk)
+                if not text_error:
+                    if user.balance_slot_count and user.balance < -amount_in_kopecks:
+                        user.balance += sweep_slots(
+                            user.pk, -amount_in_kopecks - user.balance
+                        )
+                    user.balance += amount_in_kopecks
+                    user.save(update_fields=["balance"])
             operation = BalanceOperation.objects.create(
                 user=user,
-                amount=amount_in_rubles,
+                amount=amount_in_kopecks,
                 operation_type=operation_type,
                 text_error=text_error,
-                related_customer=f"{related_customer.email}, id: {related_customer.id}"
-                if related_customer
-                else None,
+                related_customer=cls._related_customer_label(related_customer),
+                counterparty=related_customer,
+                transfer_group=transfer_group,
                 success=success,
             )
+            rollups.record_operations([operation])
+            outbox.record_operations([operation])
+            cls._on_accounts_changed(user.pk)
         return operation
 
     @classmethod
+    @metrics.instrumented
     def increase_balance(
-        cls, user: CustomCustomer, amount_in_kopecks: int, sender: CustomCustomer = None
+        cls,
+        user: CustomCustomer,
+        amount_in_kopecks: int,
+        sender: CustomCustomer = None,
+        transfer_group: uuid.UUID | None = None,
+        locked: bool = False,
     ) -> BalanceOperation:
         """
         Increase the balance of the user by the specified amount.
@@ -51,20 +198,30 @@ class BalanceService:
             user (User): The user whose balance will be increased.
             amount_in_kopecks (int): The amount to increase the balance, in kopecks.
             sender (User, optional): The sender of the increase balance operation.
+            transfer_group (UUID, optional): The id shared by the legs of a transfer.
+            locked (bool): The caller holds the row lock of `user` in this transaction.
         Returns:
             BalanceOperation: The balance operation object representing the increase.
         """
     
         return cls._perform_balance_operation(
-            user, amount_in_kopecks, "INCREASE", related_customer=sender
+            user,
+            amount_in_kopecks,
+            "INCREASE",
+            related_customer=sender,
+            transfer_group=transfer_group,
+            locked=locked,
         )
 
     @classmethod
+    @metrics.instrumented
     def decrease_balance(
         cls,
         user: CustomCustomer,
         amount_in_kopecks: int,
         recipient: CustomCustomer | None = None,
+        transfer_group: uuid.UUID | None = None,
+        locked: bool = False,
     ) -> BalanceOperation:
         """
         Decreases the balance of the user by the specified amount and performs a transfer operation.
@@ -72,26 +229,70 @@ class BalanceService:
         - user: The user whose balance will be decreased.
         - amount_in_kopecks: The amount to decrease the balance in kopecks.
         - recipient: The recipient of the transfer operation.
+        - transfer_group: The id shared by the legs of a transfer.
+        - locked: The caller holds the row lock of `user` in this transaction.
         Returns:
         - BalanceOperation: The balance operation object representing the transfer.
         """
     
         return cls._perform_balance_operation(
-            user, -amount_in_kopecks, "TRANSFER", related_customer=recipient
+            user,
+            -amount_in_kopecks,
+            "TRANSFER",
+            related_customer=recipient,
+            transfer_group=transfer_group,
+            locked=locked,
         )
 
     @staticmethod
-    def check_user_balance_in_kopecks(user: CustomCustomer) -> int:
+    @metrics.instrumented
+    def query_balance(user_id: int) -> int:
+        """Read the user's balance in kopecks from the database, bypassing the snapshot cache.
+
+        The balance of a hot account includes its balance slots.
+        Raises:
+            CustomCustomer.DoesNotExist: If the user doesn't exist.
+        """
+        return BalanceService._balance_queryset().get(pk=user_id)
+
+    @staticmethod
+    def _balance_queryset() -> QuerySet:
+        """Build the query of the total balance: the main one plus the balance slots."""
+        return CustomCustomer.objects.annotate(
+            total_balance=F("balance") + Coalesce(Sum("balance_slots__balance"), 0)
+        ).values_list("total_balance", flat=True)
+
+    @staticmethod
+    def _has_loaded_balance(user: CustomCustomer) -> bool:
+        """Check whether the user's balance is loaded and is the whole balance."""
+        return (
+            not user.get_deferred_fields() & {"balance", "balance_slot_count"}
+            and not user.balance_slot_count
+        )
+
+    @classmethod
+    @metrics.instrumented
+    def check_user_balance_in_kopecks(cls, user: CustomCustomer) -> int:
         """Get the user's balance in kopecks.
+
+        With the snapshot cache enabled the balance is taken from the
+        account snapshot. A balance that isn't loaded with the user is read
+        from a replica when one is configured.
         Args:
             user (CustomCustomer): The custom customer object.
         Returns:
             int: The user's balance in kopecks.
         """
-        return user.balance
+        if account_snapshots.enabled():
+            return account_snapshots.get(user.pk).balance
+        if cls._has_loaded_balance(user):
+            return user.balance
+        with read_from_replica(user.pk):
+            return cls.query_balance(user.pk)
 
-    @staticmethod
-    def check_user_balance_in_rubles(user: CustomCustomer) -> float | None:
+    @classmethod
+    @metrics.instrumented
+    def check_user_balance_in_rubles(cls, user: CustomCustomer) -> float | None:
         """Check user balance in rubles
 
         Args:
@@ -102,9 +303,10 @@ class BalanceService:
         """
         if user is None:
             return None
-        return user.balance / 100
+        return cls.check_user_balance_in_kopecks(user) / 100
 
     @classmethod
+    @metrics.instrumented
     def transfer_balance(
         cls, sender: CustomCustomer, recipient_id: int, amount_in_kopecks: int
     ) -> int:
@@ -117,15 +319,24 @@ class BalanceService:
             amount_in_kopecks (int): The amount to be transferred in kopecks.
 
         Returns:
-            Decimal: The remaining balance of the sender after the transfer.
+            int: The remaining balance of the sender after the transfer, in kopecks.
         """
-        with transaction.atomic():
+        if get_execution_strategy() == "conditional":
+            return cls._transfer_balance_conditional(
+                sender, recipient_id, amount_in_kopecks
+            )
+        # События обеих частей перевода получают номера одним запросом.
+        with transaction.atomic(), outbox.batched():
             sender_customer = CustomCustomer.objects.select_for_update().get(
                 pk=sender.pk
             )
-            recipient_customer = CustomCustomer.objects.select_for_update().get(
-                pk=recipient_id
-            )
+            recipients = CustomCustomer.objects.all()
+            # Зачисление на горячий счёт уходит в слот, строку получателя
+            # блокировать не нужно.
+            recipient_locked = not hot_accounts.slot_count(int(recipient_id))
+            if recipient_locked:
+                recipients = recipients.select_for_update()
+            recipient_customer = recipients.get(pk=recipient_id)
             if sender_customer == recipient_customer:
                 error_message = "You can't transfer money to yourself. Please choose another recipient."
                 cls._perform_balance_operation(
@@ -137,6 +348,13 @@ class BalanceService:
                     success=False,
                 )
                 raise ValueError(error_message)
+            if (
+                sender_customer.balance_slot_count
+                and sender_customer.balance < amount_in_kopecks
+            ):
+                sender_customer.balance += sweep_slots(
+                    sender_customer.pk, amount_in_kopecks - sender_customer.balance
+                )
             if sender_customer.balance < amount_in_kopecks:
                 error_message = f"Insufficient balance. User balance: {sender_customer.balance / 100} rubles"
                 cls._perform_balance_operation(
@@ -144,24 +362,463 @@ class BalanceService:
                     -amount_in_kopecks,
                     "DECREASE",
                     text_error=error_message,
-                    related_customer=sender_customer,
+                    related_customer=recipient_customer,
                 )
                 raise ValueError(error_message)
-            cls.decrease_balance(
-                sender_customer, amount_in_kopecks, recipient=recipient_customer
+            transfer_group = uuid.uuid4()
+            # Строки уже заблокированы выше, повторно их не читаем.
+            operation = cls.decrease_balance(
+                sender_customer,
+                amount_in_kopecks,
+                recipient=recipient_customer,
+                transfer_group=transfer_group,
+                locked=True,
             )
             cls.increase_balance(
-                recipient_customer, amount_in_kopecks, sender=sender_customer
+                recipient_customer,
+                amount_in_kopecks,
+                sender=sender_customer,
+                transfer_group=transfer_group,
+                locked=recipient_locked,
             )
 
-        return sender_customer.balance
+        if sender_customer.balance_slot_count:
+            return cls.query_balance(sender_customer.pk)
+        return operation.user.balance
+
+    @classmethod
+    def _transfer_balance_conditional(
+        cls, sender: CustomCustomer, recipient_id: int, amount_in_kopecks: int
+    ) -> int:
+        """
+        Transfer balance with one conditional UPDATE per leg instead of locking reads.
+
+        Both legs are applied in primary key order, so concurrent opposite
+        transfers can't deadlock. Insufficient funds are detected from the
+        debit affecting no rows.
+
+        Returns:
+            int: The remaining balance of the sender after the transfer, in kopecks.
+        """
+        recipient_id = int(recipient_id)
+        if sender.pk == recipient_id:
+            raise ValueError(
+                "You can't transfer money to yourself. Please choose another recipient."
+            )
+        with transaction.atomic():
+            updated = {
+                customer_id: cls._apply_balance_delta_or_raise(customer_id, delta)
+                for customer_id, delta in sorted(
+                    [(sender.pk, -amount_in_kopecks), (recipient_id, amount_in_kopecks)]
+                )
+            }
+            sender_balance, sender_email = updated[sender.pk]
+            _, recipient_email = updated[recipient_id]
+            transfer_group = uuid.uuid4()
+            operations = BalanceOperation.objects.bulk_create(
+                [
+                    BalanceOperation(
+                        user_id=sender.pk,
+                        amount=-amount_in_kopecks,
+                        operation_type="TRANSFER",
+                        related_customer=cls._related_customer_label(
+                            CustomCustomer(pk=recipient_id, email=recipient_email)
+                        ),
+                        counterparty_id=recipient_id,
+                        transfer_group=transfer_group,
+                    ),
+                    BalanceOperation(
+                        user_id=recipient_id,
+                        amount=amount_in_kopecks,
+                        operation_type="INCREASE",
+                        related_customer=cls._related_customer_label(
+                            CustomCustomer(pk=sender.pk, email=sender_email)
+                        ),
+                        counterparty_id=sender.pk,
+                        transfer_group=transfer_group,
+                    ),
+                ]
+            )
+            rollups.record_operations(operations)
+            outbox.record_operations(operations)
+            cls._on_accounts_changed(sender.pk, recipient_id)
+        if hot_accounts.slot_count(sender.pk):
+            return cls.query_balance(sender.pk)
+        return sender_balance
 
     @staticmethod
     def get_last_operations(
         user: CustomCustomer, limit: int = 5
     ) -> list[BalanceOperation]:
         """Retrieve data about the user's last operations."""
-        operations: list[BalanceOperation] = BalanceOperation.objects.filter(
-            user=user
-        ).order_by("-timestamp")[:limit]
+        with read_from_replica(user.pk):
+            operations: list[BalanceOperation] = list(
+                BalanceOperation.objects.filter(user=user).order_by(
+                    "-timestamp", "-id"
+                )[:limit]
+            )
         return operations
+
+    @staticmethod
+    def filter_operations(
+        queryset: QuerySet,
+        operation_type: str | None = None,
+        success: bool | None = None,
+        amount_min: int | None = None,
+        amount_max: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        counterparty: int | None = None,
+    ) -> QuerySet:
+        """
+        Apply the history filters to a BalanceOperation queryset.
+        Args:
+            queryset (QuerySet): The operations to filter.
+            operation_type (str, optional): Only operations of this type.
+            success (bool, optional): Only successful or only failed operations.
+            amount_min (int, optional): Minimal amount in kopecks, inclusive.
+            amount_max (int, optional): Maximal amount in kopecks, inclusive.
+            date_from (datetime, optional): Start of the period, inclusive.
+            date_to (datetime, optional): End of the period, exclusive.
+            counterparty (int, optional): Only operations with this customer.
+        Returns:
+            QuerySet: The filtered queryset.
+        """
+        lookups = {
+            "operation_type": operation_type,
+            "success": success,
+            "amount__gte": amount_min,
+            "amount__lte": amount_max,
+            "timestamp__gte": date_from,
+            "timestamp__lt": date_to,
+            "counterparty_id": counterparty,
+        }
+        return queryset.filter(
+            **{lookup: value for lookup, value in lookups.items() if value is not None}
+        )
+
+    @classmethod
+    @metrics.instrumented
+    def get_operations_page(
+        cls,
+        user: CustomCustomer,
+        limit: int = 5,
+        after: Position | None = None,
+        columns: Sequence[str] | None = None,
+        **filters: Any,
+    ) -> tuple[list[BalanceOperation] | list[tuple], Position | None]:
+        """
+        Retrieve a page of the user's operations, newest first, with keyset pagination.
+
+        The page is read by the (user, timestamp, id) index starting right after
+        `after`, so its cost doesn't depend on how deep the page is. On the
+        partitioned table the cursor and the date range also prune the
+        partitions that can't contain the page.
+
+        Args:
+            user (CustomCustomer): The owner of the operations.
+            limit (int): The page size.
+            after (Position, optional): The (timestamp, id) of the last row of
+                the previous page.
+            columns (Sequence[str], optional): Read only these columns: the page
+                is then a list of tuples of the columns followed by the
+                timestamp and the id, not model instances.
+            **filters: Filters accepted by `filter_operations`.
+        Returns:
+            tuple: The operations of the page and the position to continue
+            from, or None if this is the last page.
+        """
+        if cls._page_in_snapshot(limit, after, filters):
+            snapshot = account_snapshots.get(user.pk)
+            return cls._page_rows(snapshot.operations, columns), snapshot.next_position
+        with read_from_replica(user.pk):
+            return cls.query_operations_page(user, limit, after, columns, **filters)
+
+    @staticmethod
+    def _page_in_snapshot(limit: int, after: Position | None, filters: dict) -> bool:
+        """Check whether the requested page is the one kept in the account snapshot."""
+        return (
+            after is None
+            and limit == SNAPSHOT_PAGE_SIZE
+            and all(value is None for value in filters.values())
+            and account_snapshots.enabled()
+        )
+
+    @classmethod
+    @metrics.instrumented
+    def query_operations_page(
+        cls,
+        user: CustomCustomer | int,
+        limit: int = 5,
+        after: Position | None = None,
+        columns: Sequence[str] | None = None,
+        **filters: Any,
+    ) -> tuple[list[BalanceOperation] | list[tuple], Position | None]:
+        """Read a page of operations from the database, bypassing the snapshot cache.
+
+        Takes the same arguments as `get_operations_page`.
+        """
+        queryset = cls._operations_page_queryset(user, limit, after, columns, **filters)
+        return cls._split_page(list(queryset), limit)
+
+    @classmethod
+    def _operations_page_queryset(
+        cls,
+        user: CustomCustomer | int,
+        limit: int,
+        after: Position | None,
+        columns: Sequence[str] | None = None,
+        **filters: Any,
+    ) -> QuerySet:
+        """Build the query of a history page; it fetches one extra row to detect the next page."""
+        queryset = cls.filter_operations(
+            BalanceOperation.objects.filter(user=user), **filters
+        )
+        if after is not None:
+            timestamp, pk = after
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk),
+                timestamp__lte=timestamp,
+            )
+        if columns is not None:
+            queryset = queryset.values_list(*columns, "timestamp", "id")
+        return queryset.order_by("-timestamp", "-id")[: limit + 1]
+
+    @staticmethod
+    def _page_rows(
+        operations: list[BalanceOperation], columns: Sequence[str] | None
+    ) -> list[BalanceOperation] | list[tuple]:
+        """Turn operations into the rows `values_list` would return for `columns`."""
+        if columns is None:
+            return operations
+        row = attrgetter(*columns, "timestamp", "id")
+        return [row(operation) for operation in operations]
+
+    @staticmethod
+    def _split_page(
+        operations: list[BalanceOperation] | list[tuple], limit: int
+    ) -> tuple[list[BalanceOperation] | list[tuple], Position | None]:
+        if len(operations) <= limit:
+            return operations, None
+        operations = operations[:limit]
+        last = operations[-1]
+        if isinstance(last, tuple):
+            return operations, (last[-2], last[-1])
+        return operations, (last.timestamp, last.id)
+
+    # Асинхронные точки входа для представлений под ASGI. Используют
+    # асинхронный ORM; кеш снимков синхронный и вызывается через sync_to_async.
+
+    @staticmethod
+    async def aquery_balance(user_id: int) -> int:
+        """Async version of `query_balance`."""
+        return await BalanceService._balance_queryset().aget(pk=user_id)
+
+    @classmethod
+    async def acheck_user_balance_in_kopecks(cls, user: CustomCustomer) -> int:
+        """Async version of `check_user_balance_in_kopecks`.
+
+        Reads only the balance column instead of loading deferred fields of
+        the user.
+        """
+        if account_snapshots.enabled():
+            snapshot = await sync_to_async(account_snapshots.get)(user.pk)
+            return snapshot.balance
+        if cls._has_loaded_balance(user):
+            return user.balance
+        async with aread_from_replica(user.pk):
+            return await cls.aquery_balance(user.pk)
+
+    @classmethod
+    async def acheck_user_balance_in_rubles(cls, user: CustomCustomer) -> float | None:
+        """Async version of `check_user_balance_in_rubles`."""
+        if user is None:
+            return None
+        return await cls.acheck_user_balance_in_kopecks(user) / 100
+
+    @classmethod
+    async def aget_operations_page(
+        cls,
+        user: CustomCustomer,
+        limit: int = 5,
+        after: Position | None = None,
+        columns: Sequence[str] | None = None,
+        **filters: Any,
+    ) -> tuple[list[BalanceOperation] | list[tuple], Position | None]:
+        """Async version of `get_operations_page`."""
+        if cls._page_in_snapshot(limit, after, filters):
+            snapshot = await sync_to_async(account_snapshots.get)(user.pk)
+            return cls._page_rows(snapshot.operations, columns), snapshot.next_position
+        queryset = cls._operations_page_queryset(user, limit, after, columns, **filters)
+        async with aread_from_replica(user.pk):
+            operations = [operation async for operation in queryset]
+        return cls._split_page(operations, limit)
+
+    @staticmethod
+    def _normalize_transfer_legs(
+        legs: Iterable[Sequence], sender: CustomCustomer | int | None
+    ) -> list[tuple[int, int, int]]:
+        """
+        Bring batch transfer legs to (sender_id, recipient_id, amount) triples.
+        Args:
+            legs: (recipient_id, amount) pairs when `sender` is given,
+                otherwise (sender, recipient, amount) triples.
+            sender: The customer sending every leg, if common for the batch.
+        Returns:
+            list[tuple[int, int, int]]: Normalized legs with primary keys.
+        """
+        normalized = []
+        for leg in legs:
+            if sender is not None:
+                recipient, amount = leg
+                leg_sender = sender
+            else:
+                leg_sender, recipient, amount = leg
+            normalized.append(
+                (
+                    int(getattr(leg_sender, "pk", leg_sender)),
+                    int(getattr(recipient, "pk", recipient)),
+                    int(amount),
+                )
+            )
+        return normalized
+
+    @staticmethod
+    def _check_transfer_leg(
+        customers: dict[int, CustomCustomer],
+        sender_id: int,
+        recipient_id: int,
+        amount_in_kopecks: int,
+    ) -> str | None:
+        """Return the reason a transfer leg can't be executed, or None if it can."""
+        if amount_in_kopecks <= 0:
+            return "Amount must be a positive number."
+        if sender_id not in customers:
+            return f"Sender with id {sender_id} does not exist."
+        if recipient_id not in customers:
+            return f"Recipient with id {recipient_id} does not exist."
+        if sender_id == recipient_id:
+            return "You can't transfer money to yourself. Please choose another recipient."
+        sender_balance = customers[sender_id].balance
+        if sender_balance < amount_in_kopecks:
+            return f"Insufficient balance. User balance: {sender_balance / 100} rubles"
+        return None
+
+    @classmethod
+    @metrics.instrumented
+    def transfer_many(
+        cls,
+        legs: Iterable[Sequence],
+        sender: CustomCustomer | int | None = None,
+        atomic: bool = True,
+    ) -> list[TransferLegResult]:
+        """
+        Execute many transfers in a single transaction.
+
+        Every involved customer row is locked with one ordered
+        SELECT ... FOR UPDATE, balances are written with one bulk update and
+        the BalanceOperation rows with one bulk insert. Legs are applied in
+        the given order, so a leg may spend money received by an earlier one.
+
+        Args:
+            legs: (recipient_id, amount_in_kopecks) pairs when `sender` is given,
+                otherwise (sender, recipient, amount_in_kopecks) triples.
+            sender (CustomCustomer | int, optional): The sender of every leg.
+            atomic (bool): All-or-nothing mode. If any leg fails, nothing is
+                applied and BatchTransferError is raised. Otherwise failed legs
+                are recorded as unsuccessful operations and the rest are applied.
+
+        Returns:
+            list[TransferLegResult]: Per-leg outcomes in the order of `legs`.
+        """
+        normalized = cls._normalize_transfer_legs(legs, sender)
+        customer_ids = sorted(
+            {pk for sender_id, recipient_id, _ in normalized for pk in (sender_id, recipient_id)}
+        )
+        results: list[TransferLegResult] = []
+        operations: list[BalanceOperation] = []
+        changed: set[int] = set()
+
+        with transaction.atomic():
+            customers = {
+                customer.pk: customer
+                for customer in CustomCustomer.objects.select_for_update()
+                .filter(pk__in=customer_ids)
+                .order_by("pk")
+                .only("id", "email", "balance", "balance_slot_count")
+            }
+            # Слоты горячих счетов сводятся в основной баланс, и дальше
+            # переводы пакета работают только с заблокированными строками.
+            for customer in customers.values():
+                if customer.balance_slot_count:
+                    customer.balance += sweep_slots(customer.pk)
+            for sender_id, recipient_id, amount in normalized:
+                result = TransferLegResult(sender_id, recipient_id, amount)
+                results.append(result)
+                error = cls._check_transfer_leg(customers, sender_id, recipient_id, amount)
+                sender_customer = customers.get(sender_id)
+                recipient_customer = customers.get(recipient_id)
+                if error:
+                    result.success = False
+                    result.error = error
+                    if sender_customer is not None:
+                        result.sender_balance = sender_customer.balance
+                        operations.append(
+                            BalanceOperation(
+                                user=sender_customer,
+                                amount=-amount,
+                                operation_type="DECREASE",
+                                related_customer=cls._related_customer_label(
+                                    recipient_customer
+                                ),
+                                counterparty=recipient_customer,
+                                text_error=error,
+                                success=False,
+                            )
+                        )
+                    continue
+
+                sender_customer.balance -= amount
+                recipient_customer.balance += amount
+                changed.update((sender_id, recipient_id))
+                result.sender_balance = sender_customer.balance
+                transfer_group = uuid.uuid4()
+                operations.append(
+                    BalanceOperation(
+                        user=sender_customer,
+                        amount=-amount,
+                        operation_type="TRANSFER",
+                        related_customer=cls._related_customer_label(recipient_customer),
+                        counterparty=recipient_customer,
+                        transfer_group=transfer_group,
+                    )
+                )
+                operations.append(
+                    BalanceOperation(
+                        user=recipient_customer,
+                        amount=amount,
+                        operation_type="INCREASE",
+                        related_customer=cls._related_customer_label(sender_customer),
+                        counterparty=sender_customer,
+                        transfer_group=transfer_group,
+                    )
+                )
+
+            failed = sum(not result.success for result in results)
+            if atomic and failed:
+                raise BatchTransferError(
+                    f"{failed} of {len(results)} transfers failed, nothing was applied.",
+                    results,
+                )
+            if changed:
+                CustomCustomer.objects.bulk_update(
+                    [customers[pk] for pk in sorted(changed)], ["balance"]
+                )
+            BalanceOperation.objects.bulk_create(operations)
+            rollups.record_operations(operations)
+            outbox.record_operations(operations)
+            cls._on_accounts_changed(
+                *{operation.user_id for operation in operations}
+            )
+
+        return results
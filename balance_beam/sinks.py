@@ -0,0 +1,134 @@
+"""Получатели событий outbox.
+
+Диспетчер (balance_beam/outbox.py) передаёт получателю пачку событий в
+порядке id и удаляет их только после успешного возврата send(), поэтому
+события доставляются хотя бы один раз: после сбоя пачка приходит повторно,
+и получатель отбрасывает события, номер (`sequence`) которых не больше
+последнего принятого номера их счёта. Получатель задаётся путём к
+классу в OUTBOX_SINK, аргументы конструктора - в OUTBOX_SINK_OPTIONS.
+
+FileSink дописывает события в файл NDJSON и нужен для разработки и тестов.
+HTTPSink отправляет пачку одним POST-запросом с JSON; ответ 429 или 503
+означает, что получатель перегружен, и диспетчер уменьшает пачки и ждёт
+Retry-After. Для проверки без внешней системы есть заглушка
+`python -m benchmarks.outbox_stub`.
+"""
+import json
+import os
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+from .conf import get_setting
+
+
+class SinkError(Exception):
+    """Raised by a sink that couldn't deliver a batch; the dispatcher retries it."""
+
+    reason = "error"
+
+    def __init__(self, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SinkBackpressure(SinkError):
+    """Raised by a sink that asks the dispatcher to slow down."""
+
+    reason = "backpressure"
+
+
+class EventSink:
+    """Base class of the outbox sinks."""
+
+    def send(self, events: list[dict]) -> None:
+        """
+        Deliver a batch of events, in order.
+        Args:
+            events (list[dict]): The events, see outbox.event_message().
+        Raises:
+            SinkError: If the batch wasn't delivered.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release the resources of the sink."""
+
+
+def encode_events(events: list[dict]) -> bytes:
+    """Encode events as NDJSON."""
+    return "".join(
+        json.dumps(event, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n" for event in events
+    ).encode()
+
+
+class FileSink(EventSink):
+    """Append the events to an NDJSON file."""
+
+    def __init__(self, path: str, fsync: bool = False) -> None:
+        self.path = path
+        self.fsync = fsync
+        self._fd: int | None = None
+
+    def send(self, events: list[dict]) -> None:
+        data = encode_events(events)
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            # Пачка пишется одним вызовом: строки диспетчеров разных частей
+            # не перемешиваются.
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view) :]
+            if self.fsync:
+                os.fsync(self._fd)
+        except OSError as error:
+            raise SinkError(f"Can't write to {self.path}: {error}") from error
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class HTTPSink(EventSink):
+    """POST the events as `{"events": [...]}` to a URL."""
+
+    THROTTLING_STATUSES = (429, 503)
+
+    def __init__(self, url: str, timeout: float = 10.0, headers: dict[str, str] | None = None) -> None:
+        self.url = url
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+
+    def send(self, events: list[dict]) -> None:
+        body = json.dumps({"events": events}, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+        request = Request(self.url, data=body, headers=self.headers, method="POST")
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except HTTPError as error:
+            if error.code in self.THROTTLING_STATUSES:
+                raise SinkBackpressure(
+                    f"{self.url} responded with {error.code}",
+                    retry_after=_retry_after(error.headers.get("Retry-After")),
+                ) from error
+            raise SinkError(f"{self.url} responded with {error.code}") from error
+        except (URLError, OSError) as error:
+            raise SinkError(f"Can't reach {self.url}: {error}") from error
+
+
+def _retry_after(value: str | None) -> float | None:
+    # Дата HTTP в Retry-After не поддерживается: диспетчер ждёт по своему
+    # расписанию повторов.
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def load_sink() -> EventSink:
+    """Create the sink configured in OUTBOX_SINK with OUTBOX_SINK_OPTIONS."""
+    return import_string(get_setting("OUTBOX_SINK"))(**get_setting("OUTBOX_SINK_OPTIONS"))
@@ -0,0 +1,143 @@
+"""Кеш снимков счёта: баланс и первая страница истории операций.
+
+Снимки хранятся в кеше Django. Операции записи BalanceService сбрасывают
+снимок только после фиксации транзакции (on_commit): увеличивают номер
+поколения счёта, и снимки старых поколений больше не принимаются. Поэтому
+загрузка, начатая до записи, не может вернуть в кеш устаревшие данные.
+Одновременные промахи по одному счёту в процессе объединяются в одну
+загрузку из базы (single-flight).
+"""
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .conf import get_setting
+from .models import BalanceOperation
+from .pagination import Position
+
+# Размер страницы истории, которая хранится в снимке: страница по умолчанию.
+SNAPSHOT_PAGE_SIZE = 5
+
+
+@dataclass
+class AccountSnapshot:
+    generation: int
+    balance: int
+    operations: list[BalanceOperation]
+    next_position: Position | None
+    loaded_at: float
+
+
+class AccountSnapshotCache:
+    """Per-account snapshot cache with generation-based invalidation and single-flight loads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._inflight: dict[int, Future] = {}
+        self._stats = dict.fromkeys(
+            ("hits", "misses", "stale_hits", "coalesced", "invalidations"), 0
+        )
+
+    @staticmethod
+    def enabled() -> bool:
+        """Check whether the snapshot cache is turned on in the settings."""
+        return get_setting("ACCOUNT_SNAPSHOT_CACHE")
+
+    @staticmethod
+    def _cache():
+        return caches[get_setting("CACHE_ALIAS")]
+
+    @staticmethod
+    def _keys(user_id: int) -> tuple[str, str]:
+        return (
+            f"balance_beam:snapshot_generation:{user_id}",
+            f"balance_beam:snapshot:{user_id}",
+        )
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += value
+
+    def stats(self) -> dict[str, int]:
+        """Return the hit, miss, staleness, coalescing and invalidation counters of this process."""
+        with self._lock:
+            return dict(self._stats)
+
+    def get(self, user_id: int) -> AccountSnapshot:
+        """
+        Return the snapshot of the account, loading it from the database on a miss.
+
+        A hit is counted as stale when the snapshot is older than
+        ACCOUNT_SNAPSHOT_STALE_AFTER seconds.
+        """
+        generation_key, snapshot_key = self._keys(user_id)
+        cached = self._cache().get_many([generation_key, snapshot_key])
+        snapshot = cached.get(snapshot_key)
+        if snapshot is not None and snapshot.generation == cached.get(generation_key):
+            self._count("hits")
+            if time.time() - snapshot.loaded_at > get_setting("ACCOUNT_SNAPSHOT_STALE_AFTER"):
+                self._count("stale_hits")
+            return snapshot
+        self._count("misses")
+        return self._load_once(user_id)
+
+    def _load_once(self, user_id: int) -> AccountSnapshot:
+        with self._lock:
+            future = self._inflight.get(user_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[user_id] = Future()
+        if not leader:
+            self._count("coalesced")
+            return future.result()
+        try:
+            snapshot = self._load(user_id)
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(snapshot)
+            return snapshot
+        finally:
+            with self._lock:
+                del self._inflight[user_id]
+
+    def _load(self, user_id: int) -> AccountSnapshot:
+        from .services import BalanceService
+
+        cache = self._cache()
+        generation_key, snapshot_key = self._keys(user_id)
+        # Поколение читается до загрузки: если запись зафиксируется во время
+        # загрузки, снимок окажется старого поколения и не будет принят.
+        cache.add(generation_key, time.time_ns(), timeout=None)
+        generation = cache.get(generation_key)
+        balance = BalanceService.query_balance(user_id)
+        operations, next_position = BalanceService.query_operations_page(
+            user_id, limit=SNAPSHOT_PAGE_SIZE
+        )
+        snapshot = AccountSnapshot(generation, balance, operations, next_position, time.time())
+        cache.set(snapshot_key, snapshot, get_setting("ACCOUNT_SNAPSHOT_TIMEOUT"))
+        return snapshot
+
+    def invalidate(self, *user_ids: int) -> None:
+        """Invalidate the snapshots of the accounts right away."""
+        cache = self._cache()
+        for user_id in user_ids:
+            generation_key, _ = self._keys(user_id)
+            try:
+                cache.incr(generation_key)
+            except ValueError:
+                cache.set(generation_key, time.time_ns(), timeout=None)
+        self._count("invalidations", len(user_ids))
+
+    def invalidate_on_commit(self, *user_ids: int) -> None:
+        """Invalidate the snapshots of the accounts once the current transaction commits."""
+        if self.enabled() and user_ids:
+            transaction.on_commit(lambda: self.invalidate(*user_ids))
+
+
+account_snapshots = AccountSnapshotCache()
@@ -0,0 +1,114 @@
+"""Горячие пути API и BalanceService для тестов и check_query_plans.
+
+Каждый путь из HOT_PATHS - вызов эндпоинта через тестовый клиент Django или
+метода BalanceService на счетах HotPathFixture. Имена путей совпадают с
+ключами QUERY_BUDGETS (balance_beam/query_checks.py). Модуль использует
+django.test, поэтому сервис его не импортирует.
+"""
+import json
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.test import Client
+
+from .models import CustomCustomer
+from .serializers.token import CustomerTokenObtainPairSerializer
+from .services import BalanceService
+
+
+# Настройки BALANCE_BEAM, с которыми выполняются горячие пути: все запросы
+# идут в основную базу, без кэша снимков и без фоновых потоков, которые не
+# видят данных транзакции проверки. Асинхронные переводы и outbox включены,
+# чтобы их запросы учитывались в бюджетах.
+HOT_PATH_SETTINGS = {
+    "READ_REPLICAS": [],
+    "ACCOUNT_SNAPSHOT_CACHE": False,
+    "INCREASE_BATCHING": False,
+    "ADMISSION_CONTROL": False,
+    "ASYNC_TRANSFERS": True,
+    "OUTBOX_ENABLED": True,
+}
+
+
+@dataclass
+class HotPathFixture:
+    """The accounts the hot paths run on."""
+
+    sender: CustomCustomer
+    recipients: list[int]
+    client: Client
+    auth: dict[str, str]
+
+
+def make_fixture(sender: CustomCustomer, recipients: list[int]) -> HotPathFixture:
+    """Build the fixture: an API client authenticated as `sender` with a real access token."""
+    token = CustomerTokenObtainPairSerializer.get_token(sender).access_token
+    hosts = [host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"]
+    return HotPathFixture(
+        sender=sender,
+        recipients=recipients,
+        client=Client(HTTP_HOST=hosts[0] if hosts else "localhost", raise_request_exception=True),
+        auth={"HTTP_AUTHORIZATION": f"Bearer {token}"},
+    )
+
+
+def _post(fixture: HotPathFixture, path: str, body: dict) -> None:
+    response = fixture.client.post(
+        path, json.dumps(body), content_type="application/json", **fixture.auth
+    )
+    _check_status(path, response.status_code)
+
+
+def _get(fixture: HotPathFixture, path: str) -> None:
+    _check_status(path, fixture.client.get(path, **fixture.auth).status_code)
+
+
+def _check_status(path: str, status_code: int) -> None:
+    if status_code >= 400:
+        raise AssertionError(f"{path} responded with {status_code}")
+
+
+def _token_user(fixture: HotPathFixture) -> CustomCustomer:
+    sender = fixture.sender
+    return CustomCustomer.from_token_claims(sender.pk, True, sender.token_version)
+
+
+HOT_PATHS: dict[str, Callable[[HotPathFixture], None]] = {
+    "api:increase_balance": lambda f: _post(f, "/api/v1/increase_balance/", {"amount": 100}),
+    "api:transfer_balance": lambda f: _post(
+        f, "/api/v1/transfer_balance/", {"recipient_id": f.recipients[0], "amount": 100}
+    ),
+    "api:transfer_balance_batch": lambda f: _post(
+        f,
+        "/api/v1/transfer_balance/batch/",
+        {"transfers": [{"recipient_id": pk, "amount": 100} for pk in f.recipients]},
+    ),
+    "api:transfer_balance_async": lambda f: _post(
+        f, "/api/v1/transfer_balance/async/", {"recipient_id": f.recipients[0], "amount": 100}
+    ),
+    "api:check_balance": lambda f: _post(f, "/api/v1/check_balance/", {}),
+    "api:check_balance_in_rubles": lambda f: _get(f, "/api/v1/check_balance_in_rubles/"),
+    "api:get_operations_history": lambda f: _get(f, "/api/v1/get_operations_history/?limit=20"),
+    "api:get_operations_history_filtered": lambda f: _get(
+        f,
+        "/api/v1/get_operations_history/"
+        f"?limit=20&operation_type=TRANSFER&success=true&counterparty={f.recipients[0]}",
+    ),
+    "api:get_statement": lambda f: _get(f, "/api/v1/statement/"),
+    "service:increase_balance": lambda f: BalanceService.increase_balance(
+        f.sender, 100, sender=f.sender
+    ),
+    "service:transfer_balance": lambda f: BalanceService.transfer_balance(
+        f.sender, f.recipients[0], 100
+    ),
+    "service:transfer_many": lambda f: BalanceService.transfer_many(
+        [(pk, 100) for pk in f.recipients], sender=f.sender
+    ),
+    "service:check_user_balance_in_kopecks": lambda f: BalanceService.check_user_balance_in_kopecks(
+        _token_user(f)
+    ),
+    "service:get_operations_page": lambda f: BalanceService.get_operations_page(
+        _token_user(f), limit=20
+    ),
+}
@@ -1,3 +1,2077 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import importlib.util
+import json
+import tempfile
+import threading
+import time
+import warnings
+from datetime import date, datetime, timezone as dt_timezone
+from io import StringIO
+from types import ModuleType
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import (
+    DatabaseError,
+    IntegrityError,
+    OperationalError,
+    connection,
+    connections,
+    router,
+    transaction,
+)
+from django.db.models import DateField, Q, Sum
+from django.db.models.functions import Trunc
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import (
+    batching,
+    exports,
+    hot_accounts,
+    imports,
+    metrics,
+    outbox,
+    partitioning,
+    reconciliation,
+    rollups,
+    routers,
+    snapshots,
+    testing,
+    transfer_queue,
+)
+from .admission import AdmissionControlMiddleware, admission_controller
+from .conf import get_setting
+from .idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER
+from .models import (
+    BalanceOperation,
+    BalanceSlot,
+    CustomCustomer,
+    IdempotencyRecord,
+    ImportCheckpoint,
+    LedgerCheckpoint,
+    OperationRollup,
+    OperationRollupDelta,
+    OutboxEvent,
+    OutboxSequence,
+    TransferRequest,
+)
+from .query_checks import QUERY_BUDGETS, query_budget
+from .recipients import cached_recipient, resolve_recipient
+from .fast_json import FastJSONRenderer
+from .serializers import (
+    CustomerTokenObtainPairSerializer,
+    HistoryOperationSerializer,
+    history_rows,
+)
+from .services import BalanceService, BatchTransferError
+from .sinks import EventSink, SinkError
+
+
+def create_customer(email: str, balance: int = 0, **kwargs) -> CustomCustomer:
+    """Create a customer with the given balance in kopecks."""
+    return CustomCustomer.objects.create_user(email, "password", balance=balance, **kwargs)
+
+
+def token_client(user: CustomCustomer) -> APIClient:
+    """Build an API client authenticated with a new access token of the user."""
+    client = APIClient()
+    token = CustomerTokenObtainPairSerializer.get_token(user).access_token
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    return client
+
+
+def balance_beam_settings(**overrides) -> override_settings:
+    """Override some BALANCE_BEAM settings and keep the rest of the project's."""
+    return override_settings(
+        BALANCE_BEAM={**getattr(settings, "BALANCE_BEAM", {}), **overrides}
+    )
+
+
+def balances(*customers: CustomCustomer) -> list[int]:
+    """Read the current balances of the customers from the database."""
+    stored = dict(
+        CustomCustomer.objects.filter(pk__in=[customer.pk for customer in customers])
+        .values_list("pk", "balance")
+    )
+    return [stored[customer.pk] for customer in customers]
+
+
+class TransferManyTests(TestCase):
+    def setUp(self):
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com", 0)
+        self.carol = create_customer("carol@example.com", 500)
+
+    def test_applies_legs_in_order(self):
+        # Второй перевод тратит деньги, полученные Бобом в первом.
+        results = BalanceService.transfer_many(
+            [(self.alice, self.bob, 3000), (self.bob, self.carol, 2000)]
+        )
+
+        self.assertEqual([result.success for result in results], [True, True])
+        self.assertEqual([result.sender_balance for result in results], [7000, 1000])
+        self.assertEqual(balances(self.alice, self.bob, self.carol), [7000, 1000, 2500])
+        operations = BalanceOperation.objects.filter(success=True)
+        self.assertEqual(operations.filter(operation_type="TRANSFER").count(), 2)
+        self.assertEqual(operations.filter(operation_type="INCREASE").count(), 2)
+
+    def test_reversed_order_fails_the_leg_that_isnt_funded_yet(self):
+        with self.assertRaises(BatchTransferError) as raised:
+            BalanceService.transfer_many(
+                [(self.bob, self.carol, 2000), (self.alice, self.bob, 3000)]
+            )
+
+        self.assertEqual([result.success for result in raised.exception.results], [False, True])
+
+    def test_atomic_batch_is_rolled_back_when_a_leg_fails(self):
+        with self.assertRaises(BatchTransferError) as raised:
+            BalanceService.transfer_many(
+                [(self.bob, 1000), (self.carol, 20000)], sender=self.alice
+            )
+
+        results = raised.exception.results
+        self.assertEqual([result.success for result in results], [True, False])
+        self.assertTrue(results[1].error.startswith("Insufficient balance"))
+        self.assertEqual(balances(self.alice, self.bob, self.carol), [10000, 0, 500])
+        self.assertFalse(BalanceOperation.objects.exists())
+
+    def test_partial_batch_applies_the_legs_that_succeed(self):
+        missing_id = self.carol.pk + 1000
+        results = BalanceService.transfer_many(
+            [(self.bob, 1000), (missing_id, 100), (self.alice, 100), (self.carol, 20000)],
+            sender=self.alice,
+            atomic=False,
+        )
+
+        self.assertEqual(
+            [result.success for result in results], [True, False, False, False]
+        )
+        self.assertEqual(
+            [result.error.split(".")[0] for result in results[1:]],
+            [
+                f"Recipient with id {missing_id} does not exist",
+                "You can't transfer money to yourself",
+                "Insufficient balance",
+            ],
+        )
+        self.assertEqual([result.sender_balance for result in results], [9000] * 4)
+        self.assertEqual(balances(self.alice, self.bob, self.carol), [9000, 1000, 500])
+
+    def test_failed_legs_are_recorded_like_other_failed_debits(self):
+        BalanceService.transfer_many([(self.carol, 20000)], sender=self.alice, atomic=False)
+
+        failed = BalanceOperation.objects.get(success=False)
+        self.assertEqual(failed.user_id, self.alice.pk)
+        self.assertEqual(failed.operation_type, "DECREASE")
+        self.assertEqual(failed.amount, -20000)
+        self.assertEqual(failed.related_customer, f"carol@example.com, id: {self.carol.pk}")
+        self.assertEqual(failed.counterparty_id, self.carol.pk)
+        self.assertIsNone(failed.transfer_group)
+
+
+class TransferBalanceStrategyTests:
+    """Выполнение перевода не должно зависеть от EXECUTION_STRATEGY."""
+
+    def setUp(self):
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com", 500)
+
+    def test_returns_the_sender_balance(self):
+        balance = BalanceService.transfer_balance(self.alice, self.bob.pk, 2500)
+
+        self.assertEqual(balance, 7500)
+        self.assertEqual(balances(self.alice, self.bob), [7500, 3000])
+        operations = BalanceOperation.objects.order_by("user_id")
+        self.assertEqual(
+            [(op.user_id, op.amount, op.operation_type) for op in operations],
+            [(self.alice.pk, -2500, "TRANSFER"), (self.bob.pk, 2500, "INCREASE")],
+        )
+
+    def test_legs_point_at_each_other(self):
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 2500)
+
+        debit, credit = BalanceOperation.objects.order_by("user_id")
+        self.assertEqual(debit.counterparty_id, self.bob.pk)
+        self.assertEqual(credit.counterparty_id, self.alice.pk)
+        self.assertIsNotNone(debit.transfer_group)
+        self.assertEqual(debit.transfer_group, credit.transfer_group)
+
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 100)
+        self.assertEqual(
+            BalanceOperation.objects.values("transfer_group").distinct().count(), 2
+        )
+
+    def test_history_filters_by_counterparty(self):
+        carol = create_customer("carol@example.com", 0)
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 100)
+        BalanceService.transfer_balance(self.alice, carol.pk, 200)
+        BalanceService.transfer_balance(self.bob, self.alice.pk, 300)
+        BalanceService.increase_balance(self.alice, 400)
+
+        response = token_client(self.alice).get(
+            reverse("get_operations_history") + f"?limit=10&counterparty={self.bob.pk}"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["amount"] for row in response.json()], [300, -100])
+
+    def test_insufficient_balance(self):
+        with self.assertRaisesMessage(
+            ValueError, "Insufficient balance. User balance: 5.0 rubles"
+        ):
+            BalanceService.transfer_balance(self.bob, self.alice.pk, 501)
+
+        self.assertEqual(balances(self.alice, self.bob), [10000, 500])
+        self.assertFalse(BalanceOperation.objects.exists())
+
+    def test_transfer_to_yourself(self):
+        with self.assertRaisesMessage(ValueError, "You can't transfer money to yourself."):
+            BalanceService.transfer_balance(self.alice, self.alice.pk, 100)
+
+        self.assertEqual(balances(self.alice), [10000])
+        self.assertFalse(BalanceOperation.objects.exists())
+
+    def test_missing_recipient(self):
+        with self.assertRaises(CustomCustomer.DoesNotExist):
+            BalanceService.transfer_balance(self.alice, self.bob.pk + 1000, 100)
+
+        # Списание отправителя откатывается вместе с переводом.
+        self.assertEqual(balances(self.alice, self.bob), [10000, 500])
+        self.assertFalse(BalanceOperation.objects.exists())
+
+
+@balance_beam_settings(EXECUTION_STRATEGY="pessimistic")
+class PessimisticTransferBalanceTests(TransferBalanceStrategyTests, TestCase):
+    pass
+
+
+@balance_beam_settings(EXECUTION_STRATEGY="conditional")
+class ConditionalTransferBalanceTests(TransferBalanceStrategyTests, TestCase):
+    pass
+
+
+# Стратегия задана явно: пачка применяется условными UPDATE и при ней.
+@balance_beam_settings(EXECUTION_STRATEGY="pessimistic")
+class IncreaseBalanceBatcherTests(TestCase):
+    """Пачка применяется напрямую, без фонового потока: у потока своё
+    соединение, и данных транзакции теста он не видит."""
+
+    def setUp(self):
+        self.alice = create_customer("alice@example.com", 100)
+        self.bob = create_customer("bob@example.com")
+
+    def test_collects_queued_increases_up_to_the_max_size(self):
+        batcher = batching.IncreaseBalanceBatcher(window_ms=50, max_size=2)
+        queued = [batching._PendingIncrease(self.alice, amount, None) for amount in (1, 2, 3)]
+        for pending in queued:
+            batcher._queue.put(pending)
+
+        self.assertEqual(batcher._collect(), queued[:2])
+        self.assertEqual(batcher._collect(), queued[2:])
+
+    def test_increases_of_one_account_are_applied_in_one_update(self):
+        batch = [
+            batching._PendingIncrease(self.alice, 100, None),
+            batching._PendingIncrease(self.bob, 50, self.alice),
+            batching._PendingIncrease(self.alice, 200, None),
+        ]
+
+        with CaptureQueriesContext(connection) as captured:
+            batching.IncreaseBalanceBatcher._apply(batch)
+
+        table = CustomCustomer._meta.db_table
+        statements = [query["sql"] for query in captured.captured_queries]
+        self.assertEqual(sum(sql.startswith(f'UPDATE "{table}"') for sql in statements), 2)
+        self.assertFalse([sql for sql in statements if "FOR UPDATE" in sql])
+        self.assertEqual(balances(self.alice, self.bob), [400, 50])
+        operations = [pending.future.result(0) for pending in batch]
+        self.assertEqual(
+            [(op.user_id, op.amount, op.counterparty_id) for op in operations],
+            [
+                (self.alice.pk, 100, None),
+                (self.bob.pk, 50, self.alice.pk),
+                (self.alice.pk, 200, None),
+            ],
+        )
+        self.assertEqual(BalanceOperation.objects.count(), 3)
+
+    def test_missing_customer_fails_only_its_own_request(self):
+        missing = CustomCustomer(pk=self.bob.pk + 1000)
+        batch = [
+            batching._PendingIncrease(missing, 100, None),
+            batching._PendingIncrease(self.alice, 100, None),
+        ]
+
+        batching.IncreaseBalanceBatcher._apply(batch)
+
+        with self.assertRaisesMessage(
+            CustomCustomer.DoesNotExist, f"Customer with id {missing.pk} does not exist."
+        ):
+            batch[0].future.result(0)
+        self.assertEqual(batch[1].future.result(0).user_id, self.alice.pk)
+        self.assertEqual(balances(self.alice), [200])
+        self.assertEqual(BalanceOperation.objects.get().user_id, self.alice.pk)
+
+
+def utc(*args) -> datetime:
+    """Build an aware datetime in UTC."""
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+def partition_of(operation: BalanceOperation) -> str:
+    """Return the name of the partition holding the operation."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT tableoid::regclass::text FROM {partitioning.TABLE} WHERE id = %s",
+            [operation.pk],
+        )
+        return cursor.fetchone()[0]
+
+
+@skipUnless(connection.vendor == "postgresql", "Partitioning requires PostgreSQL.")
+class OperationPartitionsTests(TestCase):
+    """Секции создаются для месяцев в 2031 году: они не пересекаются с
+    секциями, созданными миграцией."""
+
+    def test_migration_partitions_the_table(self):
+        self.assertTrue(partitioning.is_partitioned(connection))
+        self.assertIn(partitioning.LEGACY_PARTITION, partitioning.attached_partitions(connection))
+
+    def test_command_creates_partitions_ahead(self):
+        out = StringIO()
+        with mock.patch.object(timezone, "now", return_value=utc(2031, 6, 15)):
+            call_command("partition_operations", ahead=2, stdout=out)
+            operation = BalanceOperation.objects.create(
+                user=create_customer("alice@example.com"), amount=100, operation_type="INCREASE"
+            )
+
+        months = partitioning.monthly_partitions(connection)
+        for month in ("2031_06", "2031_07", "2031_08"):
+            self.assertIn(f"Created {partitioning.TABLE}_p{month}", out.getvalue())
+        self.assertEqual(months[datetime(2031, 8, 1).date()], f"{partitioning.TABLE}_p2031_08")
+        self.assertEqual(partition_of(operation), f"{partitioning.TABLE}_p2031_06")
+
+        out = StringIO()
+        with mock.patch.object(timezone, "now", return_value=utc(2031, 6, 15)):
+            call_command("partition_operations", ahead=2, stdout=out)
+        self.assertEqual(out.getvalue(), "")
+
+    def test_command_selects_partitions_past_retention(self):
+        for month in (6, 7):
+            partitioning.create_month_partition(connection, datetime(2031, month, 1).date())
+        attached = partitioning.attached_partitions(connection)
+
+        out = StringIO()
+        with mock.patch.object(timezone, "now", return_value=utc(2031, 8, 10)):
+            call_command("partition_operations", ahead=0, retain=1, dry_run=True, stdout=out)
+
+        self.assertIn(f"Would detach {partitioning.TABLE}_p2031_06", out.getvalue())
+        self.assertNotIn(f"{partitioning.TABLE}_p2031_07", out.getvalue())
+        self.assertEqual(partitioning.attached_partitions(connection), attached)
+
+    def test_keyset_pages_cross_month_boundaries(self):
+        for month in (1, 2, 3):
+            partitioning.create_month_partition(connection, datetime(2031, month, 1).date())
+        user = create_customer("alice@example.com")
+        timestamps = [
+            utc(2031, 1, 31, 23, 59, 59, 999999),
+            utc(2031, 2, 1),
+            utc(2031, 2, 1),
+            utc(2031, 2, 28, 23, 59, 59, 999999),
+            utc(2031, 3, 1, 0, 0, 0, 1),
+        ]
+        operations = []
+        for timestamp in timestamps:
+            operation = BalanceOperation.objects.create(
+                user=user, amount=100, operation_type="INCREASE"
+            )
+            BalanceOperation.objects.filter(pk=operation.pk).update(timestamp=timestamp)
+            operations.append(operation)
+        self.assertEqual(
+            [partition_of(operation)[-7:] for operation in operations],
+            ["2031_01", "2031_02", "2031_02", "2031_02", "2031_03"],
+        )
+
+        seen, after = [], None
+        while True:
+            page, after = BalanceService.get_operations_page(user, 2, after)
+            seen += [operation.pk for operation in page]
+            if after is None:
+                break
+        expected = sorted(
+            zip(timestamps, [operation.pk for operation in operations]), reverse=True
+        )
+        self.assertEqual(seen, [pk for _, pk in expected])
+
+
+@skipUnless(connection.vendor == "postgresql", "Partitioning requires PostgreSQL.")
+class DetachPartitionTests(TransactionTestCase):
+    # DETACH PARTITION ... CONCURRENTLY не выполняется внутри транзакции.
+    def test_detached_partition_keeps_its_rows(self):
+        name = partitioning.create_month_partition(connection, datetime(2031, 6, 1).date())
+        self.addCleanup(self._drop_table, name)
+        operation = BalanceOperation.objects.create(
+            user=create_customer("alice@example.com"), amount=100, operation_type="INCREASE"
+        )
+        BalanceOperation.objects.filter(pk=operation.pk).update(timestamp=utc(2031, 6, 15))
+
+        partitioning.detach_partition(connection, name)
+
+        self.assertNotIn(name, partitioning.attached_partitions(connection))
+        self.assertFalse(BalanceOperation.objects.filter(pk=operation.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {connection.ops.quote_name(name)}")
+            self.assertEqual(cursor.fetchall(), [(operation.pk,)])
+
+    @staticmethod
+    def _drop_table(name: str) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(name)}")
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        self.user = create_customer("alice@example.com", 10000)
+        self.client = token_client(self.user)
+
+    def assertRejected(self, client: APIClient) -> None:
+        read = client.get(reverse("check_balance_in_rubles"))
+        write = client.post(reverse("increase_balance"), {"amount": 100}, format="json")
+        self.assertEqual((read.status_code, write.status_code), (401, 401))
+        self.assertEqual(read.data["code"], "token_revoked")
+        self.assertEqual(write.data["code"], "token_revoked")
+
+    def test_password_change_revokes_earlier_tokens(self):
+        # Версия попадает в кеш до смены пароля.
+        self.assertEqual(self.client.get(reverse("check_balance_in_rubles")).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse("users-detail", args=[self.user.pk]),
+                {"old_password": "password", "password": "N3w-secret-passw0rd"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_version, 1)
+        self.assertTrue(self.user.check_password("N3w-secret-passw0rd"))
+        self.assertRejected(self.client)
+        fresh = token_client(self.user)
+        self.assertEqual(fresh.get(reverse("check_balance_in_rubles")).status_code, 200)
+
+    def test_profile_update_keeps_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                reverse("users-detail", args=[self.user.pk]), {"first_name": "Alice"}, format="json"
+            )
+
+        self.assertEqual(self.client.get(reverse("check_balance_in_rubles")).status_code, 200)
+
+    def test_deactivation_revokes_tokens(self):
+        self.assertEqual(self.client.get(reverse("check_balance_in_rubles")).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save(update_fields=["is_active"])
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_version, 1)
+        response = self.client.get(reverse("check_balance_in_rubles"))
+        self.assertEqual(response.status_code, 401)
+
+        # Повторное сохранение неактивного пользователя версию не меняет.
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_version, 1)
+
+
+@balance_beam_settings(ACCOUNT_SNAPSHOT_CACHE=True)
+class AccountSnapshotCacheTests(TestCase):
+    def setUp(self):
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com", 500)
+        self.snapshots = snapshots.AccountSnapshotCache()
+        generation_key, snapshot_key = self.snapshots._keys(self.alice.pk)
+        self.generation_key = generation_key
+        self.snapshots._cache().delete_many([generation_key, snapshot_key])
+
+    def test_write_bumps_the_generation_after_commit(self):
+        generation = self.snapshots.get(self.alice.pk).generation
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            BalanceService.increase_balance(self.alice, 100)
+        # До фиксации снимок остаётся прежним.
+        self.assertEqual(self.snapshots._cache().get(self.generation_key), generation)
+        for callback in callbacks:
+            callback()
+
+        self.assertGreater(self.snapshots._cache().get(self.generation_key), generation)
+        self.assertEqual(self.snapshots.get(self.alice.pk).balance, 10100)
+        self.assertEqual(self.snapshots.stats()["misses"], 2)
+
+    def test_balance_and_history_are_read_again_after_a_transfer(self):
+        self.assertEqual(BalanceService.check_user_balance_in_kopecks(self.alice), 10000)
+        self.assertEqual(BalanceService.get_operations_page(self.alice)[0], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BalanceService.transfer_balance(self.alice, self.bob.pk, 2500)
+
+        self.assertEqual(BalanceService.check_user_balance_in_kopecks(self.alice), 7500)
+        page, _ = BalanceService.get_operations_page(self.alice)
+        self.assertEqual([(op.amount, op.operation_type) for op in page], [(-2500, "TRANSFER")])
+        # Повторное чтение берётся из снимка, без запросов к базе.
+        with self.assertNumQueries(0):
+            self.assertEqual(BalanceService.check_user_balance_in_kopecks(self.alice), 7500)
+
+    def test_concurrent_misses_share_one_load(self):
+        loading, release = threading.Event(), threading.Event()
+        snapshot = snapshots.AccountSnapshot(1, 10000, [], None, 0.0)
+
+        def load(user_id):
+            loading.set()
+            release.wait(5)
+            return snapshot
+
+        results = []
+        with mock.patch.object(self.snapshots, "_load", side_effect=load) as loader:
+            threads = [
+                threading.Thread(target=lambda: results.append(self.snapshots.get(self.alice.pk)))
+                for _ in range(3)
+            ]
+            threads[0].start()
+            self.assertTrue(loading.wait(5))
+            for thread in threads[1:]:
+                thread.start()
+            # Остальные промахи ждут загрузку, начатую первым.
+            deadline = time.monotonic() + 5
+            while self.snapshots.stats()["coalesced"] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        loader.assert_called_once_with(self.alice.pk)
+        self.assertEqual(results, [snapshot] * 3)
+        self.assertEqual(self.snapshots.stats()["misses"], 3)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user = create_customer("alice@example.com", 10000)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def increase(self, amount: int, key: str = "increase-1"):
+        return self.client.post(
+            reverse("increase_balance"),
+            {"amount": amount},
+            format="json",
+            headers={IDEMPOTENCY_HEADER: key},
+        )
+
+    def test_replays_the_stored_response(self):
+        first = self.increase(100)
+        second = self.increase(100)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn(REPLAYED_HEADER, first)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second[REPLAYED_HEADER], "true")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(balances(self.user), [10100])
+        self.assertEqual(BalanceOperation.objects.count(), 1)
+
+    def test_rejects_a_key_reused_with_another_body(self):
+        self.increase(100)
+        response = self.increase(200)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(balances(self.user), [10100])
+
+    def test_other_keys_and_users_are_independent(self):
+        self.increase(100)
+        self.increase(100, key="increase-2")
+        other = create_customer("bob@example.com")
+        self.client.force_authenticate(other)
+        self.increase(100)
+
+        self.assertEqual(balances(self.user, other), [10200, 100])
+
+    def test_expired_key_runs_the_request_again(self):
+        self.increase(100)
+        IdempotencyRecord.objects.update(expires_at=timezone.now())
+        response = self.increase(100)
+
+        self.assertNotIn(REPLAYED_HEADER, response)
+        self.assertEqual(balances(self.user), [10200])
+
+
+class ConcurrentIdempotencyKeyTests(TransactionTestCase):
+    def test_concurrent_requests_with_one_key_apply_once(self):
+        user = create_customer("alice@example.com", 10000)
+        barrier = threading.Barrier(4)
+        responses = []
+
+        def post():
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                responses.append(
+                    client.post(
+                        reverse("increase_balance"),
+                        {"amount": 100},
+                        format="json",
+                        headers={IDEMPOTENCY_HEADER: "concurrent"},
+                    )
+                )
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=post) for _ in range(barrier.parties)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [201] * 4)
+        self.assertEqual(sum(REPLAYED_HEADER in response for response in responses), 3)
+        self.assertEqual(balances(user), [10100])
+        self.assertEqual(BalanceOperation.objects.count(), 1)
+
+
+def async_read_urlconf() -> ModuleType:
+    """Build a URLconf with balance_beam.api_v1 imported under ASYNC_READ_VIEWS."""
+    with balance_beam_settings(ASYNC_READ_VIEWS=True):
+        spec = importlib.util.find_spec("balance_beam.api_v1")
+        api_v1 = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(api_v1)
+    urlconf = ModuleType("async_read_urls")
+    urlconf.urlpatterns = [path("api/v1/", include(api_v1.urlpatterns))]
+    return urlconf
+
+
+class AsyncReadViewsTests(TestCase):
+    """С ASYNC_READ_VIEWS эндпоинты чтения отвечают так же, как синхронные."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.async_urls = override_settings(ROOT_URLCONF=async_read_urlconf())
+
+    def setUp(self):
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com")
+        for amount in (100, 200, 300):
+            BalanceService.transfer_balance(self.alice, self.bob.pk, amount)
+        self.client = token_client(self.alice)
+
+    def request(self, client: APIClient, method: str, path: str):
+        response = getattr(client, method)(path)
+        with warnings.catch_warnings():
+            # Синхронный тестовый клиент дочитывает асинхронный поток выгрузки сам.
+            warnings.filterwarnings("ignore", "StreamingHttpResponse must consume")
+            response.body = b"".join(response) if response.streaming else response.content
+        return response
+
+    def assertSameResponse(self, method: str, path: str, client: APIClient | None = None):
+        client = client or self.client
+        expected = self.request(client, method, path)
+        with self.async_urls:
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(path.split("?")[0]).func))
+            actual = self.request(client, method, path)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.body, expected.body)
+        for header in ("Content-Type", "Content-Disposition", "Link", "WWW-Authenticate"):
+            self.assertEqual(actual.get(header), expected.get(header), header)
+        return actual
+
+    def test_responses_match_the_sync_views(self):
+        for method, path in (
+            ("post", reverse("check_balance")),
+            ("get", reverse("check_balance_in_rubles")),
+            ("get", reverse("get_operations_history") + "?limit=2&operation_type=TRANSFER"),
+            ("get", reverse("export_operations") + "?export_format=ndjson"),
+            ("get", reverse("statement")),
+            ("get", reverse("users-current")),
+        ):
+            with self.subTest(path):
+                response = self.assertSameResponse(method, path)
+                self.assertEqual(response.status_code, 200)
+
+    def test_errors_match_the_sync_views(self):
+        path = reverse("get_operations_history")
+        self.assertEqual(self.assertSameResponse("get", path, APIClient()).status_code, 401)
+        self.assertEqual(self.assertSameResponse("get", path + "?limit=0").status_code, 400)
+        self.assertEqual(self.assertSameResponse("delete", path).status_code, 405)
+
+    def test_options_is_not_allowed(self):
+        with self.async_urls:
+            response = self.client.options(reverse("check_balance_in_rubles"))
+
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response["Allow"], "GET")
+
+
+@skipUnless("replica" in settings.DATABASES, "Needs the replica database alias.")
+@balance_beam_settings(READ_REPLICAS=["replica"], REPLICA_MAX_LAG=2)
+class ReplicaRouterTests(TransactionTestCase):
+    """В тестах реплика - зеркало основной базы (TEST MIRROR)."""
+
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        caches[get_setting("CACHE_ALIAS")].clear()
+        self.user = create_customer("alice@example.com", 10000)
+
+    def test_service_reads_go_to_the_replica(self):
+        with routers.read_from_replica(self.user.pk) as alias:
+            self.assertEqual(alias, "replica")
+            self.assertEqual(router.db_for_read(CustomCustomer), "replica")
+        self.assertIsNone(routers._read_alias.get())
+
+        BalanceOperation.objects.create(user=self.user, amount=100, operation_type="INCREASE")
+        page, _ = BalanceService.get_operations_page(self.user, limit=10)
+        self.assertEqual([operation._state.db for operation in page], ["replica"])
+        self.assertEqual(CustomCustomer.objects.get(pk=self.user.pk)._state.db, "default")
+
+    def test_reads_in_a_transaction_stay_on_the_primary(self):
+        with transaction.atomic(), routers.read_from_replica(self.user.pk) as alias:
+            self.assertIsNone(alias)
+
+    def test_writer_reads_its_writes_from_the_primary(self):
+        other = create_customer("bob@example.com")
+
+        BalanceService.increase_balance(self.user, 100)
+
+        with routers.read_from_replica(self.user.pk) as alias:
+            self.assertIsNone(alias)
+        with routers.read_from_replica(other.pk) as alias:
+            self.assertEqual(alias, "replica")
+
+    def test_pin_is_set_after_the_commit(self):
+        pinned = caches[get_setting("CACHE_ALIAS")]
+        with transaction.atomic():
+            routers.pin_to_primary_on_commit(self.user.pk)
+            self.assertIsNone(pinned.get(routers._pin_cache_key(self.user.pk)))
+        self.assertTrue(pinned.get(routers._pin_cache_key(self.user.pk)))
+        self.assertIsNone(routers.choose_read_alias(self.user.pk))
+
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(routers.lag_monitor, "lag", return_value=2.5):
+            self.assertIsNone(routers.choose_read_alias(self.user.pk))
+        with mock.patch.object(routers.lag_monitor, "lag", return_value=1.5):
+            self.assertEqual(routers.choose_read_alias(self.user.pk), "replica")
+
+    def test_lag_monitor(self):
+        monitor = routers.ReplicaLagMonitor()
+        # Зеркало не в режиме восстановления, его отставание - 0.
+        self.assertEqual(monitor.lag("replica"), 0.0)
+
+        monitor = routers.ReplicaLagMonitor()
+        with mock.patch.object(
+            connections["replica"], "cursor", side_effect=DatabaseError("unreachable")
+        ), self.assertLogs("balance_beam.routers", "WARNING"):
+            self.assertEqual(monitor.lag("replica"), float("inf"))
+            # Результат проверки кешируется на REPLICA_LAG_CHECK_INTERVAL.
+            self.assertEqual(monitor.lag("replica"), float("inf"))
+        self.assertEqual(routers.ReplicaLagMonitor().lag("replica"), 0.0)
+
+
+class HotAccountTests:
+    """Баланс горячего счёта - основной баланс и слоты - не зависит от того,
+    куда попали зачисления и когда слоты сведены."""
+
+    def setUp(self):
+        self.merchant = create_customer("merchant@example.com", 1000)
+        self.payers = [create_customer(f"payer{i}@example.com", 10000) for i in range(3)]
+        hot_accounts.set_slot_count(self.merchant.pk, 4)
+
+    def total_balance(self) -> int:
+        return BalanceService.check_user_balance_in_kopecks(
+            CustomCustomer.objects.get(pk=self.merchant.pk)
+        )
+
+    def slot_balances(self) -> list[int]:
+        return list(
+            BalanceSlot.objects.filter(customer_id=self.merchant.pk)
+            .order_by("slot")
+            .values_list("balance", flat=True)
+        )
+
+    def credit(self) -> None:
+        for payer, amount in zip(self.payers, (100, 200, 300)):
+            BalanceService.transfer_balance(payer, self.merchant.pk, amount)
+        BalanceService.increase_balance(self.merchant, 400)
+
+    def test_credits_go_to_the_slots(self):
+        self.credit()
+
+        self.assertEqual(balances(self.merchant), [1000])
+        self.assertEqual(sum(self.slot_balances()), 1000)
+        self.assertEqual(self.total_balance(), 2000)
+        self.assertEqual(
+            BalanceOperation.objects.filter(user=self.merchant, success=True).count(), 4
+        )
+
+    def test_sweep_preserves_the_total(self):
+        self.credit()
+
+        self.assertEqual(hot_accounts.sweep_slots(self.merchant.pk, 300), 300)
+        self.assertEqual(balances(self.merchant), [1300])
+        self.assertEqual(self.total_balance(), 2000)
+
+        self.assertEqual(hot_accounts.sweep_slots(self.merchant.pk), 700)
+        self.assertEqual(self.slot_balances(), [0, 0, 0, 0])
+        self.assertEqual(balances(self.merchant), [2000])
+        self.assertEqual(self.total_balance(), 2000)
+
+    def test_debit_above_the_main_balance_sweeps_the_slots(self):
+        self.credit()
+
+        BalanceService.transfer_balance(self.merchant, self.payers[0].pk, 1500)
+
+        self.assertEqual(self.total_balance(), 500)
+        self.assertEqual(balances(self.merchant)[0] + sum(self.slot_balances()), 500)
+
+    def test_removing_the_slots_keeps_their_money(self):
+        self.credit()
+
+        call_command("consolidate_balance_slots", account=self.merchant.pk, slots=0, stdout=StringIO())
+
+        self.assertFalse(BalanceSlot.objects.filter(customer_id=self.merchant.pk).exists())
+        self.assertEqual(balances(self.merchant), [2000])
+        self.assertEqual(self.total_balance(), 2000)
+
+
+@balance_beam_settings(EXECUTION_STRATEGY="pessimistic")
+class PessimisticHotAccountTests(HotAccountTests, TestCase):
+    pass
+
+
+@balance_beam_settings(EXECUTION_STRATEGY="conditional")
+class ConditionalHotAccountTests(HotAccountTests, TestCase):
+    pass
+
+
+@skipUnless(connection.vendor == "postgresql", "Reconciliation requires PostgreSQL.")
+@balance_beam_settings(RECONCILE_WATERMARK_LAG=0)
+class ReconcileBalancesTests(TransactionTestCase):
+    """Рабочие процессы сверки читают базу сами, поэтому данные должны быть
+    зафиксированы."""
+
+    def setUp(self):
+        self.consistent = create_customer("consistent@example.com")
+        self.drifted = create_customer("drifted@example.com")
+        self.other = create_customer("other@example.com")
+        BalanceService.increase_balance(self.consistent, 1000)
+        BalanceService.increase_balance(self.drifted, 500)
+        BalanceService.transfer_balance(self.consistent, self.other.pk, 300)
+        BalanceService.transfer_balance(self.other, self.drifted.pk, 100)
+        CustomCustomer.objects.filter(pk=self.drifted.pk).update(balance=700)
+
+    def reconcile(self, *args) -> tuple[str, str]:
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            "reconcile_balances", "--workers=2", "--range-size=1", *args,
+            stdout=stdout, stderr=stderr,
+        )
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_reports_only_the_drifted_account(self):
+        with tempfile.TemporaryDirectory() as directory:
+            report = f"{directory}/mismatches.csv"
+            with self.assertRaisesMessage(CommandError, "1 balances don't match"):
+                self.reconcile(f"--report={report}")
+            with open(report, newline="", encoding="utf-8") as file:
+                rows = list(csv.reader(file))
+
+        self.assertEqual(
+            rows,
+            [
+                ["customer_id", "email", "balance", "expected", "difference"],
+                [str(self.drifted.pk), "drifted@example.com", "700", "600", "100"],
+            ],
+        )
+
+    def test_id_ranges_cover_every_customer(self):
+        ranges = reconciliation.id_ranges(2)
+
+        self.assertEqual(ranges[0][0], self.consistent.pk)
+        self.assertEqual(ranges[-1][1], self.other.pk)
+        covered = [pk for first, last in ranges for pk in range(first, last + 1)]
+        self.assertEqual(covered, [self.consistent.pk, self.drifted.pk, self.other.pk])
+
+    def test_second_run_resumes_from_the_checkpoints(self):
+        with self.assertRaises(CommandError):
+            self.reconcile()
+        checkpoints = {
+            checkpoint.customer_id: checkpoint
+            for checkpoint in LedgerCheckpoint.objects.all()
+        }
+        self.assertEqual(
+            {pk: checkpoint.operations_total for pk, checkpoint in checkpoints.items()},
+            {self.consistent.pk: 700, self.drifted.pk: 600, self.other.pk: 200},
+        )
+
+        CustomCustomer.objects.filter(pk=self.drifted.pk).update(balance=600)
+        BalanceService.increase_balance(self.consistent, 50)
+        # Операции до контрольной точки повторно не читаются: испорченная
+        # сумма в контрольной точке видна только инкрементальному запуску.
+        LedgerCheckpoint.objects.filter(customer=self.other).update(operations_total=250)
+
+        with self.assertRaisesMessage(CommandError, "1 balances don't match"):
+            self.reconcile("--no-checkpoint")
+        stdout, errors = self.reconcile("--full", "--no-checkpoint")
+        self.assertEqual(errors, "")
+        self.assertIn("Checked 3 accounts in 3 ranges, 0 mismatches", stdout)
+
+        LedgerCheckpoint.objects.filter(customer=self.other).update(operations_total=200)
+        stdout, errors = self.reconcile()
+        self.assertEqual(errors, "")
+        consistent = LedgerCheckpoint.objects.get(customer=self.consistent)
+        self.assertEqual(consistent.operations_total, 750)
+        self.assertGreater(consistent.through, checkpoints[self.consistent.pk].through)
+        # Без новых операций контрольная точка не перезаписывается.
+        self.assertEqual(
+            LedgerCheckpoint.objects.get(customer=self.other).through,
+            checkpoints[self.other.pk].through,
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "Trigram indexes require PostgreSQL.")
+@balance_beam_settings(ADMIN_PERFORMANCE_MODE=True)
+class AdminSearchTests(TestCase):
+    def setUp(self):
+        self.admin = CustomCustomer.objects.create_superuser("admin@example.com", "password")
+        self.alice = create_customer("alice@example.com", first_name="Alice")
+        self.bob = create_customer("bob@example.com", first_name="Bob")
+        self.client.force_login(self.admin)
+
+    def test_trigram_indexes_exist_only_with_pg_trgm(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            installed = cursor.fetchone() is not None
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE tablename = %s AND indexname LIKE %s",
+                [CustomCustomer._meta.db_table, "%\\_trgm\\_idx"],
+            )
+            indexes = {name for name, in cursor.fetchall()}
+
+        expected = {
+            f"customer_{field}_trgm_idx"
+            for field in ("email", "first_name", "last_name", "phone")
+        }
+        self.assertEqual(indexes, expected if installed else set())
+
+    def test_search_finds_customers_by_substring(self):
+        response = self.client.get(
+            reverse("admin:balance_beam_customcustomer_changelist"), {"q": "LIC"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [customer.pk for customer in response.context["cl"].result_list],
+            [self.alice.pk],
+        )
+
+
+@balance_beam_settings(EXPORT_CHUNK_SIZE=2, EXPORT_BUFFER_SIZE=64)
+class ExportOperationsTests(TestCase):
+    def setUp(self):
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com")
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 1000)
+        BalanceService.transfer_many([(self.bob, 50000)], sender=self.alice, atomic=False)
+        BalanceService.increase_balance(self.alice, 500)
+        BalanceService.transfer_balance(self.bob, self.alice.pk, 200)
+        self.operations = list(
+            BalanceOperation.objects.filter(user=self.alice).order_by("timestamp", "id")
+        )
+
+    def download(self, **params) -> tuple[StreamingHttpResponse, list[bytes], bytes]:
+        response = token_client(self.alice).get(reverse("export_operations"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        return response, chunks, b"".join(chunks)
+
+    def test_csv(self):
+        response, chunks, content = self.download()
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(
+            response["Content-Disposition"],
+            f'attachment; filename="operations-{self.alice.pk}.csv"',
+        )
+        self.assertGreater(len(chunks), 1)
+        header, *rows = csv.reader(StringIO(content.decode()))
+        self.assertEqual(header, exports.FIELDS)
+        self.assertEqual([int(row[0]) for row in rows], [op.pk for op in self.operations])
+        self.assertEqual(
+            [(row[2], row[3], row[4], row[5]) for row in rows],
+            [
+                ("TRANSFER", "-1000", "True", ""),
+                ("DECREASE", "-50000", "False", self.operations[1].text_error),
+                ("INCREASE", "500", "True", ""),
+                ("INCREASE", "200", "True", ""),
+            ],
+        )
+
+    def test_ndjson(self):
+        response, chunks, content = self.download(export_format="ndjson")
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertTrue(content.endswith(b"\n"))
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([list(row) for row in rows], [exports.FIELDS] * 4)
+        first = self.operations[0]
+        self.assertEqual(
+            rows[0],
+            {
+                "id": first.pk,
+                "timestamp": first.timestamp.isoformat(),
+                "operation_type": "TRANSFER",
+                "amount": -1000,
+                "success": True,
+                "text_error": None,
+                "counterparty": self.bob.pk,
+                "related_customer": first.related_customer,
+                "transfer_group": str(first.transfer_group),
+            },
+        )
+        self.assertEqual(rows[1]["transfer_group"], None)
+
+    def test_gzip(self):
+        for export_format in exports.FORMATS:
+            with self.subTest(export_format=export_format):
+                _, _, plain = self.download(export_format=export_format)
+                response, _, compressed = self.download(
+                    export_format=export_format, gzip="true"
+                )
+
+                self.assertEqual(response["Content-Type"], "application/gzip")
+                self.assertIn(f".{export_format}.gz", response["Content-Disposition"])
+                self.assertEqual(gzip.decompress(compressed), plain)
+
+    def test_filters_are_passed_through(self):
+        _, _, content = self.download(
+            export_format="ndjson",
+            operation_type="INCREASE",
+            success="true",
+            counterparty=self.bob.pk,
+        )
+
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.operations[3].pk])
+
+        response = exports.export_response(
+            self.alice.pk,
+            {"export_format": "csv", "gzip": False, "amount_max": 0},
+        )
+        rows = list(csv.reader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual([row[3] for row in rows[1:]], ["-1000", "-50000"])
+
+    def test_invalid_format(self):
+        response = token_client(self.alice).get(
+            reverse("export_operations"), {"export_format": "xml"}
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(connection.vendor == "postgresql", "Rollups require PostgreSQL.")
+class StatementTests(TestCase):
+    """История идёт через границы дня и месяца; операции 2031 года попадают
+    в секции, созданные тестом."""
+
+    def setUp(self):
+        for month in (3, 4):
+            partitioning.create_month_partition(connection, date(2031, month, 1))
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com", 1000)
+
+    def make_history(self) -> None:
+        alice, bob = self.alice, self.bob
+        history = [
+            (utc(2031, 3, 30, 23, 59), BalanceService.transfer_balance, alice, bob.pk, 700),
+            (utc(2031, 3, 31, 0, 0), BalanceService.transfer_balance, bob, alice.pk, 300),
+            (utc(2031, 3, 31, 12, 0), BalanceService.increase_balance, alice, 250),
+            # Неуспешное списание записывается операцией с text_error.
+            (utc(2031, 3, 31, 12, 1), self.transfer_without_funds, alice, bob),
+            # Ровно на date_to: в выписку до 1 апреля не входит.
+            (utc(2031, 4, 1, 0, 0), BalanceService.transfer_balance, alice, bob.pk, 100),
+            (utc(2031, 4, 2, 8, 0), BalanceService.increase_balance, bob, 50),
+        ]
+        for moment, operation, *args in history:
+            with mock.patch.object(timezone, "now", return_value=moment):
+                operation(*args)
+
+    @staticmethod
+    def transfer_without_funds(sender: CustomCustomer, recipient: CustomCustomer) -> None:
+        BalanceService.transfer_many([(recipient, 10**6)], sender=sender, atomic=False)
+
+    def direct_statement(
+        self, user: CustomCustomer, period: str, date_from: date, date_to: date
+    ) -> list[dict]:
+        """Aggregate the operations themselves, the way the statement is defined."""
+        succeeded = Q(success=True, text_error__isnull=True)
+        rows = (
+            BalanceOperation.objects.filter(
+                user=user,
+                timestamp__gte=utc(date_from.year, date_from.month, date_from.day),
+                timestamp__lt=utc(date_to.year, date_to.month, date_to.day),
+            )
+            .annotate(
+                start=Trunc(
+                    "timestamp", period, output_field=DateField(), tzinfo=dt_timezone.utc
+                )
+            )
+            .values("start")
+            .annotate(
+                money_in=Sum("amount", filter=succeeded & Q(amount__gt=0), default=0),
+                money_out=Sum("amount", filter=succeeded & Q(amount__lt=0), default=0),
+                operations=Sum(1, filter=succeeded, default=0),
+                failed=Sum(1, filter=~succeeded, default=0),
+            )
+            .order_by("start")
+        )
+        return [{**row, "money_out": -row["money_out"]} for row in rows]
+
+    def assert_statements_match(self) -> None:
+        for user in (self.alice, self.bob):
+            for period, date_from, date_to in [
+                ("day", date(2031, 3, 30), date(2031, 4, 1)),
+                ("day", date(2031, 3, 1), date(2031, 5, 1)),
+                ("month", date(2031, 3, 1), date(2031, 4, 1)),
+                ("month", date(2031, 3, 31), date(2031, 4, 2)),
+            ]:
+                with self.subTest(user=user.email, period=period, dates=(date_from, date_to)):
+                    self.assertEqual(
+                        rollups.statement(user.pk, period, date_from, date_to),
+                        self.direct_statement(user, period, date_from, date_to),
+                    )
+
+    def test_statement_matches_the_operations(self):
+        self.make_history()
+
+        self.assertEqual(
+            rollups.statement(self.alice.pk, "day", date(2031, 3, 30), date(2031, 4, 1)),
+            [
+                {
+                    "start": date(2031, 3, 30),
+                    "money_in": 0,
+                    "money_out": 700,
+                    "operations": 1,
+                    "failed": 0,
+                },
+                {
+                    "start": date(2031, 3, 31),
+                    "money_in": 550,
+                    "money_out": 0,
+                    "operations": 2,
+                    "failed": 1,
+                },
+            ],
+        )
+        self.assert_statements_match()
+
+    @balance_beam_settings(ROLLUPS_DEFERRED=True)
+    def test_pending_deltas_are_counted(self):
+        self.make_history()
+        self.assertFalse(OperationRollup.objects.exists())
+
+        self.assert_statements_match()
+        while rollups.apply_deltas(2):
+            pass
+        self.assertFalse(OperationRollupDelta.objects.exists())
+        self.assert_statements_match()
+
+    def test_rebuild_keeps_the_totals(self):
+        self.make_history()
+        expected = rollups.statement(self.alice.pk, "day", date(2031, 3, 1), date(2031, 5, 1))
+
+        rollups.rebuild_range(self.alice.pk, self.bob.pk)
+
+        self.assertEqual(
+            rollups.statement(self.alice.pk, "day", date(2031, 3, 1), date(2031, 5, 1)), expected
+        )
+        self.assert_statements_match()
+
+
+def parse_metrics(text: str) -> dict[str, float]:
+    """Map the samples of a Prometheus text exposition to their values."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            samples[sample] = float(value)
+    return samples
+
+
+@balance_beam_settings(METRICS_ENABLED=True, METRICS_TOKEN="scrape-token")
+class MetricsTests(TestCase):
+    def setUp(self):
+        # Измерения этого теста не смешиваются с накопленными другими тестами.
+        patcher = mock.patch.object(metrics, "registry", metrics.MetricsRegistry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com")
+
+    def scrape(self, token: str | None = "scrape-token"):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        return self.client.get(reverse("metrics"), **headers)
+
+    @balance_beam_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.scrape().status_code, 404)
+
+    def test_token_is_required(self):
+        for token in (None, "wrong-token"):
+            with self.subTest(token=token):
+                response = self.scrape(token)
+
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response["WWW-Authenticate"], "Bearer")
+
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+
+    def test_requests_and_service_calls_are_measured(self):
+        response = token_client(self.alice).post(
+            reverse("transfer_balance"), {"amount": 100, "recipient_id": self.bob.pk}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+
+        text = self.scrape().content.decode()
+        for name, (kind, _, _) in metrics.METRICS.items():
+            self.assertIn(f"# TYPE {name} {kind}\n", text)
+        samples = parse_metrics(text)
+        request = 'method="POST",status="200",view="transfer_balance"'
+        self.assertEqual(
+            samples[f"balance_beam_http_request_duration_seconds_count{{{request}}}"], 1
+        )
+        self.assertEqual(
+            samples[f'balance_beam_http_request_duration_seconds_bucket{{{request},le="+Inf"}}'], 1
+        )
+        self.assertGreater(
+            samples['balance_beam_http_db_queries_total{view="transfer_balance"}'], 0
+        )
+        self.assertEqual(
+            samples['balance_beam_service_duration_seconds_count{method="transfer_balance"}'], 1
+        )
+
+    def test_failures_are_counted_by_reason(self):
+        with self.assertRaises(ValueError):
+            BalanceService.transfer_balance(self.bob, self.alice.pk, 100)
+
+        samples = parse_metrics(self.scrape().content.decode())
+        self.assertEqual(
+            samples[
+                'balance_beam_service_failures_total'
+                '{method="transfer_balance",reason="insufficient_funds"}'
+            ],
+            1,
+        )
+
+    def test_row_lock_waits_are_measured_for_both_strategies(self):
+        for strategy in ("pessimistic", "conditional"):
+            with self.subTest(strategy=strategy), balance_beam_settings(
+                EXECUTION_STRATEGY=strategy
+            ):
+                BalanceService.transfer_balance(self.alice, self.bob.pk, 100)
+
+        samples = parse_metrics(self.scrape().content.decode())
+        self.assertEqual(
+            samples['balance_beam_row_lock_wait_seconds_count{method="transfer_balance"}'], 2
+        )
+
+    def test_database_timer_counts_locking_statements(self):
+        timer = metrics.DatabaseTimer()
+        table = CustomCustomer._meta.db_table
+        with connection.execute_wrapper(timer), connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {table} WHERE id = %s FOR UPDATE", [self.alice.pk])
+            cursor.execute(f"UPDATE {table} SET balance = balance WHERE id = %s", [self.alice.pk])
+            cursor.execute(f"SELECT id FROM {table} WHERE id = %s", [self.alice.pk])
+
+        self.assertEqual(timer.queries, 3)
+        self.assertEqual(timer.locking_statements, 2)
+        self.assertLessEqual(timer.lock_wait, timer.duration)
+
+
+class ImportCustomersTests(TransactionTestCase):
+    """Команда закрывает соединения перед запуском пула процессов, поэтому
+    тесты идут вне транзакции."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.report = f"{self.directory}/rejected.csv"
+
+    def write(self, name: str, text: str) -> str:
+        path = f"{self.directory}/{name}"
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt", encoding="utf-8") as file:
+            file.write(text)
+        return path
+
+    def run_import(self, source: str, *args) -> str:
+        stdout = StringIO()
+        call_command(
+            "import_customers", source, "--workers=2", f"--report={self.report}", *args,
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def rejected(self) -> list[list[str]]:
+        with open(self.report, newline="", encoding="utf-8") as file:
+            return list(csv.reader(file))
+
+    def test_detect_format(self):
+        for path, source_format in [
+            ("customers.csv", "csv"),
+            ("customers.csv.gz", "csv"),
+            ("customers.ndjson", "ndjson"),
+            ("customers.jsonl.gz", "ndjson"),
+            ("customers.txt", "csv"),
+        ]:
+            with self.subTest(path=path):
+                self.assertEqual(imports.detect_format(path), source_format)
+
+    def test_csv(self):
+        create_customer("taken@example.com", phone="79009999999")
+        source = self.write(
+            "customers.csv",
+            "email,password,first_name,last_name,phone,birth_date\n"
+            "alice@example.com,secret1,Alice,Smith,79001234567,1990-05-01\n"
+            "not-an-email,secret2,Bob,,,\n"
+            "alice@EXAMPLE.com,secret3,Alice,,,\n"
+            "carol@example.com,secret4,Carol,,79009999999,\n"
+            "dave@example.com,secret5,Dave,,79001234567,\n"
+            "erin@example.com,secret6,Erin,,,1990-13-45\n"
+            "frank@example.com,,Frank,Miller,,\n",
+        )
+
+        output = self.run_import(source, "--chunk-size=2")
+
+        self.assertIn("Imported 2 customers, rejected 5 records; 7 records", output)
+        alice = CustomCustomer.objects.get(email="alice@example.com")
+        self.assertTrue(alice.check_password("secret1"))
+        self.assertEqual(
+            (alice.first_name, alice.last_name, alice.phone, alice.birth_date),
+            ("Alice", "Smith", "79001234567", date(1990, 5, 1)),
+        )
+        frank = CustomCustomer.objects.get(email="frank@example.com")
+        self.assertFalse(frank.has_usable_password())
+        self.assertEqual(
+            [row[:2] + [row[2].split(":")[0]] for row in self.rejected()],
+            [
+                ["record", "email", "reason"],
+                ["2", "not-an-email", "email"],
+                ["3", "alice@example.com", "duplicate email"],
+                ["4", "carol@example.com", "duplicate phone"],
+                ["5", "dave@example.com", "duplicate phone"],
+                ["6", "erin@example.com", "birth_date"],
+            ],
+        )
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual(
+            (checkpoint.records, checkpoint.imported, checkpoint.rejected), (7, 2, 5)
+        )
+
+    def test_gzipped_ndjson(self):
+        source = self.write(
+            "customers.ndjson.gz",
+            '{"email": "gina@example.com", "password": "pw", "phone": "79005550000"}\n'
+            "not json\n"
+            "\n"
+            '{"email": "gina@example.com"}\n'
+            "[1, 2]\n"
+            '{"email": "hank@example.com", "phone": 79005550000, "extra": 1}\n'
+            '{"email": "ivan@example.com", "first_name": "Ivan", "birth_date": "1985-02-03"}\n',
+        )
+
+        self.run_import(source)
+
+        self.assertEqual(
+            sorted(CustomCustomer.objects.values_list("email", flat=True)),
+            ["gina@example.com", "ivan@example.com"],
+        )
+        self.assertEqual(
+            [row[2].split(":")[0] for row in self.rejected()[1:]],
+            ["invalid JSON", "duplicate email", "invalid JSON", "duplicate phone"],
+        )
+
+    def test_interrupted_import_resumes_from_the_checkpoint(self):
+        source = self.write(
+            "customers.csv",
+            "email,password\n"
+            + "".join(f"customer{number}@example.com,secret\n" for number in range(5)),
+        )
+        save_chunk = imports.save_chunk
+        calls = []
+
+        def interrupted(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("interrupted")
+            return save_chunk(*args, **kwargs)
+
+        with mock.patch.object(imports, "save_chunk", interrupted):
+            with self.assertRaisesMessage(RuntimeError, "interrupted"):
+                self.run_import(source, "--chunk-size=2")
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.records, checkpoint.imported), (2, 2))
+
+        output = self.run_import(source, "--chunk-size=2")
+
+        self.assertIn("Resuming", output)
+        self.assertIn("Imported 3 customers, rejected 0 records; 5 records", output)
+        self.assertEqual(CustomCustomer.objects.count(), 5)
+        self.assertEqual(self.rejected(), [["record", "email", "reason"]])
+
+    def test_save_chunk_gives_up_after_the_retries(self):
+        ImportCheckpoint.objects.create(job="job")
+        records = [imports.Record(1, email="alice@example.com", password_hash="!")]
+
+        with mock.patch.object(imports, "_insert", side_effect=IntegrityError) as insert:
+            with self.assertRaises(IntegrityError):
+                imports.save_chunk("job", records, 1)
+        self.assertEqual(insert.call_count, imports.CONFLICT_RETRIES)
+
+        with mock.patch.object(imports, "_insert", side_effect=[IntegrityError, (1, [])]):
+            self.assertEqual(imports.save_chunk("job", records, 1), (1, []))
+        self.assertEqual(ImportCheckpoint.objects.get().records, 1)
+
+
+class HistoryRowsTests(TestCase):
+    """Строки истории из values_list() должны выглядеть в ответе так же,
+    как экземпляры модели после HistoryOperationSerializer."""
+
+    def setUp(self):
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com")
+        # Время без микросекунд isoformat() пишет короче.
+        with mock.patch.object(
+            timezone, "now", return_value=timezone.now().replace(microsecond=0)
+        ):
+            BalanceService.increase_balance(self.alice, 250)
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 1000)
+        # Неуспешное списание с text_error.
+        BalanceService.transfer_many([(self.bob, 10**6)], sender=self.alice, atomic=False)
+
+    def render_both(self, renderer: JSONRenderer) -> tuple[bytes, bytes]:
+        instances, _ = BalanceService.get_operations_page(self.alice, 10)
+        rows, _ = BalanceService.get_operations_page(
+            self.alice, 10, columns=history_rows.columns
+        )
+        return (
+            renderer.render(HistoryOperationSerializer(instances, many=True).data),
+            renderer.render(history_rows.to_representation(rows)),
+        )
+
+    def test_rows_render_like_the_serializer(self):
+        for time_zone in ("UTC", "Europe/Moscow"):
+            for backend in ("json", "orjson"):
+                with self.subTest(time_zone=time_zone, backend=backend), override_settings(
+                    TIME_ZONE=time_zone
+                ), balance_beam_settings(JSON_BACKEND=backend):
+                    expected, rendered = self.render_both(FastJSONRenderer())
+
+                    self.assertEqual(rendered, expected)
+                    self.assertEqual(rendered, JSONRenderer().render(json.loads(expected)))
+
+        data = json.loads(rendered)
+        self.assertEqual([item["success"] for item in data], [False, True, True])
+        self.assertTrue(data[0]["text_error"].startswith("Insufficient balance"))
+        self.assertEqual(data[1]["text_error"], None)
+        self.assertTrue(data[0]["timestamp"].endswith("+03:00"))
+
+    def test_history_endpoint_renders_the_serializer_output(self):
+        expected, _ = self.render_both(JSONRenderer())
+
+        response = token_client(self.alice).get(reverse("get_operations_history") + "?limit=10")
+
+        self.assertEqual(response.content, expected)
+        self.assertIn(b'"text_error":null', response.content)
+        self.assertRegex(
+            json.loads(response.content)[-1]["timestamp"], r"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ$"
+        )
+
+
+class RecipientTests(TestCase):
+    def setUp(self):
+        # Кеш общий для всех тестов процесса, а id удалённых при откате
+        # пользователей в нём остаются.
+        caches[get_setting("CACHE_ALIAS")].clear()
+        self.sender = create_customer("alice@example.com", 10000)
+        self.recipient = create_customer("bob@example.com", phone="79001234567")
+        self.client = token_client(self.sender)
+
+    def transfer(self, **recipient):
+        return self.client.post(
+            reverse("transfer_balance"), {"amount": 100, **recipient}, format="json"
+        )
+
+    def test_every_way_of_addressing_the_recipient(self):
+        for recipient in (
+            {"recipient_id": self.recipient.pk},
+            {"recipient_email": " bob@EXAMPLE.com"},
+            {"recipient_phone": "79001234567"},
+        ):
+            with self.subTest(**recipient):
+                self.assertEqual(self.transfer(**recipient).status_code, 200)
+        self.assertEqual(balances(self.sender, self.recipient), [9700, 300])
+        self.assertEqual(
+            set(
+                BalanceOperation.objects.filter(user=self.recipient).values_list(
+                    "counterparty_id", flat=True
+                )
+            ),
+            {self.sender.pk},
+        )
+
+    def test_exactly_one_recipient_field(self):
+        for recipient in (
+            {},
+            {"recipient_id": self.recipient.pk, "recipient_email": "bob@example.com"},
+        ):
+            with self.subTest(**recipient):
+                response = self.transfer(**recipient)
+
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("Specify exactly one of", str(response.json()))
+        self.assertFalse(BalanceOperation.objects.exists())
+
+    def test_unknown_recipient(self):
+        response = self.transfer(recipient_email="nobody@example.com")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(),
+            {"recipient_email": ["Customer with email nobody@example.com does not exist."]},
+        )
+        self.assertIsNone(cached_recipient("recipient_email", "nobody@example.com"))
+
+    def test_found_ids_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                resolve_recipient("recipient_email", "bob@EXAMPLE.com"), self.recipient.pk
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                resolve_recipient("recipient_email", "bob@example.com"), self.recipient.pk
+            )
+            self.assertEqual(
+                cached_recipient("recipient_email", "bob@example.com"), self.recipient.pk
+            )
+        self.assertIsNone(cached_recipient("recipient_phone", "79001234567"))
+
+    @balance_beam_settings(RECIPIENT_CACHE_TIMEOUT=0)
+    def test_cache_can_be_disabled(self):
+        resolve_recipient("recipient_email", "bob@example.com")
+
+        with self.assertNumQueries(1):
+            resolve_recipient("recipient_email", "bob@example.com")
+        self.assertIsNone(cached_recipient("recipient_email", "bob@example.com"))
+
+    def test_phone_change_drops_the_cached_owner(self):
+        self.assertEqual(self.transfer(recipient_phone="79001234567").status_code, 200)
+        self.assertEqual(cached_recipient("recipient_phone", "79001234567"), self.recipient.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = token_client(self.recipient).patch(
+                reverse("users-detail", args=[self.recipient.pk]),
+                {"phone": "79007654321"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertIsNone(cached_recipient("recipient_phone", "79001234567"))
+        self.assertEqual(self.transfer(recipient_phone="79001234567").status_code, 400)
+        self.assertEqual(self.transfer(recipient_phone="79007654321").status_code, 200)
+
+    def test_stale_cached_recipient(self):
+        resolve_recipient("recipient_email", "bob@example.com")
+        CustomCustomer.objects.filter(pk=self.recipient.pk).delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.transfer(recipient_email="bob@example.com")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(),
+            {"recipient_email": ["Customer with email bob@example.com does not exist."]},
+        )
+        self.assertEqual(balances(self.sender), [10000])
+        self.assertIsNone(cached_recipient("recipient_email", "bob@example.com"))
+
+
+@balance_beam_settings(ASYNC_TRANSFERS=True)
+class AsyncTransferTests(TestCase):
+    def setUp(self):
+        caches[get_setting("CACHE_ALIAS")].clear()
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com")
+        self.client = token_client(self.alice)
+
+    def enqueue(self, amount: int, **headers):
+        return self.client.post(
+            reverse("transfer_balance_async"),
+            {"amount": amount, "recipient_email": "bob@example.com"},
+            format="json",
+            headers=headers,
+        )
+
+    def work(self):
+        """Run one worker pass in the test transaction."""
+        return transfer_queue.process_batch(*transfer_queue.claim_batch(10))
+
+    def test_transfer_goes_through_the_queue(self):
+        response = self.enqueue(2500)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["status"], TransferRequest.PENDING)
+        self.assertEqual(response.data["recipient_id"], self.bob.pk)
+        location = response["Location"]
+        self.assertEqual(
+            location,
+            "http://testserver" + reverse("transfer_request", args=[response.data["id"]]),
+        )
+        self.assertEqual(balances(self.alice, self.bob), [10000, 0])
+
+        self.assertEqual(self.work(), {"succeeded": 1})
+
+        polled = self.client.get(location)
+        self.assertEqual(polled.status_code, 200)
+        self.assertEqual(polled.data["status"], TransferRequest.SUCCEEDED)
+        self.assertEqual(polled.data["attempts"], 1)
+        self.assertEqual(polled.data["balance_after"], 7500)
+        self.assertIsNotNone(polled.data["completed_at"])
+        self.assertEqual(balances(self.alice, self.bob), [7500, 2500])
+        self.assertEqual(self.work(), {})
+
+    def test_insufficient_balance_fails_the_request(self):
+        response = self.enqueue(20000)
+        self.assertEqual(response.status_code, 202)
+
+        self.assertEqual(self.work(), {"failed": 1})
+
+        polled = self.client.get(response["Location"])
+        self.assertEqual(polled.data["status"], TransferRequest.FAILED)
+        self.assertTrue(polled.data["error"].startswith("Insufficient balance"))
+        self.assertEqual(balances(self.alice, self.bob), [10000, 0])
+
+    def test_database_errors_are_retried(self):
+        self.enqueue(100)
+
+        with mock.patch.object(
+            BalanceService, "transfer_balance", side_effect=OperationalError("deadlock")
+        ):
+            self.assertEqual(self.work(), {"retried": 1})
+        request = TransferRequest.objects.get()
+        self.assertEqual((request.status, request.attempts), (TransferRequest.PENDING, 1))
+        self.assertGreater(request.available_at, timezone.now())
+        self.assertEqual(self.work(), {})
+
+        TransferRequest.objects.update(available_at=timezone.now())
+        self.assertEqual(self.work(), {"succeeded": 1})
+        self.assertEqual(balances(self.alice, self.bob), [9900, 100])
+
+    def test_replayed_request_is_queued_once(self):
+        first = self.enqueue(100, **{IDEMPOTENCY_HEADER: "async-1"})
+        second = self.enqueue(100, **{IDEMPOTENCY_HEADER: "async-1"})
+
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(second[REPLAYED_HEADER], "true")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(TransferRequest.objects.count(), 1)
+
+    def test_invalid_request_is_not_queued(self):
+        response = self.enqueue(0)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TransferRequest.objects.exists())
+
+    def test_requests_of_other_users_are_hidden(self):
+        response = self.enqueue(100)
+
+        polled = token_client(self.bob).get(response["Location"])
+
+        self.assertEqual(polled.status_code, 404)
+
+    @balance_beam_settings(ASYNC_TRANSFERS=False)
+    def test_disabled(self):
+        response = self.enqueue(100)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(TransferRequest.objects.exists())
+
+
+class RecordingSink(EventSink):
+    """Keep the delivered batches; the first `failures` sends fail."""
+
+    def __init__(self, failures: int = 0, retry_after: float | None = None) -> None:
+        self.batches: list[list[dict]] = []
+        self.failures = failures
+        self.retry_after = retry_after
+
+    def send(self, events: list[dict]) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise SinkError("unavailable", retry_after=self.retry_after)
+        self.batches.append(events)
+
+    def delivered(self) -> list[tuple[int, int]]:
+        return [(event["account"], event["sequence"]) for batch in self.batches for event in batch]
+
+
+def event_sequences() -> dict[int, list[int]]:
+    """Return the sequences of the undelivered events per account, in id order."""
+    sequences: dict[int, list[int]] = {}
+    for account_id, sequence in OutboxEvent.objects.order_by("id").values_list(
+        "account_id", "sequence"
+    ):
+        sequences.setdefault(account_id, []).append(sequence)
+    return sequences
+
+
+@balance_beam_settings(
+    OUTBOX_ENABLED=True,
+    EXECUTION_STRATEGY="pessimistic",
+    OUTBOX_RETRY_DELAY=1,
+    OUTBOX_MAX_RETRY_DELAY=3,
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.alice = create_customer("alice@example.com", 10000)
+        self.bob = create_customer("bob@example.com")
+        self.merchant = create_customer("merchant@example.com")
+        hot_accounts.set_slot_count(self.merchant.pk, 4)
+
+    def test_events_are_numbered_per_account(self):
+        BalanceService.increase_balance(self.alice, 100)
+        BalanceService.transfer_balance(self.alice, self.merchant.pk, 200)
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 300)
+        with self.assertRaises(ValueError):
+            BalanceService.transfer_balance(self.alice, self.bob.pk, 10**6)
+        BalanceService.transfer_many([(self.merchant, 100), (self.bob, 100)], sender=self.alice)
+
+        self.assertEqual(
+            event_sequences(),
+            {self.alice.pk: [1, 2, 3, 4, 5], self.merchant.pk: [1, 2], self.bob.pk: [1, 2]},
+        )
+        self.assertEqual(
+            dict(OutboxSequence.objects.values_list("account_id", "last_sequence")),
+            {self.alice.pk: 5, self.merchant.pk: 2, self.bob.pk: 2},
+        )
+
+    def test_batched_events_are_written_on_exit(self):
+        with transaction.atomic(), outbox.batched():
+            BalanceService.transfer_balance(self.alice, self.bob.pk, 100)
+            with self.assertRaises(ValueError):
+                BalanceService.transfer_balance(self.alice, self.bob.pk, 10**6)
+            BalanceService.transfer_balance(self.alice, self.merchant.pk, 100)
+            self.assertFalse(OutboxEvent.objects.exists())
+
+        # События отменённого перевода отброшены вместе с его точкой сохранения.
+        self.assertEqual(
+            event_sequences(),
+            {self.alice.pk: [1, 2], self.bob.pk: [1], self.merchant.pk: [1]},
+        )
+
+    def test_dispatcher_delivers_in_order_per_account(self):
+        for amount in (100, 200, 300):
+            BalanceService.transfer_balance(self.alice, self.merchant.pk, amount)
+            BalanceService.transfer_balance(self.alice, self.bob.pk, amount)
+        sink = RecordingSink()
+
+        stats = outbox.Dispatcher(sink, batch_size=4, poll_interval=0).run(drain=True)
+
+        self.assertEqual(stats, {"delivered": 12, "batches": 3})
+        for account, count in ((self.alice, 6), (self.bob, 3), (self.merchant, 3)):
+            self.assertEqual(
+                [sequence for account_id, sequence in sink.delivered() if account_id == account.pk],
+                list(range(1, count + 1)),
+            )
+        merchant_events = [
+            event for batch in sink.batches for event in batch if event["account"] == self.merchant.pk
+        ]
+        self.assertEqual([event["data"]["amount"] for event in merchant_events], [100, 200, 300])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_dispatcher_takes_only_its_partition(self):
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 100)
+        partition = self.bob.pk % 2
+        sink = RecordingSink()
+
+        outbox.Dispatcher(sink, partition, partitions=2, poll_interval=0).run(drain=True)
+
+        self.assertTrue(sink.delivered())
+        self.assertTrue(all(account % 2 == partition for account, _ in sink.delivered()))
+        self.assertEqual(
+            set(OutboxEvent.objects.values_list("account_id", flat=True)),
+            {self.alice.pk} if self.alice.pk % 2 != partition else set(),
+        )
+
+    def test_failed_batch_is_kept(self):
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 100)
+        sink = RecordingSink(failures=1)
+
+        with self.assertRaises(SinkError):
+            outbox.Dispatcher(sink).dispatch()
+
+        self.assertEqual(sink.batches, [])
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+
+    def test_sink_failures_are_retried_in_order(self):
+        for amount in range(100, 800, 100):
+            BalanceService.increase_balance(self.alice, amount)
+        sink = RecordingSink(failures=3)
+        dispatcher = outbox.Dispatcher(sink, batch_size=8, poll_interval=0)
+
+        with mock.patch.object(outbox, "_sleep") as sleep:
+            stats = dispatcher.run(drain=True)
+
+        # Удваивающаяся задержка до OUTBOX_MAX_RETRY_DELAY, пачка уменьшается
+        # вдвое после каждой ошибки и растёт после доставок.
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 2, 3])
+        self.assertEqual(stats, {"failures": 3, "delivered": 7, "batches": 4})
+        self.assertEqual([len(batch) for batch in sink.batches], [1, 2, 3, 1])
+        self.assertEqual(sink.delivered(), [(self.alice.pk, sequence) for sequence in range(1, 8)])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_retry_after_of_the_sink_is_respected(self):
+        BalanceService.increase_balance(self.alice, 100)
+        sink = RecordingSink(failures=1, retry_after=7)
+
+        with mock.patch.object(outbox, "_sleep") as sleep:
+            stats = outbox.Dispatcher(sink, poll_interval=0).run(drain=True)
+
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [7])
+        self.assertEqual(stats, {"failures": 1, "delivered": 1, "batches": 1})
+
+    @skipUnless(connection.vendor == "postgresql", "Advisory locks require PostgreSQL.")
+    def test_one_dispatcher_per_partition(self):
+        BalanceService.transfer_balance(self.alice, self.bob.pk, 100)
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            # Другое соединение - другая сессия PostgreSQL.
+            try:
+                with outbox.partition_lock(0) as acquired:
+                    self.assertTrue(acquired)
+                    held.set()
+                    release.wait(5)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(release.set)
+        self.assertTrue(held.wait(5))
+        events_file = tempfile.NamedTemporaryFile(suffix=".ndjson")
+        self.addCleanup(events_file.close)
+        with balance_beam_settings(
+            OUTBOX_ENABLED=True,
+            OUTBOX_SINK="balance_beam.sinks.FileSink",
+            OUTBOX_SINK_OPTIONS={"path": events_file.name},
+        ):
+            with outbox.partition_lock(0) as acquired:
+                self.assertFalse(acquired)
+            with outbox.partition_lock(1) as acquired:
+                self.assertTrue(acquired)
+            output = StringIO()
+            call_command("dispatch_outbox", "--drain", stdout=output)
+            self.assertIn("Partition 0 is dispatched by another process, skipped", output.getvalue())
+            self.assertEqual(OutboxEvent.objects.count(), 2)
+
+            release.set()
+            thread.join(5)
+            output = StringIO()
+            call_command("dispatch_outbox", "--drain", stdout=output)
+
+            self.assertIn("Partition 0: 2 events in 1 batches", output.getvalue())
+            self.assertFalse(OutboxEvent.objects.exists())
+            with open(events_file.name) as delivered:
+                events = [json.loads(line) for line in delivered]
+        self.assertEqual(
+            [(event["account"], event["sequence"]) for event in events],
+            [(self.alice.pk, 1), (self.bob.pk, 1)],
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "Row locks are tested on PostgreSQL.")
+@balance_beam_settings(OUTBOX_ENABLED=True, EXECUTION_STRATEGY="pessimistic")
+class HotAccountOutboxTests(TransactionTestCase):
+    def test_concurrent_credits_are_numbered_in_commit_order(self):
+        merchant = create_customer("merchant@example.com")
+        hot_accounts.set_slot_count(merchant.pk, 4)
+        recorded, commit, credited = threading.Event(), threading.Event(), threading.Event()
+
+        def first():
+            try:
+                with transaction.atomic():
+                    BalanceService.increase_balance(merchant, 100)
+                    recorded.set()
+                    commit.wait(5)
+            finally:
+                connections.close_all()
+
+        def second():
+            try:
+                BalanceService.increase_balance(merchant, 200)
+                credited.set()
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        # Зачисления попадают в разные слоты и не ждут друг друга на них.
+        with mock.patch.object(hot_accounts.random, "randrange", side_effect=[0, 1]):
+            threads[0].start()
+            self.assertTrue(recorded.wait(5))
+            threads[1].start()
+            # Второе зачисление ждёт номер события, пока первое не зафиксировано.
+            self.assertFalse(credited.wait(0.5))
+            commit.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertTrue(credited.is_set())
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by("id").values_list("sequence", "payload__amount")),
+            [(1, 100), (2, 200)],
+        )
+        self.assertEqual(
+            BalanceService.check_user_balance_in_kopecks(CustomCustomer.objects.get(pk=merchant.pk)),
+            300,
+        )
+
+
+@balance_beam_settings(**testing.HOT_PATH_SETTINGS)
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        sender = create_customer("alice@example.com", 10**9)
+        recipients = [
+            create_customer(f"recipient-{index}@example.com").pk for index in range(3)
+        ]
+        BalanceService.transfer_many([(pk, 100) for pk in recipients], sender=sender)
+        self.fixture = testing.make_fixture(sender, recipients)
+
+    def test_every_hot_path_has_a_budget(self):
+        self.assertEqual(set(testing.HOT_PATHS), set(QUERY_BUDGETS))
+
+    def test_hot_paths_stay_within_their_budgets(self):
+        for name, hot_path in testing.HOT_PATHS.items():
+            with self.subTest(name):
+                # Первый вызов заполняет кэши процесса, как в check_query_plans.
+                hot_path(self.fixture)
+                with query_budget(name):
+                    hot_path(self.fixture)
+
+
+@balance_beam_settings(ADMISSION_CONTROL=True, ADMISSION_ACCOUNT_CONCURRENCY=1)
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        caches[get_setting("CACHE_ALIAS")].clear()
+        self.sender = create_customer("alice@example.com", 10000)
+        self.recipient = create_customer("bob@example.com", phone="79001234567")
+        self.client = token_client(self.sender)
+
+    def transfer(self, **recipient):
+        return self.client.post(
+            reverse("transfer_balance"), {"amount": 100, **recipient}, format="json"
+        )
+
+    def test_recipient_limit_applies_to_every_way_of_addressing_it(self):
+        # Получатель уже найден представлением и есть в кеше.
+        resolve_recipient("recipient_email", "bob@example.com")
+        resolve_recipient("recipient_phone", "79001234567")
+        # Запрос, который сейчас держит счёт получателя.
+        admission = admission_controller.try_acquire((self.recipient.pk,))
+        self.addCleanup(admission_controller.release, admission)
+
+        for recipient in (
+            {"recipient_id": self.recipient.pk},
+            {"recipient_email": "bob@EXAMPLE.com"},
+            {"recipient_phone": "79001234567"},
+        ):
+            with self.subTest(**recipient):
+                response = self.transfer(**recipient)
+                self.assertEqual(response.status_code, 429)
+                self.assertIn("Retry-After", response)
+        self.assertEqual(balances(self.sender, self.recipient), [10000, 0])
+
+    def test_admission_reads_the_recipient_from_the_cache_only(self):
+        middleware = AdmissionControlMiddleware(lambda request: None)
+        view = resolve(reverse("transfer_balance")).func
+        token = self.client._credentials["HTTP_AUTHORIZATION"]
+        # Список горячих счетов перечитывается по таймеру, а не на запрос.
+        hot_accounts.hot_accounts.refresh()
+
+        def admitted_accounts(**recipient) -> tuple[int, ...]:
+            request = RequestFactory().post(
+                reverse("transfer_balance"),
+                {"amount": 100, **recipient},
+                content_type="application/json",
+                HTTP_AUTHORIZATION=token,
+            )
+            with self.assertNumQueries(0):
+                self.assertIsNone(middleware.process_view(request, view, (), {}))
+            middleware._release(request)
+            return request._admission.account_ids
+
+        self.assertEqual(admitted_accounts(recipient_email="bob@example.com"), (self.sender.pk,))
+        resolve_recipient("recipient_email", "bob@example.com")
+        self.assertEqual(
+            admitted_accounts(recipient_email="bob@example.com"),
+            (self.sender.pk, self.recipient.pk),
+        )
+        self.assertEqual(
+            admitted_accounts(recipient_id=self.recipient.pk), (self.sender.pk, self.recipient.pk)
+        )
+
+    def test_transfers_to_other_accounts_are_admitted(self):
+        other = create_customer("carol@example.com")
+        admission = admission_controller.try_acquire((self.recipient.pk,))
+        self.addCleanup(admission_controller.release, admission)
+
+        response = self.transfer(recipient_email="carol@example.com")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(balances(self.sender, other), [9900, 100])
+
+    def test_batch_limit_applies_to_the_recipient_of_every_leg(self):
+        other = create_customer("carol@example.com")
+        admission = admission_controller.try_acquire((self.recipient.pk,))
+        self.addCleanup(admission_controller.release, admission)
+        transfers = [
+            {"recipient_id": other.pk, "amount": 100},
+            {"recipient_id": self.recipient.pk, "amount": 100},
+        ]
+
+        response = self.client.post(
+            reverse("transfer_balance_batch"), {"transfers": transfers}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(balances(self.sender, other, self.recipient), [10000, 0, 0])
+        response = self.client.post(
+            reverse("transfer_balance_batch"), {"transfers": transfers[:1]}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,269 @@
+"""Очередь асинхронных переводов в базе, без внешнего брокера.
+
+Эндпоинт transfer_balance/async/ проверяет запрос и сохраняет его строкой
+TransferRequest; ответ 202 содержит её id для опроса. Воркеры команды
+process_transfers:
+
+- берут пачку готовых запросов короткой транзакцией с
+  SELECT ... FOR UPDATE SKIP LOCKED, так что воркеры не ждут друг друга и
+  не получают одни и те же запросы;
+- группируют пачку по отправителю и исполняют переводы группы через
+  BalanceService в одной транзакции: счета группы блокируются один раз и в
+  порядке id, а не на каждый перевод;
+- сохраняют результат в той же транзакции, что и переводы, поэтому перевод
+  не исполняется дважды, даже если аренда пачки истекла и запрос взял
+  другой воркер.
+
+Отказ сервиса (нет средств, перевод себе) завершает запрос статусом
+FAILED. Ошибка базы (взаимоблокировка, таймаут) откатывает группу, её
+запросы повторяются с удваивающейся задержкой, пока не исчерпаны
+TRANSFER_QUEUE_MAX_ATTEMPTS попыток.
+"""
+import time
+import uuid
+from collections import Counter
+from collections.abc import Callable
+from datetime import timedelta
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics, outbox
+from .conf import get_setting
+from .hot_accounts import hot_accounts
+from .models import CustomCustomer, TransferRequest
+from .services import BalanceService
+
+# Исходы обработки запроса для метрик и отчёта воркера.
+OUTCOMES = ("succeeded", "failed", "retried")
+
+
+def enqueue_transfer(
+    sender: CustomCustomer, recipient_id: int, amount_in_kopecks: int
+) -> TransferRequest:
+    """
+    Queue a transfer for the process_transfers workers.
+    Args:
+        sender (CustomCustomer): The customer sending the money.
+        recipient_id (int): The ID of the recipient customer.
+        amount_in_kopecks (int): The amount to be transferred in kopecks.
+    Returns:
+        TransferRequest: The pending transfer request.
+    """
+    return TransferRequest.objects.create(
+        sender=sender, recipient_id=recipient_id, amount=amount_in_kopecks
+    )
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Return the delay before the next attempt of a request that has been tried `attempts` times."""
+    return timedelta(seconds=get_setting("TRANSFER_QUEUE_RETRY_DELAY") * 2 ** max(attempts - 1, 0))
+
+
+def claim_batch(batch_size: int) -> tuple[uuid.UUID, list[TransferRequest]]:
+    """
+    Claim the due transfer requests that no other worker holds.
+
+    The requests become PROCESSING under a new claim token until the lease
+    (TRANSFER_QUEUE_LEASE) runs out.
+    Args:
+        batch_size (int): The maximum number of requests to claim.
+    Returns:
+        tuple[uuid.UUID, list[TransferRequest]]: The claim token and the requests, oldest first.
+    """
+    token = uuid.uuid4()
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            TransferRequest.objects.select_for_update(skip_locked=True)
+            .filter(status__in=TransferRequest.ACTIVE_STATUSES, available_at__lte=now)
+            .order_by("available_at", "id")[:batch_size]
+        )
+        if not batch:
+            return token, batch
+        lease_end = now + timedelta(seconds=get_setting("TRANSFER_QUEUE_LEASE"))
+        TransferRequest.objects.filter(pk__in=[request.pk for request in batch]).update(
+            status=TransferRequest.PROCESSING,
+            claim_token=token,
+            attempts=F("attempts") + 1,
+            available_at=lease_end,
+        )
+    for request in batch:
+        request.status = TransferRequest.PROCESSING
+        request.claim_token = token
+        request.attempts += 1
+        request.available_at = lease_end
+    if metrics.enabled():
+        metrics.registry.observe("balance_beam_transfer_queue_claimed", {}, len(batch))
+    return token, batch
+
+
+def process_batch(token: uuid.UUID, batch: list[TransferRequest]) -> Counter:
+    """
+    Execute claimed transfer requests, one transaction per sender.
+    Args:
+        token (uuid.UUID): The claim token of the batch.
+        batch (list[TransferRequest]): The claimed requests.
+    Returns:
+        Counter: The number of requests per outcome (see OUTCOMES).
+    """
+    groups: dict[int, list[TransferRequest]] = {}
+    for request in batch:
+        groups.setdefault(request.sender_id, []).append(request)
+    outcomes = Counter()
+    # Группы идут в порядке id отправителей, как у всех воркеров.
+    for sender_id in sorted(groups):
+        group = groups[sender_id]
+        try:
+            processed = _execute_group(token, sender_id, group)
+        except DatabaseError as error:
+            processed = _reschedule_group(token, group, error)
+        for request in processed:
+            outcome = "retried" if request.status == TransferRequest.PENDING else request.status.lower()
+            outcomes[outcome] += 1
+            _record(request, outcome)
+    return outcomes
+
+
+def _execute_group(
+    token: uuid.UUID, sender_id: int, group: list[TransferRequest]
+) -> list[TransferRequest]:
+    sender = CustomCustomer(pk=sender_id)
+    max_attempts = get_setting("TRANSFER_QUEUE_MAX_ATTEMPTS")
+    processed = []
+    # События всех переводов группы записываются в конце её транзакции.
+    with transaction.atomic(), outbox.batched():
+        # Запросы, которые после истечения аренды взял другой воркер, уже не
+        # наши: их строки у него или у них другой токен.
+        owned = set(
+            TransferRequest.objects.select_for_update()
+            .filter(
+                pk__in=[request.pk for request in group],
+                claim_token=token,
+                status=TransferRequest.PROCESSING,
+            )
+            .values_list("pk", flat=True)
+        )
+        # Счета группы блокируются сразу, одним запросом в порядке id: воркеры
+        # не ждут друг друга по кругу, а переводы группы повторно берут уже
+        # свои блокировки. Горячие получатели не блокируются, зачисление на
+        # них уходит в слот.
+        accounts = {sender_id} | {
+            request.recipient_id
+            for request in group
+            if request.pk in owned and not hot_accounts.slot_count(request.recipient_id)
+        }
+        if owned:
+            list(
+                CustomCustomer.objects.select_for_update()
+                .filter(pk__in=accounts)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+        for request in group:
+            if request.pk not in owned:
+                continue
+            processed.append(request)
+            if request.attempts > max_attempts:
+                # Воркеры, бравшие запрос раньше, не дожили до результата.
+                request.status = TransferRequest.FAILED
+                request.error = f"Gave up after {max_attempts} attempts."
+                request.completed_at = timezone.now()
+                continue
+            try:
+                request.balance_after = BalanceService.transfer_balance(
+                    sender, request.recipient_id, request.amount
+                )
+            except (ValueError, ObjectDoesNotExist) as error:
+                # Перевод внутри сервиса откатился до своей точки сохранения,
+                # остальные переводы группы продолжаются.
+                request.status = TransferRequest.FAILED
+                request.error = str(error)[:255]
+            else:
+                request.status = TransferRequest.SUCCEEDED
+                request.error = None
+            request.completed_at = timezone.now()
+        TransferRequest.objects.bulk_update(
+            processed, ["status", "error", "balance_after", "completed_at"]
+        )
+    return processed
+
+
+def _reschedule_group(
+    token: uuid.UUID, group: list[TransferRequest], error: DatabaseError
+) -> list[TransferRequest]:
+    now = timezone.now()
+    max_attempts = get_setting("TRANSFER_QUEUE_MAX_ATTEMPTS")
+    # Текст ошибки базы клиенту не показываем, только её причину.
+    message = f"Database error: {metrics.failure_reason(error)}."
+    with transaction.atomic():
+        requests = list(
+            TransferRequest.objects.select_for_update().filter(
+                pk__in=[request.pk for request in group],
+                claim_token=token,
+                status=TransferRequest.PROCESSING,
+            )
+        )
+        for request in requests:
+            request.error = message
+            if request.attempts >= max_attempts:
+                request.status = TransferRequest.FAILED
+                request.completed_at = now
+            else:
+                request.status = TransferRequest.PENDING
+                request.claim_token = None
+                request.available_at = now + retry_delay(request.attempts)
+        TransferRequest.objects.bulk_update(
+            requests, ["status", "error", "claim_token", "available_at", "completed_at"]
+        )
+    return requests
+
+
+def _record(request: TransferRequest, outcome: str) -> None:
+    if not metrics.enabled():
+        return
+    metrics.registry.inc("balance_beam_transfer_queue_processed_total", {"outcome": outcome})
+    if request.completed_at is not None:
+        metrics.registry.observe(
+            "balance_beam_transfer_queue_delay_seconds",
+            {"outcome": outcome},
+            (request.completed_at - request.created_at).total_seconds(),
+        )
+
+
+def run_worker(
+    batch_size: int | None = None,
+    poll_interval: float | None = None,
+    drain: bool = False,
+    should_stop: Callable[[], bool] = lambda: False,
+) -> Counter:
+    """
+    Claim and execute transfer requests until stopped.
+    Args:
+        batch_size (int | None): Requests claimed at once; TRANSFER_QUEUE_BATCH_SIZE by default.
+        poll_interval (float | None): Seconds to wait when nothing is due; TRANSFER_QUEUE_POLL_INTERVAL by default.
+        drain (bool): Return once no request is pending or being processed.
+        should_stop (Callable[[], bool]): Checked before each batch; the worker returns when it gives True.
+    Returns:
+        Counter: The number of processed requests per outcome.
+    """
+    batch_size = batch_size or get_setting("TRANSFER_QUEUE_BATCH_SIZE")
+    if poll_interval is None:
+        poll_interval = get_setting("TRANSFER_QUEUE_POLL_INTERVAL")
+    outcomes = Counter()
+    while not should_stop():
+        # Соединение воркера живёт долго: обрываем его по CONN_MAX_AGE и
+        # после ошибок, как в конце HTTP-запроса.
+        close_old_connections()
+        token, batch = claim_batch(batch_size)
+        if batch:
+            outcomes.update(process_batch(token, batch))
+            continue
+        if drain and not TransferRequest.objects.filter(
+            status__in=TransferRequest.ACTIVE_STATUSES
+        ).exists():
+            break
+        time.sleep(poll_interval)
+    return outcomes
@@ -1,2 +1,14 @@
-from .balance import increase_balance, check_balance, check_balance_in_rubles, get_operations_history, transfer_balance
+from .balance import (
+    increase_balance,
+    check_balance,
+    check_balance_in_rubles,
+    get_operations_history,
+    export_operations,
+    get_statement,
+    transfer_balance,
+    transfer_balance_async,
+    get_transfer_request,
+    transfer_balance_batch,
+)
 from .account import UserViewSet
+from .metrics import metrics_view
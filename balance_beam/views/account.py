@@ -1,4 +1,6 @@
 from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework import status
@@ -6,6 +8,8 @@ from ..serializers import (
     UserSerializer,
     UserSerializerForUpdate
 )
+from ..authentication import READ_AUTHENTICATION_CLASSES
+from ..routers import pin_to_primary_on_commit, read_from_replica
 from ..models import CustomCustomer
 
 
@@ -68,8 +72,16 @@ class UserViewSet(
                 """Insufficient permissions to perform this action."""
             )
 
-        return super().update(request, *args, **kwargs)
+        response = super().update(request, *args, **kwargs)
+        pin_to_primary_on_commit(request.user.id)
+        return response
 
+    @action(
+        detail=False,
+        methods=["get"],
+        authentication_classes=READ_AUTHENTICATION_CLASSES,
+        permission_classes=[IsAuthenticated],
+    )
     def current(self, request: Request) -> Response:
         """Get current user data.
         Retrieve data about the authenticated user.
@@ -79,6 +91,7 @@ class UserViewSet(
         Returns:
             Response: The response object containing user data.
         """
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        with read_from_replica(request.user.pk):
+            serializer = self.get_serializer(request.user)
+            return Response(serializer.data)
 
@@ -0,0 +1,155 @@
+"""Асинхронные представления чтения для запуска под ASGI.
+
+Повторяют ответы синхронных DRF-представлений (тело отрисовывается тем же
+JSONRenderer), но не занимают поток на время ожидания базы: используют
+асинхронный ORM и асинхронную JWT-аутентификацию без чтения пользователя.
+Метаданные DRF на OPTIONS они не отдают: такой запрос получает 405, и
+заголовок Allow перечисляет только методы представления.
+Включаются настройкой BALANCE_BEAM["ASYNC_READ_VIEWS"].
+"""
+from functools import wraps
+from typing import Any
+
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import replace_query_param
+
+from .. import exports, rollups
+from ..authentication import StatelessJWTAuthentication
+from ..fast_json import FastJSONRenderer
+from ..models import CustomCustomer
+from ..pagination import encode_cursor
+from ..routers import aread_from_replica
+from ..serializers import (
+    ExportQuerySerializer,
+    HistoryQuerySerializer,
+    StatementQuerySerializer,
+    UserSerializer,
+    history_rows,
+)
+from ..services import BalanceService
+
+
+def json_response(
+    data: Any,
+    status_code: int = status.HTTP_200_OK,
+    headers: dict | None = None,
+    renderer_class: type[JSONRenderer] = JSONRenderer,
+) -> HttpResponse:
+    """Render data exactly like a DRF Response with the JSON renderer."""
+    renderer = renderer_class()
+    return HttpResponse(
+        renderer.render(data),
+        status=status_code,
+        content_type=renderer.media_type,
+        headers=headers,
+    )
+
+
+def _exception_response(
+    exc: exceptions.APIException, authenticator: StatelessJWTAuthentication, request: HttpRequest
+) -> HttpResponse:
+    """Build the same error response as the default DRF exception handler."""
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers["WWW-Authenticate"] = authenticator.authenticate_header(request)
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+    return json_response(data, exc.status_code, headers)
+
+
+def async_api_view(http_method_names: list[str]):
+    """Turn an async function into an authenticated JSON API view.
+
+    The view receives a Django request with `user` set and returns an
+    HttpResponse. APIException errors are rendered as in DRF. OPTIONS is not
+    answered, so `Allow` lists only `http_method_names`.
+    """
+
+    def decorator(view):
+        allow = ", ".join(http_method_names)
+
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+            authenticator = StatelessJWTAuthentication()
+            try:
+                authenticated = await authenticator.aauthenticate(request)
+                if authenticated is None:
+                    raise exceptions.NotAuthenticated()
+                request.user, request.auth = authenticated
+                if request.method not in http_method_names:
+                    raise exceptions.MethodNotAllowed(request.method)
+                response = await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                response = _exception_response(exc, authenticator, request)
+            response.headers["Allow"] = allow
+            response.headers["Vary"] = "Accept"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+@async_api_view(["POST"])
+async def check_balance(request: HttpRequest) -> HttpResponse:
+    """Async version of the `check_balance` view."""
+    balance = await BalanceService.acheck_user_balance_in_kopecks(request.user)
+    return json_response({"balance": f"{balance} in kopecks"})
+
+
+@async_api_view(["GET"])
+async def check_balance_in_rubles(request: HttpRequest) -> HttpResponse:
+    """Async version of the `check_balance_in_rubles` view."""
+    balance = await BalanceService.acheck_user_balance_in_rubles(request.user)
+    return json_response({"balance": f"{balance} rubles"})
+
+
+@async_api_view(["GET"])
+async def get_operations_history(request: HttpRequest) -> HttpResponse:
+    """Async version of the `get_operations_history` view."""
+    query = HistoryQuerySerializer(data=request.GET.dict())
+    query.is_valid(raise_exception=True)
+    params = dict(query.validated_data)
+    history, next_position = await BalanceService.aget_operations_page(
+        request.user, after=params.pop("cursor", None), columns=history_rows.columns, **params
+    )
+    headers = {}
+    if next_position is not None:
+        next_url = replace_query_param(
+            request.build_absolute_uri(), "cursor", encode_cursor(next_position)
+        )
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return json_response(
+        history_rows.to_representation(history), headers=headers, renderer_class=FastJSONRenderer
+    )
+
+
+@async_api_view(["GET"])
+async def export_operations(request: HttpRequest) -> StreamingHttpResponse:
+    """Async version of the `export_operations` view."""
+    query = ExportQuerySerializer(data=request.GET.dict())
+    query.is_valid(raise_exception=True)
+    return exports.export_response(request.user.pk, query.validated_data, asynchronous=True)
+
+
+@async_api_view(["GET"])
+async def get_statement(request: HttpRequest) -> HttpResponse:
+    """Async version of the `get_statement` view."""
+    query = StatementQuerySerializer(data=request.GET.dict())
+    query.is_valid(raise_exception=True)
+    params = query.validated_data
+    periods = await rollups.astatement(
+        request.user.pk, params["period"], params["date_from"], params["date_to"]
+    )
+    return json_response(rollups.statement_response(params, periods))
+
+
+@async_api_view(["GET"])
+async def current_user(request: HttpRequest) -> HttpResponse:
+    """Async version of the `UserViewSet.current` action."""
+    async with aread_from_replica(request.user.pk):
+        user = await CustomCustomer.objects.aget(pk=request.user.pk)
+    return json_response(UserSerializer(user).data)
@@ -1,18 +1,45 @@
+from dataclasses import asdict
+
+from django.http import Http404, StreamingHttpResponse
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (
+    api_view,
+    authentication_classes,
+    permission_classes,
+    renderer_classes,
+)
 from rest_framework.permissions import IsAuthenticated
-from ..services import BalanceService
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
+from .. import batching, exports, rollups, transfer_queue
+from ..admission import admission_controlled
+from ..authentication import READ_AUTHENTICATION_CLASSES
+from ..conf import get_setting
+from ..fast_json import FastJSONRenderer
+from ..idempotency import idempotent
+from ..models import CustomCustomer, TransferRequest
+from ..pagination import encode_cursor
+from ..recipients import RECIPIENT_LOOKUPS, forget_recipient
+from ..services import BalanceService, BatchTransferError
 from ..serializers import (
-    HistoryOperationSerializer,
+    ExportQuerySerializer,
+    HistoryQuerySerializer,
     BalanceIncreaseOperationSerializer,
     BalanceTransferOperationSerializer,
+    BalanceBatchTransferSerializer,
+    StatementQuerySerializer,
+    TransferRequestSerializer,
+    history_rows,
 )
 
 
+@admission_controlled
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def increase_balance(request: Request) -> Response:
     """
     Increase user balance based on the amount provided in kopecks.
@@ -28,13 +55,12 @@ def increase_balance(request: Request) -> Response:
     serializer.is_valid(raise_exception=True)
     validated_data = serializer.validated_data
     amount_in_kopecks = validated_data.get("amount")
-    BalanceService.increase_balance(
-        user, amount_in_kopecks=amount_in_kopecks, sender=user
-    )
+    batching.increase_balance(user, amount_in_kopecks=amount_in_kopecks, sender=user)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 @api_view(["POST"])
+@authentication_classes(READ_AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated])
 def check_balance(request: Request) -> Response:
     """
@@ -50,6 +76,7 @@ def check_balance(request: Request) -> Response:
 
 
 @api_view(["GET"])
+@authentication_classes(READ_AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated])
 def check_balance_in_rubles(request: Request) -> Response:
     """
@@ -65,28 +92,94 @@ def check_balance_in_rubles(request: Request) -> Response:
 
 
 @api_view(["GET"])
+@authentication_classes(READ_AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer])
 def get_operations_history(request: Request) -> Response:
     """
-    Retrieve the last operations history for the authenticated user.
+    Retrieve the operations history for the authenticated user, newest first.
+
+    Query parameters: `limit`, `cursor` and the filters `operation_type`,
+    `success`, `amount_min`, `amount_max`, `date_from`, `date_to`,
+    `counterparty`. The URL of the next page is returned in the `Link` header.
+    Only the serialized columns are read, and the rows are serialized with
+    `history_rows` instead of HistoryOperationSerializer, with the same output.
     Args:
         request (Request): The request object containing user information.
     Returns:
         Response: The response object containing the serialized history operations data.
     """
-    # TODO: хотелось ещё подзаморочиться и сделать разные параметры для фильтрации, но я уже и так наделала делов)
     user = request.user
-    history = BalanceService.get_last_operations(user)
-    serializer = HistoryOperationSerializer(history, many=True)
-    return Response(serializer.data)
+    query = HistoryQuerySerializer(data=request.query_params.dict())
+    query.is_valid(raise_exception=True)
+    params = dict(query.validated_data)
+    history, next_position = BalanceService.get_operations_page(
+        user, after=params.pop("cursor", None), columns=history_rows.columns, **params
+    )
+    headers = {}
+    if next_position is not None:
+        next_url = replace_query_param(
+            request.build_absolute_uri(), "cursor", encode_cursor(next_position)
+        )
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return Response(history_rows.to_representation(history), headers=headers)
 
 
+@api_view(["GET"])
+@authentication_classes(READ_AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated])
+def export_operations(request: Request) -> StreamingHttpResponse:
+    """
+    Download the full operations history of the authenticated user, oldest first.
+
+    Query parameters: `export_format` (`csv` or `ndjson`), `gzip` and the
+    filters of `get_operations_history`. The rows are streamed, so the
+    response can be of any size.
+    Args:
+        request (Request): The request object containing user information.
+    Returns:
+        StreamingHttpResponse: The export as a file attachment.
+    """
+    query = ExportQuerySerializer(data=request.query_params.dict())
+    query.is_valid(raise_exception=True)
+    return exports.export_response(request.user.pk, query.validated_data)
+
+
+@api_view(["GET"])
+@authentication_classes(READ_AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated])
+def get_statement(request: Request) -> Response:
+    """
+    Retrieve the user's totals per month or per day, read from the rollups.
+
+    Query parameters: `period` (`month` or `day`), `date_from` and
+    `date_to` (dates, the end is exclusive).
+    Args:
+        request (Request): The request object containing user information.
+    Returns:
+        Response: Money in, money out, the number of successful and failed
+        operations per period and in total, amounts in kopecks.
+    """
+    query = StatementQuerySerializer(data=request.query_params.dict())
+    query.is_valid(raise_exception=True)
+    params = query.validated_data
+    periods = rollups.statement(
+        request.user.pk, params["period"], params["date_from"], params["date_to"]
+    )
+    return Response(rollups.statement_response(params, periods))
+
+
+@admission_controlled(recipient_fields=tuple(RECIPIENT_LOOKUPS))
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def transfer_balance(request: Request) -> Response:
     """
     Transfer balance from the user's account to another user's account.
 
+    The recipient is given by `recipient_id`, `recipient_email` or
+    `recipient_phone`; its resolved id goes straight into the locked transfer.
+
     Args:
     - request: Request object containing user data and transfer details
 
@@ -106,6 +199,14 @@ def transfer_balance(request: Request) -> Response:
             amount_in_kopecks=validated_data.get("amount"),
             recipient_id=validated_data.get("recipient_id"),
         )
+    except CustomCustomer.DoesNotExist:
+        # Получатель из кеша удалён: запись кеша больше не нужна.
+        field, value = serializer.recipient_lookup
+        forget_recipient(field, value)
+        return Response(
+            {field: [f"Customer with {field.removeprefix('recipient_')} {value} does not exist."]},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
     except ValueError as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     return Response(
@@ -114,3 +215,106 @@ def transfer_balance(request: Request) -> Response:
         },
         status=status.HTTP_200_OK,
     )
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@idempotent
+def transfer_balance_async(request: Request) -> Response:
+    """
+    Queue a transfer from the user's account for the process_transfers workers.
+
+    The request is validated like a synchronous transfer; the answer is 202
+    with the transfer request, whose status is polled at the Location URL.
+    Available while ASYNC_TRANSFERS is on. The view isn't admission
+    controlled: it only inserts the request and locks no account rows, and
+    the workers execute the queue at their own pace.
+
+    Args:
+    - request: Request object containing user data and transfer details
+
+    Returns:
+    - Response: Response object with the queued transfer request
+    """
+    if not get_setting("ASYNC_TRANSFERS"):
+        raise Http404
+    serializer = BalanceTransferOperationSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    validated_data = serializer.validated_data
+    transfer_request = transfer_queue.enqueue_transfer(
+        request.user,
+        recipient_id=validated_data["recipient_id"],
+        amount_in_kopecks=validated_data["amount"],
+    )
+    return Response(
+        TransferRequestSerializer(transfer_request).data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={
+            "Location": reverse(
+                "transfer_request", args=[transfer_request.pk], request=request
+            )
+        },
+    )
+
+
+@api_view(["GET"])
+@authentication_classes(READ_AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated])
+def get_transfer_request(request: Request, pk: int) -> Response:
+    """
+    Retrieve the status of a queued transfer of the user.
+    Args:
+        request (Request): The incoming request object.
+        pk (int): The transfer request ID.
+    Returns:
+        Response: The transfer request, or 404 if the user has no such request.
+    """
+    transfer_request = TransferRequest.objects.filter(
+        pk=pk, sender_id=request.user.pk
+    ).first()
+    if transfer_request is None:
+        raise Http404
+    return Response(TransferRequestSerializer(transfer_request).data)
+
+
+@admission_controlled(legs_field="transfers")
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@idempotent
+def transfer_balance_batch(request: Request) -> Response:
+    """
+    Transfer balance from the user's account to many recipients in one transaction.
+
+    Args:
+    - request: Request object with a list of transfers and the `atomic` flag
+
+    Returns:
+    - Response: Response object with current balance and per-transfer results
+    """
+
+    user = request.user
+
+    serializer = BalanceBatchTransferSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    validated_data = serializer.validated_data
+    legs = [
+        (transfer["recipient_id"], transfer["amount"])
+        for transfer in validated_data["transfers"]
+    ]
+
+    try:
+        results = BalanceService.transfer_many(
+            legs, sender=user, atomic=validated_data["atomic"]
+        )
+    except BatchTransferError as e:
+        return Response(
+            {"error": str(e), "results": [asdict(result) for result in e.results]},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return Response(
+        {
+            "current_balance": f"{results[-1].sender_balance} in kopecks",
+            "results": [asdict(result) for result in results],
+        },
+        status=status.HTTP_200_OK,
+    )
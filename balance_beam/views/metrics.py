@@ -0,0 +1,28 @@
+from django.http import Http404, HttpRequest, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from .. import metrics
+from ..conf import get_setting
+
+
+@require_GET
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Expose the service metrics of all worker processes in the Prometheus text format.
+
+    Available while METRICS_ENABLED is on. With METRICS_TOKEN set the scraper
+    must send it as a bearer token.
+    Args:
+        request (HttpRequest): The scrape request.
+    Returns:
+        HttpResponse: The metrics, or 401 without the expected token.
+    """
+    if not metrics.enabled():
+        raise Http404
+    token = get_setting("METRICS_TOKEN")
+    if token and not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return HttpResponse(status=401, headers={"WWW-Authenticate": "Bearer"})
+    return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
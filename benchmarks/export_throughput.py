@@ -0,0 +1,88 @@
+"""Пропускная способность и память выгрузки истории операций.
+
+Создаёт пользователя с `--rows` операциями (одним INSERT ... SELECT из
+generate_series) и выгружает их каждым форматом, со сжатием и без.
+Запускайте на тестовой базе PostgreSQL: каждый прогон создаёт нового
+пользователя `export-bench-*@example.com`.
+
+    python -m benchmarks.export_throughput --rows 5000000
+
+Результат печатается в JSON: время до первого фрагмента, строк и мегабайт
+в секунду и пиковый размер процесса (RSS), который не должен расти вместе с
+числом строк.
+"""
+import argparse
+import json
+import os
+import resource
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wallet_wise.settings")
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+from balance_beam import exports  # noqa: E402
+from balance_beam.models import BalanceOperation, CustomCustomer  # noqa: E402
+
+
+def create_history(rows: int) -> CustomCustomer:
+    """Create a customer with `rows` operations spread over the last hours."""
+    customer = CustomCustomer.objects.create(
+        email=f"export-bench-{time.time_ns()}@example.com"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {BalanceOperation._meta.db_table} "
+            "(user_id, amount, operation_type, timestamp, success, related_customer) "
+            "SELECT %s, 100 + n %% 1000, CASE WHEN n %% 3 = 0 THEN 'TRANSFER' ELSE 'INCREASE' END, "
+            "now() - n * interval '10 milliseconds', n %% 50 <> 0, 'bench@example.com, id: 1' "
+            "FROM generate_series(1, %s) AS n",
+            [customer.pk, rows],
+        )
+        cursor.execute(f"ANALYZE {BalanceOperation._meta.db_table}")
+    return customer
+
+
+def run(customer_id: int, rows: int, export_format: str, compress: bool) -> dict:
+    """Export the history once, discarding the output."""
+    began = time.perf_counter()
+    first_chunk = None
+    size = 0
+    for chunk in exports.stream_operations(customer_id, export_format, compress):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - began
+        size += len(chunk)
+    elapsed = time.perf_counter() - began
+    return {
+        "format": export_format,
+        "gzip": compress,
+        "rows": rows,
+        "first_chunk_ms": round(first_chunk * 1000, 1),
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round(rows / elapsed),
+        "mb_per_second": round(size / elapsed / 2**20, 1),
+        "output_mb": round(size / 2**20, 1),
+        # ru_maxrss в Linux - в килобайтах.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--formats", nargs="+", default=list(exports.FORMATS))
+    args = parser.parse_args()
+    customer = create_history(args.rows)
+    results = [
+        run(customer.pk, args.rows, export_format, compress)
+        for export_format in args.formats
+        for compress in (False, True)
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Микробенчмарк сериализации истории операций.
+
+Сравнивает на одной и той же странице операций, без базы и HTTP:
+
+    model_serializer  экземпляры модели через HistoryOperationSerializer и
+                      JSONRenderer DRF (прежний путь)
+    rows              строки values_list() через history_rows и JSONRenderer
+    rows_fast         строки через history_rows и FastJSONRenderer
+
+и разбор тела пакетного перевода JSONParser и FastJSONParser. Перед
+замерами проверяется, что все пути дают одинаковые байты.
+
+    python -m benchmarks.history_serialization
+    python -m benchmarks.history_serialization --rows 20 --repeat 20000
+
+Результат печатается в JSON: микросекунды на страницу (на тело) и ускорение
+относительно прежнего пути; `orjson` - установлен ли orjson.
+"""
+import argparse
+import io
+import json
+import os
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wallet_wise.settings")
+django.setup()
+
+from django.utils import timezone  # noqa: E402
+from rest_framework.parsers import JSONParser  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from balance_beam import fast_json  # noqa: E402
+from balance_beam.models import BalanceOperation  # noqa: E402
+from balance_beam.serializers import HistoryOperationSerializer, history_rows  # noqa: E402
+from balance_beam.services import BalanceService  # noqa: E402
+
+
+def make_page(rows: int) -> list[BalanceOperation]:
+    """Build a page of operations like the ones of a real history, in memory."""
+    now = timezone.now()
+    return [
+        BalanceOperation(
+            id=index + 1,
+            user_id=42,
+            amount=100 + index * 37,
+            operation_type="TRANSFER" if index % 3 == 0 else "INCREASE",
+            timestamp=now - timedelta(seconds=index, microseconds=index * 7919),
+            success=index % 10 != 0,
+            text_error=None if index % 10 else "Недостаточно средств",
+        )
+        for index in range(rows)
+    ]
+
+
+def measure(function, repeat: int) -> float:
+    """Return the mean time of a call in microseconds."""
+    began = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return round((time.perf_counter() - began) / repeat * 1e6, 2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100, help="Operations per page.")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    operations = make_page(args.rows)
+    rows = BalanceService._page_rows(operations, history_rows.columns)
+    renderer = JSONRenderer()
+    fast_renderer = fast_json.FastJSONRenderer()
+    paths = {
+        "model_serializer": lambda: renderer.render(
+            HistoryOperationSerializer(operations, many=True).data
+        ),
+        "rows": lambda: renderer.render(history_rows.to_representation(rows)),
+        "rows_fast": lambda: fast_renderer.render(history_rows.to_representation(rows)),
+    }
+    outputs = {name: path() for name, path in paths.items()}
+    if len(set(outputs.values())) != 1:
+        raise SystemExit("The serialization paths give different output.")
+
+    body = json.dumps(
+        {"transfers": [{"recipient_id": index, "amount": 100 + index} for index in range(args.rows)]}
+    ).encode()
+    parsers = {
+        "json_parser": JSONParser(),
+        "fast_json_parser": fast_json.FastJSONParser(),
+    }
+    if len({json.dumps(p.parse(io.BytesIO(body))) for p in parsers.values()}) != 1:
+        raise SystemExit("The parsers give different data.")
+
+    results = {name: measure(path, args.repeat) for name, path in paths.items()}
+    results.update(
+        {
+            name: measure(lambda p=p: p.parse(io.BytesIO(body)), args.repeat)
+            for name, p in parsers.items()
+        }
+    )
+    baseline = results["model_serializer"]
+    print(
+        json.dumps(
+            {
+                "rows": args.rows,
+                "repeat": args.repeat,
+                "orjson": fast_json.use_orjson(),
+                "response_bytes": len(outputs["rows_fast"]),
+                "microseconds": results,
+                "speedup": {
+                    name: round(baseline / results[name], 2) for name in ("rows", "rows_fast")
+                },
+                "parser_speedup": round(results["json_parser"] / results["fast_json_parser"], 2),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Нагрузочный тест эндпоинтов чтения по HTTP.
+
+Сравнение синхронных представлений под WSGI с асинхронными под ASGI:
+запустите сервер одним способом, прогоните скрипт, затем другим.
+
+    gunicorn wallet_wise.wsgi -w 4 --threads 8
+    python -m benchmarks.http_load --email u@example.com --password secret
+
+    # BALANCE_BEAM["ASYNC_READ_VIEWS"] = True
+    uvicorn wallet_wise.asgi:application --workers 4
+    python -m benchmarks.http_load --email u@example.com --password secret
+
+Используется только стандартная библиотека: клиент на asyncio держит
+`--concurrency` постоянных соединений. Результат печатается в JSON.
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+DEFAULT_ENDPOINTS = [
+    "GET /api/v1/check_balance_in_rubles/",
+    "POST /api/v1/check_balance/",
+    "GET /api/v1/get_operations_history/",
+    "GET /api/v1/account/current",
+]
+
+
+def obtain_token(base_url: str, email: str, password: str) -> str:
+    """Get an access token from the token endpoint."""
+    request = Request(
+        f"{base_url}/api/token/",
+        data=json.dumps({"email": email, "password": password}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urlopen(request) as response:
+        return json.load(response)["access"]
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    """Build the throughput and latency summary of a run, latencies in milliseconds."""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    status_line = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+async def _worker(host, port, raw_requests, deadline, latencies, counters):
+    reader, writer = await asyncio.open_connection(host, port)
+    index = 0
+    try:
+        while time.perf_counter() < deadline:
+            raw = raw_requests[index % len(raw_requests)]
+            index += 1
+            started = time.perf_counter()
+            writer.write(raw)
+            await writer.drain()
+            status = await _read_response(reader)
+            if status < 400:
+                latencies.append(time.perf_counter() - started)
+            else:
+                counters["errors"] += 1
+    finally:
+        writer.close()
+
+
+async def run(base_url: str, token: str, endpoints: list[str], concurrency: int, duration: float) -> dict:
+    """Hit the endpoints round-robin from `concurrency` connections for `duration` seconds."""
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    raw_requests = []
+    for endpoint in endpoints:
+        method, path = endpoint.split(" ", 1)
+        raw_requests.append(
+            (
+                f"{method} {url.path.rstrip('/')}{path} HTTP/1.1\r\n"
+                f"Host: {url.netloc}\r\n"
+                f"Authorization: Bearer {token}\r\n"
+                "Content-Length: 0\r\n\r\n"
+            ).encode()
+        )
+    latencies: list[float] = []
+    counters = {"errors": 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(
+        *(
+            _worker(host, port, raw_requests, deadline, latencies, counters)
+            for _ in range(concurrency)
+        )
+    )
+    return summarize(latencies, counters["errors"], time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", help="Access token; obtained from --email/--password if omitted.")
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    parser.add_argument("--endpoint", action="append", dest="endpoints", help='e.g. "GET /api/v1/check_balance_in_rubles/"')
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--duration", type=float, default=30.0)
+    args = parser.parse_args()
+
+    token = args.token or obtain_token(args.base_url, args.email, args.password)
+    endpoints = args.endpoints or DEFAULT_ENDPOINTS
+    result = asyncio.run(run(args.base_url, token, endpoints, args.concurrency, args.duration))
+    result.update(base_url=args.base_url, endpoints=endpoints, concurrency=args.concurrency)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Воспроизводимый набор нагрузочных сценариев для API баланса.
+
+Сценарии выполняются потоками либо через BalanceService (`--driver
+service`), либо через эндпоинты API со всем стеком middleware, DRF и
+аутентификацией по JWT (`--driver api`, клиент Django в процессе, без
+сети):
+
+    uniform_transfers  переводы между случайными счетами пула
+    hot_recipient      переводы со всех счетов на один счёт мерчанта
+    read_polling       опрос баланса
+    history_paging     листание истории операций по курсору
+
+Запускайте на тестовой базе: каждый прогон создаёт счета
+`load-suite-*@example.com` с историей операций. Выбор счетов зависит только
+от `--seed`, поэтому прогоны с одинаковыми параметрами сравнимы.
+
+    python -m benchmarks.load_suite
+    python -m benchmarks.load_suite --driver api --scenario hot_recipient --threads 32
+    python -m benchmarks.load_suite --output after.json --compare before.json
+
+Результат печатается в JSON (и пишется в `--output`): для каждого сценария
+пропускная способность, задержки p50/p95/p99, число взаимоблокировок и
+ошибок сериализации, отклонённых запросов (429) и запросов к базе на одну
+операцию, а также параметры прогона и версия кода.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from contextlib import ExitStack
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wallet_wise.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import close_old_connections, connection, connections  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from balance_beam import hot_accounts  # noqa: E402
+from balance_beam.conf import DEFAULTS, get_setting  # noqa: E402
+from balance_beam.models import BalanceOperation, CustomCustomer  # noqa: E402
+from balance_beam.serializers.token import CustomerTokenObtainPairSerializer  # noqa: E402
+from balance_beam.services import BalanceService  # noqa: E402
+from benchmarks.http_load import summarize  # noqa: E402
+
+SCENARIOS = ["uniform_transfers", "hot_recipient", "read_polling", "history_paging"]
+DRIVERS = ["service", "api"]
+# SQLSTATE ошибок, после которых транзакцию можно повторить.
+DEADLOCK = "40P01"
+SERIALIZATION_FAILURE = "40001"
+PAGE_SIZE = 20
+
+
+class Fixture:
+    """The accounts a run works on."""
+
+    def __init__(self, accounts: list[CustomCustomer], merchant: CustomCustomer) -> None:
+        self.accounts = accounts
+        self.merchant = merchant
+        self.tokens = {
+            account.pk: str(CustomerTokenObtainPairSerializer.get_token(account).access_token)
+            for account in accounts
+        }
+
+
+def create_fixture(accounts: int, history: int, hot_slots: int) -> Fixture:
+    """Create funded accounts with `history` operations each, and the merchant."""
+    prefix = f"load-suite-{time.time_ns()}"
+    customers = CustomCustomer.objects.bulk_create(
+        CustomCustomer(email=f"{prefix}-{index}@example.com", balance=10**9)
+        for index in range(accounts)
+    )
+    merchant = CustomCustomer.objects.create(email=f"{prefix}-merchant@example.com")
+    hot_accounts.set_slot_count(merchant.pk, hot_slots)
+    now = timezone.now()
+    BalanceOperation.objects.bulk_create(
+        (
+            BalanceOperation(
+                user=customer,
+                amount=100 + index,
+                operation_type="INCREASE",
+                timestamp=now - timedelta(minutes=index),
+            )
+            for customer in customers
+            for index in range(history)
+        ),
+        batch_size=5000,
+    )
+    return Fixture(customers, merchant)
+
+
+def client_host() -> str:
+    """Return a host name the API accepts."""
+    hosts = [host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"]
+    return hosts[0] if hosts else "localhost"
+
+
+def service_operation(scenario: str, fixture: Fixture, rng: random.Random) -> Callable[[], any]:
+    """Build one operation of the scenario, called through BalanceService."""
+    sender = rng.choice(fixture.accounts)
+    if scenario == "uniform_transfers":
+        recipient = rng.choice([account for account in fixture.accounts if account != sender])
+        return lambda: BalanceService.transfer_balance(sender, recipient.pk, rng.randint(1, 1000))
+    if scenario == "hot_recipient":
+        return lambda: BalanceService.transfer_balance(
+            sender, fixture.merchant.pk, rng.randint(1, 1000)
+        )
+    if scenario == "read_polling":
+        # Такой же пользователь, как у представлений чтения: из claims токена.
+        user = CustomCustomer.from_token_claims(sender.pk, True, sender.token_version)
+        return lambda: BalanceService.check_user_balance_in_rubles(user)
+
+    def page_through() -> None:
+        after = None
+        while True:
+            _, after = BalanceService.get_operations_page(sender, PAGE_SIZE, after)
+            if after is None:
+                return
+
+    return page_through
+
+
+def api_operation(
+    scenario: str, fixture: Fixture, rng: random.Random, client: Client
+) -> Callable[[], int]:
+    """Build one operation of the scenario, sent to the API; it returns the last status code."""
+    sender = rng.choice(fixture.accounts)
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {fixture.tokens[sender.pk]}"}
+    if scenario in ("uniform_transfers", "hot_recipient"):
+        if scenario == "hot_recipient":
+            recipient = fixture.merchant
+        else:
+            recipient = rng.choice([account for account in fixture.accounts if account != sender])
+        body = json.dumps({"recipient_id": recipient.pk, "amount": rng.randint(1, 1000)})
+        return lambda: client.post(
+            "/api/v1/transfer_balance/", body, content_type="application/json", **auth
+        ).status_code
+    if scenario == "read_polling":
+        return lambda: client.get("/api/v1/check_balance_in_rubles/", **auth).status_code
+
+    def page_through() -> int:
+        url = f"/api/v1/get_operations_history/?limit={PAGE_SIZE}"
+        while True:
+            response = client.get(url, **auth)
+            link = response.headers.get("Link")
+            if response.status_code >= 400 or not link:
+                return response.status_code
+            url = link[1 : link.index(">")]
+
+    return page_through
+
+
+def failure_kind(error: BaseException) -> str:
+    """Classify an exception as a deadlock, a serialization failure or another error."""
+    while error is not None:
+        code = getattr(error, "pgcode", None) or getattr(error, "sqlstate", None)
+        if code == DEADLOCK:
+            return "deadlocks"
+        if code == SERIALIZATION_FAILURE:
+            return "serialization_failures"
+        error = error.__cause__
+    return "errors"
+
+
+class QueryCounter:
+    """Count the queries of the current thread (connection.execute_wrapper)."""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def worker(
+    scenario: str,
+    driver: str,
+    fixture: Fixture,
+    seed: int,
+    count: int,
+    warmup: int,
+    start: threading.Barrier,
+    latencies: list[float],
+    outcomes: Counter,
+) -> None:
+    rng = random.Random(seed)
+    client = Client(HTTP_HOST=client_host(), raise_request_exception=True)
+    queries = QueryCounter()
+    with ExitStack() as stack:
+        for alias in settings.DATABASES:
+            stack.enter_context(connections[alias].execute_wrapper(queries))
+        start.wait()
+        for index in range(warmup + count):
+            if index == warmup:
+                queries.count = 0
+            if driver == "api":
+                operation = api_operation(scenario, fixture, rng, client)
+            else:
+                operation = service_operation(scenario, fixture, rng)
+            began = time.perf_counter()
+            try:
+                status = operation()
+            except Exception as error:  # pylint: disable=broad-except
+                kind = failure_kind(error)
+            else:
+                kind = None
+                if driver == "api" and status >= 400:
+                    kind = "rejected" if status == 429 else "errors"
+            if index < warmup:
+                continue
+            if kind is None:
+                latencies.append(time.perf_counter() - began)
+            else:
+                outcomes[kind] += 1
+    outcomes["queries"] += queries.count
+    close_old_connections()
+
+
+def run(
+    scenario: str, driver: str, fixture: Fixture, threads: int, count: int, warmup: int, seed: int
+) -> dict:
+    """Run one scenario with `threads` threads doing `count` operations each."""
+    # У каждого потока свои задержки и счётчики, они сводятся после join.
+    thread_latencies: list[list[float]] = [[] for _ in range(threads)]
+    thread_outcomes: list[Counter] = [Counter() for _ in range(threads)]
+    start = threading.Barrier(threads + 1)
+    workers = [
+        threading.Thread(
+            target=worker,
+            args=(
+                scenario, driver, fixture, seed * 1000 + index, count, warmup, start,
+                thread_latencies[index], thread_outcomes[index],
+            ),
+        )
+        for index in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    latencies = [latency for chunk in thread_latencies for latency in chunk]
+    outcomes = sum(thread_outcomes, Counter())
+
+    failures = sum(outcomes[kind] for kind in ("deadlocks", "serialization_failures", "rejected", "errors"))
+    operations = threads * count
+    return {
+        "scenario": scenario,
+        "driver": driver,
+        **summarize(latencies, failures, elapsed),
+        "deadlocks": outcomes["deadlocks"],
+        "serialization_failures": outcomes["serialization_failures"],
+        "rejected": outcomes["rejected"],
+        "queries_per_request": round(outcomes["queries"] / operations, 2) if operations else 0.0,
+    }
+
+
+def git_revision() -> str | None:
+    """Return the commit of the working tree, if it is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline: dict) -> list[dict]:
+    """Compare the results with a previous run, as relative changes in percent."""
+    previous = {(result["scenario"], result["driver"]): result for result in baseline["results"]}
+    changes = []
+    for result in results:
+        before = previous.get((result["scenario"], result["driver"]))
+        if before is None:
+            continue
+        change = {"scenario": result["scenario"], "driver": result["driver"]}
+        for name in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request"):
+            change[name] = (
+                round((result[name] - before[name]) / before[name] * 100, 1) if before[name] else None
+            )
+        changes.append(change)
+    return changes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", dest="scenarios")
+    parser.add_argument("--driver", choices=DRIVERS, action="append", dest="drivers")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--count", type=int, default=200, help="Measured operations per thread.")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured operations per thread.")
+    parser.add_argument("--accounts", type=int, default=64)
+    parser.add_argument("--history", type=int, default=100, help="Operations per account.")
+    parser.add_argument("--hot-slots", type=int, default=0, help="Balance slots of the merchant.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Also write the results to this file.")
+    parser.add_argument("--compare", help="The results file of a previous run.")
+    args = parser.parse_args()
+
+    # Отказы считаются в результатах, трассировки ошибок 500 не нужны.
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    fixture = create_fixture(args.accounts, args.history, args.hot_slots)
+    results = [
+        run(scenario, driver, fixture, args.threads, args.count, args.warmup, args.seed)
+        for scenario in args.scenarios or SCENARIOS
+        for driver in args.drivers or DRIVERS
+    ]
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        # Действующие значения, а не только переопределённые в проекте.
+        "balance_beam": {name: get_setting(name) for name in DEFAULTS},
+        "parameters": {
+            name: value for name, value in vars(args).items() if name not in ("output", "compare")
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            report["comparison"] = compare(results, json.load(baseline))
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Заглушка HTTP-получателя событий outbox для тестов и нагрузки.
+
+Принимает пачки HTTPSink (POST с `{"events": [...]}`), проверяет порядок
+событий каждого счёта и отвечает ошибками с заданной частотой, чтобы
+проверить повторы и снижение нагрузки диспетчером:
+
+    python -m benchmarks.outbox_stub --port 8099 --fail-rate 0.05 --throttle-rate 0.1
+
+    BALANCE_BEAM["OUTBOX_SINK"] = "balance_beam.sinks.HTTPSink"
+    BALANCE_BEAM["OUTBOX_SINK_OPTIONS"] = {"url": "http://127.0.0.1:8099/events"}
+
+`GET /stats` возвращает счётчики в JSON: принятые пачки и события, дубли
+(повторная доставка после ошибки), нарушения порядка номеров счёта
+(`sequence` меньше ожидаемого или с пропуском) и отказы.
+С `--output` принятые события дописываются в файл NDJSON. Используется
+только стандартная библиотека.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    """What the stub has received, per account."""
+
+    def __init__(self, output: str | None) -> None:
+        self.lock = threading.Lock()
+        self.last_sequences: dict[int, int] = {}
+        self.stats = Counter()
+        self.output = open(output, "a", encoding="utf-8") if output else None
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] += 1
+
+    def accept(self, events: list[dict]) -> None:
+        with self.lock:
+            self.stats["batches"] += 1
+            for event in events:
+                account, sequence = event["account"], event["sequence"]
+                last = self.last_sequences.get(account)
+                # Повторная доставка после ошибки приходит с уже принятыми
+                # номерами.
+                if last is not None and sequence <= last:
+                    self.stats["duplicates"] += 1
+                    continue
+                # Номер первого события счёта заранее не известен: заглушку
+                # могли запустить, когда часть событий уже доставлена.
+                if last is not None and sequence != last + 1:
+                    self.stats["out_of_order"] += 1
+                self.last_sequences[account] = sequence
+                self.stats["events"] += 1
+                if self.output:
+                    self.output.write(json.dumps(event, ensure_ascii=False) + "\n")
+            if self.output:
+                self.output.flush()
+
+
+def make_handler(state: StubState, options: argparse.Namespace) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if options.delay:
+                time.sleep(options.delay / 1000)
+            roll = random.random()
+            if roll < options.throttle_rate:
+                state.count("throttled")
+                self._reply(429, {"error": "throttled"}, {"Retry-After": str(options.retry_after)})
+                return
+            if roll < options.throttle_rate + options.fail_rate:
+                state.count("failed")
+                self._reply(500, {"error": "failed"})
+                return
+            state.accept(json.loads(body)["events"])
+            self._reply(200, {"accepted": True})
+
+        def do_GET(self) -> None:
+            with state.lock:
+                stats = dict(state.stats, accounts=len(state.last_sequences))
+            self._reply(200, stats)
+
+        def _reply(self, status: int, data: dict, headers: dict | None = None) -> None:
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--output", help="Append the accepted events to this NDJSON file.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of batches answered with 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of batches answered with 429.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429 answers, seconds.")
+    parser.add_argument("--delay", type=float, default=0.0, help="Milliseconds spent on each batch.")
+    options = parser.parse_args()
+
+    state = StubState(options.output)
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(state, options))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(dict(state.stats, accounts=len(state.last_sequences))))
+
+
+if __name__ == "__main__":
+    main()
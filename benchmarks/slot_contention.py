@@ -0,0 +1,111 @@
+"""Конкурентные зачисления на один горячий счёт.
+
+Несколько потоков одновременно зачисляют деньги на один счёт мерчанта
+через BalanceService; прогон повторяется для каждого числа слотов баланса.
+Запускайте на тестовой базе: каждый прогон создаёт новые счета с адресами
+`slot-bench-*@example.com` и операции по ним.
+
+    python -m benchmarks.slot_contention --threads 32 --slots 0 1 4 16
+    python -m benchmarks.slot_contention --operation transfer
+
+Результат печатается в JSON: пропускная способность и задержки на каждое
+число слотов.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wallet_wise.settings")
+django.setup()
+
+from django.db import close_old_connections  # noqa: E402
+
+from balance_beam import hot_accounts  # noqa: E402
+from balance_beam.models import CustomCustomer  # noqa: E402
+from balance_beam.services import BalanceService  # noqa: E402
+from benchmarks.http_load import summarize  # noqa: E402
+
+
+def create_accounts(threads: int) -> tuple[CustomCustomer, list[CustomCustomer]]:
+    """Create the merchant and one funded payer per thread."""
+    prefix = f"slot-bench-{time.time_ns()}"
+    merchant = CustomCustomer.objects.create(email=f"{prefix}-merchant@example.com")
+    payers = CustomCustomer.objects.bulk_create(
+        CustomCustomer(email=f"{prefix}-{index}@example.com", balance=10**9)
+        for index in range(threads)
+    )
+    return merchant, payers
+
+
+def credit_worker(
+    operation: str,
+    merchant: CustomCustomer,
+    payer: CustomCustomer,
+    count: int,
+    latencies: list[float],
+    errors: list[int],
+    start: threading.Barrier,
+) -> None:
+    start.wait()
+    for _ in range(count):
+        began = time.perf_counter()
+        try:
+            if operation == "transfer":
+                BalanceService.transfer_balance(payer, merchant.pk, 100)
+            else:
+                BalanceService.increase_balance(merchant, 100, sender=payer)
+        except Exception:  # pylint: disable=broad-except
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - began)
+    close_old_connections()
+
+
+def run(operation: str, threads: int, count: int, slots: int) -> dict:
+    """Run one round of concurrent credits against a merchant with `slots` slots."""
+    merchant, payers = create_accounts(threads)
+    hot_accounts.set_slot_count(merchant.pk, slots)
+    latencies: list[float] = []
+    errors: list[int] = []
+    start = threading.Barrier(threads + 1)
+    workers = [
+        threading.Thread(
+            target=credit_worker,
+            args=(operation, merchant, payer, count, latencies, errors, start),
+        )
+        for payer in payers
+    ]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    began = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - began
+
+    expected = 100 * len(latencies)
+    balance = BalanceService.query_balance(merchant.pk)
+    return {
+        "slots": slots,
+        "balance_ok": balance == expected,
+        **summarize(latencies, len(errors), elapsed),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operation", choices=["increase", "transfer"], default="increase")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--count", type=int, default=200, help="Credits per thread.")
+    parser.add_argument("--slots", type=int, nargs="+", default=[0, 1, 2, 4, 8, 16])
+    args = parser.parse_args()
+    results = [run(args.operation, args.threads, args.count, slots) for slots in args.slots]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
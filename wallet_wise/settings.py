@@ -47,7 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "balance_beam.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "balance_beam.admission.AdmissionControlMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -93,6 +95,15 @@ DATABASES = {
         "PORT": "5432",
     },
 }
+# A streaming replica for reads. Point it at the replica host and list it in
+# BALANCE_BEAM["READ_REPLICAS"]; until then nothing is routed to it. Tests
+# run it as a mirror of "default".
+DATABASES["replica"] = {
+    **DATABASES["default"],
+    "TEST": {"MIRROR": "default"},
+}
+
+DATABASE_ROUTERS = ["balance_beam.routers.ReplicaRouter"]
 
 AUTH_USER_MODEL = "balance_beam.CustomCustomer"
 # Password validation
@@ -114,6 +125,18 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Use a shared backend (Redis, Memcached) in production, so that token
+# revocation and snapshot invalidation are seen by every process.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
 
@@ -141,8 +164,13 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    )
+        "balance_beam.authentication.VersionedJWTAuthentication",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "balance_beam.fast_json.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -171,8 +199,14 @@ SIMPLE_JWT = {
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
     "TOKEN_USER_CLASS": "rest_framework_simplejwt.models.TokenUser",
+    "TOKEN_OBTAIN_SERIALIZER": "balance_beam.serializers.CustomerTokenObtainPairSerializer",
     "JTI_CLAIM": "jti",
     "SLIDING_TOKEN_REFRESH_EXP_CLAIM": "refresh_exp",
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 }
+
+# Balance Beam
+# Only the values that differ from the defaults. The defaults and their
+# descriptions live in balance_beam/conf.py (DEFAULTS).
+BALANCE_BEAM = {}
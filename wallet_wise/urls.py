@@ -20,6 +20,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 from balance_beam.common import admin_site
+from balance_beam.views import metrics_view
 
 for (
     model,
@@ -34,4 +35,5 @@ urlpatterns = [
     path("api/v1/", include("balance_beam.api_v1")),
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("metrics", metrics_view, name="metrics"),
 ]